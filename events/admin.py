@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import PrivateEvent, PublicEvent, Guest, UserProfile, ContactMessage
+from .models import PrivateEvent, PublicEvent, Guest, UserProfile, ContactMessage, OutboundEmail, SeatHold, WaitlistEntry, Checkout
 
 @admin.register(PrivateEvent)
 class PrivateEventAdmin(admin.ModelAdmin):
@@ -20,3 +20,29 @@ class UserProfileAdmin(admin.ModelAdmin):
 @admin.register(ContactMessage)
 class ContactMessageAdmin(admin.ModelAdmin):
     list_display = ('name', 'email', 'created_at')
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('to_email', 'kind', 'priority', 'status', 'attempts', 'next_attempt_at')
+    list_filter = ('status', 'kind')
+
+    def get_exclude(self, request, obj=None):
+        # Données d'un email de code 2FA : jamais affichées
+        if obj is not None and obj.kind == OutboundEmail.KIND_TWO_FACTOR_CODE:
+            return ('payload',)
+        return super().get_exclude(request, obj)
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'event', 'status', 'created_at', 'promoted_at')
+    list_filter = ('status',)
+
+@admin.register(SeatHold)
+class SeatHoldAdmin(admin.ModelAdmin):
+    list_display = ('user', 'event', 'expires_at')
+
+@admin.register(Checkout)
+class CheckoutAdmin(admin.ModelAdmin):
+    list_display = ('user', 'event', 'amount', 'status', 'transaction_id', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('idempotency_key', 'transaction_id')
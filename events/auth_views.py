@@ -1,4 +1,6 @@
 import json
+import logging
+import time
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate, get_user_model
 from django.contrib.auth.decorators import login_required
@@ -12,13 +14,14 @@ from django.db import transaction
 
 from .models import TwoFactorAuth, TwoFactorCode
 from .forms import TwoFactorVerificationForm, Toggle2FAForm
+from .utils.trace import trace
+
+logger = logging.getLogger(__name__)
 
 def two_factor_verify(request):
     """
     Affiche le formulaire de vérification 2FA avec gestion améliorée des erreurs
     """
-    print("=== DEBUG: Début de two_factor_verify ===")
-    
     # Vérifier si l'utilisateur a une session 2FA en attente
     pending_user_id = request.session.get('pending_2fa_user_id')
     user = None
@@ -29,7 +32,7 @@ def two_factor_verify(request):
         try:
             user = User.objects.get(id=pending_user_id)
             two_fa, created = TwoFactorAuth.objects.get_or_create(user=user)
-            print(f"DEBUG: Utilisateur trouvé: {user.username}, 2FA activée: {two_fa.is_enabled}")
+            trace('2fa.verify.pending_user', user_id=user.pk, enabled=two_fa.is_enabled)
             
             # Si la 2FA n'est pas activée, connecter l'utilisateur directement
             if not two_fa.is_enabled:
@@ -40,7 +43,7 @@ def two_factor_verify(request):
                 return redirect('dashboard')
                 
         except (User.DoesNotExist, KeyError) as e:
-            print(f"DEBUG: Erreur utilisateur: {str(e)}")
+            trace('2fa.verify.unknown_user', logging.WARNING, user_id=pending_user_id, error=str(e))
             if 'pending_2fa_user_id' in request.session:
                 del request.session['pending_2fa_user_id']
             return redirect('login')
@@ -48,14 +51,14 @@ def two_factor_verify(request):
         # Si l'utilisateur est déjà authentifié mais n'a pas de session 2FA en attente
         user = request.user
         two_fa, created = TwoFactorAuth.objects.get_or_create(user=user)
-        print(f"DEBUG: Utilisateur déjà authentifié: {user.username}")
+        trace('2fa.verify.authenticated_user', user_id=user.pk, enabled=two_fa.is_enabled)
         
         # Si la 2FA n'est pas activée, rediriger vers le tableau de bord
         if not two_fa.is_enabled:
             return redirect('dashboard')
     else:
         # Si aucun utilisateur n'est authentifié et aucune session 2FA en attente
-        print("DEBUG: Aucun utilisateur trouvé, redirection vers login")
+        trace('2fa.verify.no_user')
         return redirect('login')
     
     # Si l'utilisateur a une session 2FA valide, rediriger
@@ -67,28 +70,30 @@ def two_factor_verify(request):
             del request.session['pending_2fa_user_id']
         return redirect(next_url)
     
+    # Trop de codes erronés : plus de vérification ni d'envoi jusqu'à la fin de la fenêtre
+    wait = two_fa.verify_retry_after()
+    if wait:
+        trace('2fa.verify.locked', logging.WARNING, user_id=user.pk, retry_after=wait)
+        return _two_factor_locked(request, user, wait)
+
     # Gestion de la soumission du formulaire
     if request.method == 'POST':
-        print("DEBUG: Requête POST reçue")
         form = TwoFactorVerificationForm(request.POST)
         if form.is_valid():
             code = form.cleaned_data['code']
-            print(f"DEBUG: Code reçu: {code}")
-            
             # Vérifier le code
             try:
                 two_fa = TwoFactorAuth.objects.get(user=user)
                 if two_fa.verify_code(code):
-                    print("DEBUG: Code valide")
-                    # Marquer la session comme vérifiée
-                    request.session['2fa_verified'] = True
-                    request.session['2fa_verified_at'] = timezone.now().isoformat()
-                    
+                    trace('2fa.verify.accepted', user_id=user.pk)
                     # Connecter l'utilisateur s'il n'est pas déjà connecté
                     if not request.user.is_authenticated:
                         user.backend = 'django.contrib.auth.backends.ModelBackend'
                         login(request, user)
                     
+                    # Marquer la session comme vérifiée
+                    mark_two_factor_verified(request)
+                    
                     if 'pending_2fa_user_id' in request.session:
                         del request.session['pending_2fa_user_id']
                     
@@ -100,23 +105,25 @@ def two_factor_verify(request):
                     messages.success(request, 'Connexion réussie avec authentification à deux facteurs.')
                     return redirect(next_url)
                 else:
-                    print("DEBUG: Code invalide")
+                    trace('2fa.verify.rejected', logging.INFO, user_id=user.pk)
+                    wait = two_fa.verify_retry_after()
+                    if wait:
+                        return _two_factor_locked(request, user, wait)
                     messages.error(request, 'Code de vérification invalide ou expiré.')
             except TwoFactorAuth.DoesNotExist:
-                print("DEBUG: Erreur - TwoFactorAuth n'existe pas")
+                logger.error(f"Configuration 2FA introuvable pour l'utilisateur {user.pk}")
                 messages.error(request, "Une erreur s'est produite. Veuillez réessayer.")
     else:
         form = TwoFactorVerificationForm()
     
-    # Envoyer un nouveau code si nécessaire
+    # Envoyer un code si aucun code valable n'a déjà été envoyé
+    # (un nouveau code ne s'obtient que via resend_verification_code ou après expiration)
     code_sent = False
     try:
-        two_fa = TwoFactorAuth.objects.get(user=user)
-        print(f"DEBUG: Envoi du code à {user.email}")
         code_sent = two_fa.send_verification_email(request)
-        print(f"DEBUG: Code envoyé: {code_sent}")
+        trace('2fa.verify.code_sent', user_id=user.pk, sent=code_sent)
     except Exception as e:
-        print(f"DEBUG: Erreur lors de l'envoi du code: {str(e)}")
+        logger.error(f"Erreur lors de l'envoi du code 2FA: {str(e)}")
     
     return render(request, 'registration/two_factor_verify.html', {
         'form': form,
@@ -124,6 +131,21 @@ def two_factor_verify(request):
         'code_sent': code_sent
     })
 
+def _two_factor_locked(request, user, wait):
+    """Vérification bloquée après trop de codes erronés (le code en cours est invalidé)"""
+    messages.error(
+        request,
+        f"Trop de codes erronés : ce code n'est plus valable. Réessayez dans {(wait + 59) // 60} minute(s).",
+    )
+    response = render(request, 'registration/two_factor_verify.html', {
+        'form': TwoFactorVerificationForm(),
+        'email': user.email,
+        'code_sent': False,
+    }, status=429)
+    response['Retry-After'] = str(wait)
+    return response
+
+
 @login_required
 def toggle_two_factor(request):
     """
@@ -143,6 +165,7 @@ def toggle_two_factor(request):
                 # Activer la 2FA et envoyer un code de vérification
                 two_fa.is_enabled = True
                 two_fa.save()
+                invalidate_two_factor_state(request)
                 two_fa.send_verification_email(request)
                 messages.success(request, 'Authentification à deux facteurs activée. Un code de vérification a été envoyé à votre adresse email.')
                 return redirect('two_factor_verify')
@@ -150,6 +173,7 @@ def toggle_two_factor(request):
                 # Désactiver la 2FA
                 two_fa.is_enabled = False
                 two_fa.save()
+                invalidate_two_factor_state(request)
                 messages.success(request, 'Authentification à deux facteurs désactivée avec succès.')
                 return redirect('profile')
     else:
@@ -161,64 +185,92 @@ def toggle_two_factor(request):
     })
 
 # Middleware pour vérifier la 2FA
+# Durée de validité d'une vérification 2FA
+TWO_FACTOR_VERIFIED_TTL = 24 * 60 * 60  # secondes
+
+# État 2FA mis en cache dans la session : [user_id, 2FA activée, vérifiée jusqu'à (epoch)]
+TWO_FACTOR_SESSION_KEY = '2fa_state'
+
+# Liste des URLs qui ne nécessitent pas de 2FA (un tuple : un seul appel à startswith)
+TWO_FACTOR_EXEMPT_PREFIXES = (
+    '/accounts/login/',
+    '/accounts/logout/',
+    '/accounts/password_reset/',
+    '/accounts/reset/',
+    '/admin/',
+    '/static/',
+    '/media/',
+    '/two-factor/verify/',
+    '/two-factor/resend-code/',
+)
+
+
+def mark_two_factor_verified(request):
+    """Marque la session comme vérifiée par la 2FA"""
+    now = timezone.now()
+    request.session['2fa_verified'] = True
+    request.session['2fa_verified_at'] = now.isoformat()
+    request.session[TWO_FACTOR_SESSION_KEY] = [request.user.pk, True, now.timestamp() + TWO_FACTOR_VERIFIED_TTL]
+
+
+def invalidate_two_factor_state(request):
+    """Force le middleware à relire la configuration 2FA au prochain appel"""
+    request.session.pop(TWO_FACTOR_SESSION_KEY, None)
+
+
+def _verified_until(session):
+    """Convertit l'ancienne clé `2fa_verified_at` (ISO) en epoch d'expiration"""
+    if not (session.get('2fa_verified', False) and session.get('2fa_verified_at')):
+        return 0
+    from datetime import datetime
+    from django.utils.timezone import make_aware
+
+    try:
+        verified_at = datetime.fromisoformat(session['2fa_verified_at'])
+        if not verified_at.tzinfo:
+            verified_at = make_aware(verified_at)
+        return verified_at.timestamp() + TWO_FACTOR_VERIFIED_TTL
+    except (ValueError, TypeError):
+        # En cas d'erreur de format de date, on force une nouvelle vérification
+        return 0
+
+
 class TwoFactorMiddleware:
     """
     Middleware pour gérer l'authentification à deux facteurs
-    La 2FA est obligatoire pour tous les utilisateurs
+    La 2FA est obligatoire pour tous les utilisateurs qui l'ont activée.
+    L'état 2FA est lu en base une seule fois puis gardé dans la session :
+    une page vue par un utilisateur déjà vérifié ne coûte aucune requête SQL.
     """
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        # Liste des URLs qui ne nécessitent pas de 2FA
-        exempt_urls = [
-            '/accounts/login/',
-            '/accounts/logout/',
-            '/accounts/password_reset/',
-            '/accounts/reset/',
-            '/admin/',
-            '/static/',
-            '/media/',
-            '/two-factor/verify/',
-            '/two-factor/resend-code/',
-        ]
-
         # Si l'URL est dans la liste des URLs exemptées, on ne fait rien
-        if any(request.path.startswith(url) for url in exempt_urls):
+        if request.path.startswith(TWO_FACTOR_EXEMPT_PREFIXES):
             return self.get_response(request)
 
         # Si l'utilisateur n'est pas authentifié, on ne fait rien
         if not request.user.is_authenticated:
             return self.get_response(request)
 
-        # Vérifier si l'utilisateur a une configuration 2FA
-        try:
-            two_fa = request.user.two_factor_auth
-        except TwoFactorAuth.DoesNotExist:
-            # Si l'utilisateur n'a pas de configuration 2FA, on en crée une activée
-            two_fa = TwoFactorAuth.objects.create(user=request.user, is_enabled=True)
-            # On redirige vers la page de vérification 2FA
-            request.session['pending_2fa_user_id'] = request.user.id
-            return redirect('two_factor_verify')
-
-        # Vérifier si la session 2FA est valide (moins de 24h)
-        two_fa_verified = request.session.get('2fa_verified', False)
-        two_fa_verified_at = request.session.get('2fa_verified_at')
-        
-        if two_fa_verified and two_fa_verified_at:
-            from datetime import datetime, timedelta
-            from django.utils.timezone import make_aware
-            
+        state = request.session.get(TWO_FACTOR_SESSION_KEY)
+        if not state or state[0] != request.user.pk:
+            # Vérifier si l'utilisateur a une configuration 2FA
             try:
-                verified_at = datetime.fromisoformat(two_fa_verified_at)
-                if not verified_at.tzinfo:
-                    verified_at = make_aware(verified_at)
-                    
-                if datetime.now(verified_at.tzinfo) - verified_at < timedelta(hours=24):
-                    return self.get_response(request)
-            except (ValueError, TypeError) as e:
-                # En cas d'erreur de format de date, on force une nouvelle vérification
-                pass
+                enabled = request.user.two_factor_auth.is_enabled
+            except TwoFactorAuth.DoesNotExist:
+                # Si l'utilisateur n'a pas de configuration 2FA, on en crée une activée
+                TwoFactorAuth.objects.create(user=request.user, is_enabled=True)
+                # On redirige vers la page de vérification 2FA
+                request.session['pending_2fa_user_id'] = request.user.id
+                return redirect('two_factor_verify')
+            state = [request.user.pk, enabled, _verified_until(request.session)]
+            request.session[TWO_FACTOR_SESSION_KEY] = state
+
+        # 2FA désactivée, ou session vérifiée depuis moins de 24h
+        if not state[1] or time.time() < state[2]:
+            return self.get_response(request)
 
         # Si on arrive ici, la 2FA est requise
         if 'pending_2fa_user_id' not in request.session:
@@ -235,7 +287,13 @@ def resend_verification_code(request):
         try:
             two_fa = request.user.two_factor_auth
             if two_fa.is_enabled:
-                code_sent = two_fa.send_verification_email(request)
+                if two_fa.verify_retry_after():
+                    return JsonResponse({'success': False, 'message': 'Trop de codes erronés. Veuillez réessayer plus tard.'}, status=429)
+                from .utils.two_factor_codes import code_send_limiter
+                wait = code_send_limiter().retry_after(request.user.id)
+                if wait:
+                    return JsonResponse({'success': False, 'message': f'Veuillez patienter {wait} secondes avant de demander un nouveau code.'}, status=429)
+                code_sent = two_fa.send_verification_email(request, force=True)
                 if code_sent:
                     return JsonResponse({'success': True, 'message': 'Un nouveau code a été envoyé à votre adresse email.'})
                 else:
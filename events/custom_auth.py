@@ -1,4 +1,4 @@
-from django.contrib.auth import login as auth_login, authenticate, get_user_model
+from django.contrib.auth import login as auth_login, get_user_model
 from django.contrib.auth.forms import AuthenticationForm
 from django.shortcuts import redirect, render
 from django.contrib import messages
@@ -18,9 +18,9 @@ def login_with_2fa(request):
     if request.method == 'POST':
         form = AuthenticationForm(request, data=request.POST)
         if form.is_valid():
-            username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password')
-            user = authenticate(username=username, password=password)
+            # Le formulaire a déjà authentifié l'utilisateur (hash du mot de passe) :
+            # on réutilise son résultat au lieu de refaire un authenticate()
+            user = form.get_user()
             
             if user is not None:
                 # Créer ou récupérer la configuration 2FA
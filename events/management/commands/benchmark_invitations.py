@@ -0,0 +1,54 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from events.models import PrivateEvent
+from events.utils.email_utils import PrivateEventInvitationRenderer
+
+
+class Command(BaseCommand):
+    help = "Compare le rendu des invitations : template rendu par invité vs rendu pré-calculé par événement"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help="Nombre d'invitations à rendre")
+
+    def handle(self, *args, **options):
+        count = options['count']
+        # Objets non sauvegardés : le benchmark ne touche pas à la base
+        owner = User(username='bench', email='bench@example.com')
+        event = PrivateEvent(
+            owner=owner,
+            title='Benchmark',
+            description='Rendu des invitations ' * 10,
+            date=timezone.now() + timedelta(days=7),
+            location='Tunis',
+        )
+        urls = [f"https://example.com/rsvp/{uuid.uuid4()}/" for _ in range(count)]
+
+        start = time.perf_counter()
+        for url in urls:
+            # Ancien chemin : template + texte brut reconstruits pour chaque invité
+            render_to_string(PrivateEventInvitationRenderer.template_name, {
+                'event': event,
+                'rsvp_url': url,
+                'site_name': 'Smart Event',
+                'current_year': timezone.now().year,
+            })
+            f"{event.title} {event.date.strftime('%A %d %B %Y à %H:%M')} {event.location} {url}"
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        renderer = PrivateEventInvitationRenderer(event)
+        for url in urls:
+            renderer.render(url)
+        precompiled = time.perf_counter() - start
+
+        self.stdout.write(f"{count} invitations")
+        self.stdout.write(f"  Rendu par invité     : {legacy * 1000:.1f} ms")
+        self.stdout.write(f"  Rendu par événement  : {precompiled * 1000:.1f} ms")
+        self.stdout.write(f"  Gain                 : x{legacy / precompiled:.1f}")
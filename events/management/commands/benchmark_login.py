@@ -0,0 +1,39 @@
+import os
+import time
+
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Mesure le débit de connexions par cœur pour chaque hasher de PASSWORD_HASHERS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help="Vérifications de mot de passe par hasher")
+        parser.add_argument('--password', default='Sm4rt-Event-Bench!', help="Mot de passe utilisé pour la mesure")
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        password = options['password']
+        cores = os.cpu_count() or 1
+
+        self.stdout.write(f"{iterations} vérifications par hasher, {cores} cœur(s) disponible(s)")
+        for position, hasher in enumerate(get_hashers()):
+            try:
+                encoded = hasher.encode(password, hasher.salt())
+            except ValueError as e:
+                # Hasher configuré mais bibliothèque absente (argon2-cffi, bcrypt...)
+                self.stdout.write(f"  {hasher.algorithm:<22} : ignoré ({str(e)})")
+                continue
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                hasher.verify(password, encoded)
+            per_check = (time.perf_counter() - start) / iterations
+
+            per_core = 1 / per_check if per_check else float('inf')
+            role = "actif" if position == 0 else "vérification seulement"
+            self.stdout.write(
+                f"  {hasher.algorithm:<22} ({role}) : {per_check * 1000:7.1f} ms/connexion, "
+                f"{per_core:7.1f} connexions/s/cœur, ~{per_core * cores:7.1f} connexions/s sur {cores} cœur(s)"
+            )
@@ -0,0 +1,89 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from events.models import PublicEvent
+from events.utils.search import search_events, uses_fts
+
+WORDS = (
+    "concert festival conférence atelier marathon salon exposition théâtre cinéma jazz "
+    "rock danse gastronomie startup tech python django design photo yoga randonnée "
+    "tunis sfax sousse bizerte carthage hammamet monastir nabeul djerba tozeur "
+    "soirée matinée gala tournoi rencontre séminaire formation hackathon brunch dégustation"
+).split()
+QUERIES = ['jazz', 'conf', 'tunis', 'festival rock', 'atel pyth', 'dégustation sousse', 'gal', 'zorbi']
+# Vocabulaire de remplissage des descriptions, pour une distribution de mots réaliste
+FILLER_SIZE = 20_000
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure la recherche d'événements publics sur un jeu de données synthétique "
+        "(créé dans une transaction annulée à la fin) : index plein texte contre icontains"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=100_000, help="Événements synthétiques")
+        parser.add_argument('--repeat', type=int, default=20, help="Exécutions par requête")
+        parser.add_argument('--limit', type=int, default=20, help="Résultats chargés par recherche")
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        letters = 'abcdefghijklmnopqrstuvwxyzéè'
+        filler = [''.join(rng.choices(letters, k=rng.randint(3, 10))) for _ in range(FILLER_SIZE)]
+        with transaction.atomic():
+            owner = User.objects.create_user('benchmark-search', 'benchmark-search@example.com')
+            start = time.perf_counter()
+            now = timezone.now()
+            PublicEvent.objects.bulk_create(
+                (
+                    PublicEvent(
+                        owner=owner,
+                        title=' '.join(rng.choices(WORDS, k=3)).capitalize(),
+                        description=' '.join(rng.choices(WORDS, k=2) + rng.choices(filler, k=30)),
+                        location=rng.choice(WORDS).capitalize(),
+                        date=now + timedelta(hours=i),
+                    )
+                    for i in range(options['events'])
+                ),
+                batch_size=2000,
+            )
+            self.stdout.write(
+                f"{options['events']} événements créés et indexés en {time.perf_counter() - start:.1f} s "
+                f"({'FTS5' if uses_fts() else 'index inversé'})"
+            )
+
+            limit = options['limit']
+            upcoming = PublicEvent.objects.filter(date__gte=now).order_by('date')
+            for query in QUERIES:
+                ranked = self._measure(
+                    lambda: list(search_events(PublicEvent.objects.all(), query)[:limit]), options['repeat'])
+                listed = self._measure(
+                    lambda: list(search_events(upcoming, query, ranked=False)[:limit]), options['repeat'])
+                scan = self._measure(lambda: list(upcoming.filter(
+                    Q(title__icontains=query) | Q(description__icontains=query) | Q(location__icontains=query)
+                )[:limit]), options['repeat'])
+                verdict = "✅" if max(ranked[1], listed[1]) < 10 else "⚠️"
+                self.stdout.write(
+                    f"  {verdict} {query!r:<22} classé : p50 {ranked[0]:6.2f} / p95 {ranked[1]:6.2f} ms"
+                    f" | par date : p50 {listed[0]:6.2f} / p95 {listed[1]:6.2f} ms"
+                    f" | icontains : p50 {scan[0]:7.2f} ms"
+                )
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _measure(run, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from events.utils.email_queue import process_queue, purge_finished
+
+# Purge des emails envoyés ou abandonnés au plus une fois par heure
+PURGE_INTERVAL = 60 * 60  # secondes
+
+
+class Command(BaseCommand):
+    help = "Vide la file d'attente des emails sortants (invitations, codes 2FA, confirmations)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Traite un seul lot puis s'arrête")
+        parser.add_argument('--batch-size', type=int, default=None, help="Nombre d'emails par lot")
+        parser.add_argument('--sleep', type=float, default=2.0, help="Pause (secondes) quand la file est vide")
+
+    def purge(self):
+        purged = purge_finished()
+        if purged:
+            self.stdout.write(f"🧹 {purged} email(s) envoyé(s) ou abandonné(s) supprimé(s)")
+
+    def handle(self, *args, **options):
+        self.stdout.write("📬 Worker de la file d'emails démarré")
+        self.purge()
+        last_purge = time.monotonic()
+        try:
+            while True:
+                sent, failed = process_queue(batch_size=options['batch_size'])
+                if sent or failed:
+                    self.stdout.write(f"{sent} email(s) envoyé(s), {failed} échec(s)")
+                if options['once']:
+                    break
+                if not (sent or failed):
+                    if time.monotonic() - last_purge >= PURGE_INTERVAL:
+                        self.purge()
+                        last_purge = time.monotonic()
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write("Arrêt du worker")
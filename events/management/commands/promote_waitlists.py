@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from events.utils.waitlist import PROMOTION_BATCH_SIZE, promote_all
+
+
+class Command(BaseCommand):
+    help = "Attribue les places libres aux premiers des listes d'attente (rattrapage des promotions manquées)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PROMOTION_BATCH_SIZE,
+                            help="Inscriptions promues par transaction")
+
+    def handle(self, *args, **options):
+        promoted = promote_all(options['batch_size'])
+        self.stdout.write(f"⏳ {promoted} inscription(s) en liste d'attente traitée(s)")
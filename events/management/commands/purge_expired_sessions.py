@@ -0,0 +1,30 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = "Supprime les sessions expirées par petits lots (le verrou d'écriture SQLite est relâché entre deux lots)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Sessions supprimées par lot")
+        parser.add_argument('--sleep', type=float, default=0.0, help="Pause (secondes) entre deux lots")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+        total = 0
+        while True:
+            keys = list(
+                Session.objects.filter(expire_date__lt=now)
+                .values_list('session_key', flat=True)[:batch_size]
+            )
+            if not keys:
+                break
+            deleted, _ = Session.objects.filter(session_key__in=keys).delete()
+            total += deleted
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(f"🧹 {total} session(s) expirée(s) supprimée(s)")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from events.models import PrivateEvent, PublicEvent
+from events.utils.search import rebuild_index, uses_fts
+
+
+class Command(BaseCommand):
+    help = "Reconstruit l'index de recherche plein texte des événements (FTS5 ou index inversé)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Événements indexés par lot")
+
+    def handle(self, *args, **options):
+        backend = "FTS5" if uses_fts() else "index inversé"
+        for model in (PrivateEvent, PublicEvent):
+            total = rebuild_index(model, batch_size=options['batch_size'])
+            self.stdout.write(f"🔎 {total} {model._meta.verbose_name_plural.lower()} indexé(s) ({backend})")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from events.models import PrivateEvent, PublicEvent
+from events.utils import stats
+from events.utils.counters import recount_events
+
+
+class Command(BaseCommand):
+    help = "Recalcule les statistiques agrégées (événements et participations par jour et par mois)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recount', action='store_true',
+            help="Recompte d'abord les compteurs de participation des événements",
+        )
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            for model in (PrivateEvent, PublicEvent):
+                total = recount_events(model)
+                self.stdout.write(f"🔢 {total} {model._meta.verbose_name_plural.lower()} recompté(s)")
+        rows = stats.rebuild()
+        self.stdout.write(f"📊 {rows} ligne(s) de statistiques recalculée(s)")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from events.utils.guests import reconcile_guest_users
+
+
+class Command(BaseCommand):
+    help = "Rattache les invités sans compte aux utilisateurs inscrits avec la même adresse email"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Invités traités par lot")
+
+    def handle(self, *args, **options):
+        linked = reconcile_guest_users(batch_size=options['batch_size'])
+        self.stdout.write(f"🔗 {linked} invité(s) rattaché(s) à un compte")
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from events.models import PrivateEvent, PublicEvent
+from events.utils import stats
+from events.utils.counters import recount_events
+
+
+class Command(BaseCommand):
+    help = "Recalcule les compteurs de participation (acceptés, payés, RSVP) des événements, par lots"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Événements recomptés par lot")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model in (PrivateEvent, PublicEvent):
+            total = 0
+            last_id = 0
+            while True:
+                ids = list(
+                    model.objects.filter(id__gt=last_id).order_by('id')
+                    .values_list('id', flat=True)[:batch_size]
+                )
+                if not ids:
+                    break
+                total += recount_events(model, ids)
+                last_id = ids[-1]
+            self.stdout.write(f"🔢 {total} {model._meta.verbose_name_plural.lower()} recompté(s)")
+        # Les participations agrégées suivent les compteurs recomptés
+        self.stdout.write(f"📊 {stats.rebuild()} ligne(s) de statistiques recalculée(s)")
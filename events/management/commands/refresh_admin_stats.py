@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from events.utils.admin_stats import refresh_snapshot
+
+
+class Command(BaseCommand):
+    help = "Recalcule l'instantané du tableau de bord administrateur (à lancer périodiquement)"
+
+    def handle(self, *args, **options):
+        snapshot = refresh_snapshot()
+        self.stdout.write(f"📊 Instantané recalculé : {snapshot['data']['total_events']} événement(s)")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from events.utils.checkout import resolve_stale_checkouts
+
+
+class Command(BaseCommand):
+    help = "Solde les paiements restés en cours (débit remboursé) ; à lancer périodiquement"
+
+    def handle(self, *args, **options):
+        resolved = resolve_stale_checkouts()
+        self.stdout.write(f"💳 {resolved} paiement(s) en suspens soldé(s)")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from events.utils.capacity import sweep_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Libère les places retenues expirées (à lancer périodiquement) et fait avancer les listes d'attente"
+
+    def handle(self, *args, **options):
+        released = sweep_expired_holds()
+        self.stdout.write(f"🎟️ {released} place(s) retenue(s) expirée(s) libérée(s)")
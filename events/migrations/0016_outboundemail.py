@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:01
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0015_alter_twofactorauth_is_enabled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('private_invitation', 'Invitation à un événement privé'), ('rsvp_confirmation', 'Confirmation RSVP'), ('two_factor_code', 'Code 2FA'), ('plain', 'Email simple')], max_length=30)),
+                ('priority', models.PositiveSmallIntegerField(choices=[(0, 'Haute'), (5, 'Normale'), (9, 'Envoi en masse')], default=5)),
+                ('status', models.CharField(choices=[('pending', 'En attente'), ('sending', 'En cours'), ('sent', 'Envoyé'), ('dead', 'Abandonné')], default='pending', max_length=10)),
+                ('to_email', models.EmailField(max_length=254)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Email sortant',
+                'verbose_name_plural': 'Emails sortants',
+                'ordering': ['priority', 'next_attempt_at', 'id'],
+                'indexes': [models.Index(fields=['status', 'priority', 'next_attempt_at'], name='events_outb_status_a5487a_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def backfill_email_normalized(apps, schema_editor):
+    """Remplit email_normalized pour les invités existants, par lots"""
+    Guest = apps.get_model('events', 'Guest')
+
+    last_id = 0
+    while True:
+        batch = list(
+            Guest.objects.filter(id__gt=last_id).order_by('id').only('id', 'email')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for guest in batch:
+            guest.email_normalized = (guest.email or '').strip().lower()
+        Guest.objects.bulk_update(batch, ['email_normalized'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0016_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='guest',
+            name='email_normalized',
+            field=models.EmailField(default='', editable=False, max_length=254),
+        ),
+        migrations.RunPython(backfill_email_normalized, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='guest',
+            index=models.Index(fields=['email_normalized', 'status'], name='guest_email_norm_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='guest',
+            index=models.Index(fields=['email_normalized', 'event_private'], name='guest_email_norm_priv_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='guest',
+            index=models.Index(fields=['email_normalized', 'event_public'], name='guest_email_norm_pub_idx'),
+        ),
+    ]
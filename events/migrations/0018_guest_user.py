@@ -0,0 +1,50 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+BATCH_SIZE = 500
+
+
+def link_existing_guests(apps, schema_editor):
+    """Rattache les invités existants aux comptes de même email, par lots"""
+    Guest = apps.get_model('events', 'Guest')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+    last_id = 0
+    while True:
+        batch = list(
+            Guest.objects.filter(id__gt=last_id, user__isnull=True)
+            .order_by('id').only('id', 'email_normalized')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        users = dict(
+            User.objects.annotate(email_lower=Lower('email'))
+            .filter(email_lower__in={g.email_normalized for g in batch})
+            .order_by('-id').values_list('email_lower', 'id')
+        )
+        linked = [g for g in batch if users.get(g.email_normalized)]
+        for guest in linked:
+            guest.user_id = users[guest.email_normalized]
+        Guest.objects.bulk_update(linked, ['user'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0017_guest_email_normalized'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='guest',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='guest_entries', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(link_existing_guests, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:23
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 500
+
+
+def _count(model, fk, **filters):
+    subquery = (
+        model.objects.filter(**{fk: OuterRef('pk')}, **filters)
+        .order_by().values(fk).annotate(c=Count('pk')).values('c')
+    )
+    return Coalesce(Subquery(subquery), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    """Initialise les compteurs de chaque événement, par lots d'ids"""
+    Guest = apps.get_model('events', 'Guest')
+    RSVP = apps.get_model('events', 'RSVP')
+    for model_name, fk in (('PrivateEvent', 'event_private'), ('PublicEvent', 'event_public')):
+        Event = apps.get_model('events', model_name)
+        last_id = 0
+        while True:
+            ids = list(Event.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+            if not ids:
+                break
+            Event.objects.filter(id__in=ids).update(
+                accepted_count=_count(Guest, fk, status='accepted'),
+                paid_count=_count(Guest, fk, payment_status='paid'),
+                rsvp_yes_count=_count(RSVP, fk, response='yes'),
+            )
+            last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0018_guest_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='privateevent',
+            name='accepted_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='privateevent',
+            name='paid_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='privateevent',
+            name='rsvp_yes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='publicevent',
+            name='accepted_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='publicevent',
+            name='paid_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='publicevent',
+            name='rsvp_yes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:27
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+EVENT_TABLES = {'PrivateEvent': 'private', 'PublicEvent': 'public'}
+FIELD_WEIGHTS = {'title': 10, 'location': 5, 'description': 1}
+
+
+def _has_fts5(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return any(row[0] == 'ENABLE_FTS5' for row in cursor.fetchall())
+
+
+def _tokenize(text):
+    folded = unicodedata.normalize('NFKD', (text or '').lower())
+    return re.findall(r'\w+', ''.join(c for c in folded if not unicodedata.combining(c)))
+
+
+def build_search_index(apps, schema_editor):
+    """
+    SQLite : crée et remplit une table FTS5 par type d'événement.
+    Autres moteurs : remplit l'index inversé SearchTerm, par lots.
+    """
+    connection = schema_editor.connection
+    SearchTerm = apps.get_model('events', 'SearchTerm')
+    for model_name, kind in EVENT_TABLES.items():
+        Event = apps.get_model('events', model_name)
+        table = Event._meta.db_table
+        if _has_fts5(connection):
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {table}_fts USING fts5("
+                f"title, description, location, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            schema_editor.execute(
+                f"INSERT INTO {table}_fts (rowid, title, description, location) "
+                f"SELECT id, title, description, location FROM {table}"
+            )
+            continue
+
+        last_id = 0
+        while True:
+            batch = list(
+                Event.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'title', 'description', 'location')[:BATCH_SIZE]
+            )
+            if not batch:
+                break
+            terms = []
+            for event_id, title, description, location in batch:
+                weights = {}
+                for field, value in (('title', title), ('description', description), ('location', location)):
+                    for word in _tokenize(value):
+                        weights[word] = max(weights.get(word, 0), FIELD_WEIGHTS[field])
+                terms += [SearchTerm(kind=kind, event_id=event_id, term=word[:64], weight=weight)
+                          for word, weight in weights.items()]
+            SearchTerm.objects.bulk_create(terms)
+            last_id = batch[-1][0]
+
+
+def drop_search_index(apps, schema_editor):
+    if _has_fts5(schema_editor.connection):
+        for model_name in EVENT_TABLES:
+            table = apps.get_model('events', model_name)._meta.db_table
+            schema_editor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0019_attendance_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('private', 'Privé'), ('public', 'Public')], max_length=7)),
+                ('event_id', models.PositiveBigIntegerField()),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveSmallIntegerField(default=1)),
+            ],
+            options={
+                'verbose_name': 'Terme de recherche',
+                'verbose_name_plural': 'Termes de recherche',
+                'indexes': [models.Index(fields=['kind', 'term'], name='search_term_kind_term_idx'), models.Index(fields=['kind', 'event_id'], name='search_term_kind_event_idx')],
+            },
+        ),
+        migrations.RunPython(build_search_index, drop_search_index),
+    ]
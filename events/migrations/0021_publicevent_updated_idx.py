@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0020_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='publicevent',
+            index=models.Index(fields=['updated_at'], name='publicevent_updated_idx'),
+        ),
+    ]
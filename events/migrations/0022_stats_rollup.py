@@ -0,0 +1,87 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:53
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import Greatest, TruncDate, TruncMonth
+
+BATCH_SIZE = 500
+
+
+def fill_stats(apps, schema_editor):
+    """Initialise participants_count (par lots d'ids) puis les agrégats par jour et par mois"""
+    EventStat = apps.get_model('events', 'EventStat')
+    rows = []
+    for model_name, kind in (('PrivateEvent', 'private'), ('PublicEvent', 'public')):
+        Event = apps.get_model('events', model_name)
+        if kind == 'private':
+            participants = F('accepted_count')
+        else:
+            participants = F('rsvp_yes_count') + Greatest('accepted_count', 'paid_count')
+        last_id = 0
+        while True:
+            ids = list(Event.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+            if not ids:
+                break
+            Event.objects.filter(id__in=ids).update(participants_count=participants)
+            last_id = ids[-1]
+
+        for period, trunc in (('day', TruncDate('date')), ('month', TruncMonth('date', output_field=DateField()))):
+            aggregates = Event.objects.annotate(start=trunc).order_by().values('start').annotate(
+                n=Count('pk'), participations=Sum(F('accepted_count') + F('rsvp_yes_count')),
+            )
+            rows += [
+                EventStat(period=period, period_start=row['start'], kind=kind,
+                          events=row['n'], participations=row['participations'] or 0)
+                for row in aggregates
+            ]
+    EventStat.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0021_publicevent_updated_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Jour'), ('month', 'Mois')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('kind', models.CharField(choices=[('private', 'Privé'), ('public', 'Public')], max_length=7)),
+                ('events', models.IntegerField(default=0)),
+                ('participations', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Statistique agrégée',
+                'verbose_name_plural': 'Statistiques agrégées',
+            },
+        ),
+        migrations.AddField(
+            model_name='privateevent',
+            name='participants_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='publicevent',
+            name='participants_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='privateevent',
+            index=models.Index(fields=['-participants_count'], name='privateevent_participants_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='publicevent',
+            index=models.Index(fields=['-participants_count'], name='publicevent_participants_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='eventstat',
+            constraint=models.UniqueConstraint(fields=('period', 'period_start', 'kind'), name='event_stat_unique_period'),
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:06
+
+import django.db.models.deletion
+import events.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0022_stats_rollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboundemail',
+            name='kind',
+            field=models.CharField(choices=[('private_invitation', 'Invitation à un événement privé'), ('rsvp_confirmation', 'Confirmation RSVP'), ('two_factor_code', 'Code 2FA'), ('waitlist_promotion', "Place attribuée (liste d'attente)"), ('plain', 'Email simple')], max_length=30),
+        ),
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('waiting', 'En attente'), ('promoted', 'Place attribuée'), ('cancelled', 'Annulée')], default='waiting', max_length=10)),
+                ('sequence', models.BigIntegerField(default=events.models.waitlist_sequence, editable=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('promoted_at', models.DateTimeField(blank=True, null=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='events.publicevent')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': "Inscription en liste d'attente",
+                'verbose_name_plural': "Liste d'attente",
+                'indexes': [models.Index(fields=['event', 'status', 'sequence', 'id'], name='waitlist_queue_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'waiting')), fields=('event', 'user'), name='waitlist_one_waiting_entry')],
+            },
+        ),
+    ]
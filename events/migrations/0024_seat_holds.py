@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0023_waitlist'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_holds', to='events.publicevent')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_holds', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Place retenue',
+                'verbose_name_plural': 'Places retenues',
+                'indexes': [models.Index(fields=['event', 'expires_at'], name='seat_hold_event_expiry_idx'), models.Index(fields=['expires_at'], name='seat_hold_expiry_idx')],
+                'constraints': [models.UniqueConstraint(fields=('event', 'user'), name='seat_hold_one_per_user')],
+            },
+        ),
+    ]
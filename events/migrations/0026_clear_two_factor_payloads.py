@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:32
+
+from django.db import migrations
+
+
+def clear_two_factor_payloads(apps, schema_editor):
+    """Efface les codes 2FA écrits en clair dans la file ; ceux encore en attente sont abandonnés"""
+    OutboundEmail = apps.get_model('events', 'OutboundEmail')
+    codes = OutboundEmail.objects.filter(kind='two_factor_code')
+    codes.exclude(status='sent').update(status='dead', locked_at=None, last_error="Code retiré de la file")
+    codes.update(payload={})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0025_checkouts'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_two_factor_payloads, migrations.RunPython.noop),
+    ]
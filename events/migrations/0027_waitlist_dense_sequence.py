@@ -0,0 +1,51 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def renumber_waitlists(apps, schema_editor):
+    """Rangs d'arrivée existants (horloge) renumérotés 1, 2, 3... par événement, dans le même ordre"""
+    PublicEvent = apps.get_model('events', 'PublicEvent')
+    WaitlistEntry = apps.get_model('events', 'WaitlistEntry')
+    event_ids = WaitlistEntry.objects.values_list('event_id', flat=True).distinct()
+    for event_id in list(event_ids):
+        entries = list(WaitlistEntry.objects.filter(event_id=event_id).order_by('sequence', 'id'))
+        for rank, entry in enumerate(entries, start=1):
+            entry.sequence = rank
+        WaitlistEntry.objects.bulk_update(entries, ['sequence'])
+        PublicEvent.objects.filter(pk=event_id).update(waitlist_tail=len(entries))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0026_clear_two_factor_payloads'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='waitlistentry',
+            name='waitlist_queue_idx',
+        ),
+        migrations.AddField(
+            model_name='publicevent',
+            name='waitlist_tail',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(renumber_waitlists, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='waitlistentry',
+            name='sequence',
+            field=models.PositiveBigIntegerField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistentry',
+            index=models.Index(fields=['event', 'status', 'sequence'], name='waitlist_queue_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='waitlistentry',
+            constraint=models.UniqueConstraint(fields=('event', 'sequence'), name='waitlist_unique_sequence'),
+        ),
+    ]
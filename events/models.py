@@ -1,5 +1,8 @@
-from django.db import models
+import logging
+
+from django.db import models, router, transaction
 from django.contrib.auth.models import User
+import time
 import uuid
 import random
 import string
@@ -7,6 +10,8 @@ from django.utils import timezone
 from django.core.mail import send_mail
 from django.conf import settings
 
+logger = logging.getLogger(__name__)
+
 # ==========================================================
 # 🔐 MODÈLE POUR L'AUTHENTIFICATION 2FA
 # ==========================================================
@@ -25,70 +30,90 @@ class TwoFactorAuth(models.Model):
         """Génère un code de vérification à 6 chiffres"""
         return ''.join(random.choices(string.digits, k=6))
 
-    def send_verification_email(self, request=None):
-        """Envoie un email avec le code de vérification"""
+    def send_verification_email(self, request=None, force=False):
+        """
+        Envoie un email avec le code de vérification.
+        Un code encore valable est réutilisé (aucun email) sauf si `force` est vrai ;
+        chaque nouveau code passe par le limiteur d'envois de l'utilisateur (l'espacement
+        minimal ne s'applique qu'aux renvois demandés : sans code valable, le premier
+        envoi après une reconnexion rapide part quand même).
+        """
+        from .utils.trace import trace
+
         if not self.is_enabled:
-            print("DEBUG: 2FA non activée pour cet utilisateur")
+            trace('2fa.send_skipped', user_id=self.user_id, reason='disabled')
             return False
             
         try:
+            from .utils.two_factor_codes import code_send_limiter, code_ttl, get_code_store
+            store = get_code_store()
+            
+            # Le code déjà envoyé est toujours valable : rien à renvoyer
+            if not force and store.active_code(self.user_id):
+                trace('2fa.code_reused', user_id=self.user_id)
+                return True
+            
+            if not code_send_limiter().hit(self.user_id, debounce=force):
+                trace('2fa.send_skipped', logging.INFO, user_id=self.user_id, reason='rate_limited')
+                return False
+            
             # Générer un nouveau code
             verification_code = self.generate_code()
-            print(f"DEBUG: Génération du code: {verification_code}")
             
-            # Créer ou mettre à jour le code de vérification
-            TwoFactorCode.objects.filter(user=self.user).delete()
-            code = TwoFactorCode.objects.create(
-                user=self.user,
-                code=verification_code,
-                expires_at=timezone.now() + timezone.timedelta(minutes=15)
-            )
-            print(f"DEBUG: Code enregistré: {code}")
+            # Enregistrer le code (le précédent est invalidé)
+            store.issue(self.user_id, verification_code)
+            trace('2fa.code_issued', user_id=self.user_id, forced=force)
             
             # Envoyer l'email
             subject = 'Votre code de vérification à deux facteurs'
-            message = f'Votre code de vérification est : {verification_code}\n\nCe code est valable 15 minutes.'
             from_email = settings.DEFAULT_FROM_EMAIL
-            recipient_list = [self.user.email]
-            
-            print(f"DEBUG: Envoi de l'email à {recipient_list}")
-            print(f"DEBUG: De: {from_email}")
-            print(f"DEBUG: Sujet: {subject}")
-            print(f"DEBUG: Message: {message}")
             
+            # Le code passe devant les invitations en masse dans la file d'envoi ;
+            # il n'est pas stocké dans la file : relu dans le stockage des codes à l'envoi
+            from .utils.email_queue import enqueue_email
             try:
-                send_mail(
-                    subject,
-                    message,
-                    from_email,
-                    recipient_list,
-                    fail_silently=False,
+                enqueue_email(
+                    OutboundEmail.KIND_TWO_FACTOR_CODE,
+                    self.user.email,
+                    payload={'subject': subject, 'user_id': self.user_id, 'from_email': from_email},
+                    priority=OutboundEmail.PRIORITY_HIGH,
                 )
-                print("DEBUG: Email envoyé avec succès")
+                trace('2fa.email_queued', user_id=self.user_id)
                 return True
             except Exception as e:
-                print(f"ERREUR lors de l'envoi de l'email: {str(e)}")
+                logger.error(f"Erreur lors de la mise en file de l'email 2FA: {str(e)}")
                 return False
         except Exception as e:
-            print(f"ERREUR dans send_verification_email: {str(e)}")
+            logger.error(f"Erreur dans send_verification_email: {str(e)}")
             return False
 
+    def verify_retry_after(self):
+        """Secondes avant de pouvoir saisir un code après trop d'échecs (0 si autorisé)"""
+        from .utils.two_factor_codes import code_attempt_limiter
+
+        return code_attempt_limiter().retry_after(self.user_id)
+
     def verify_code(self, code):
-        """Vérifie si le code fourni est valide"""
-        try:
-            verification_code = TwoFactorCode.objects.get(
-                user=self.user,
-                code=code,
-                expires_at__gt=timezone.now(),
-                is_used=False
-            )
-            verification_code.is_used = True
-            verification_code.save()
-            self.last_verified = timezone.now()
-            self.save()
-            return True
-        except TwoFactorCode.DoesNotExist:
+        """
+        Vérifie si le code fourni est valide et le consomme.
+        Chaque échec est compté : à la limite, le code en cours est invalidé
+        et tout code est refusé jusqu'à la fin de la fenêtre (verify_retry_after)
+        """
+        from .utils.two_factor_codes import code_attempt_limiter, get_code_store
+
+        limiter = code_attempt_limiter()
+        if limiter.retry_after(self.user_id):
+            return False
+        store = get_code_store()
+        if not store.consume(self.user_id, code):
+            limiter.hit(self.user_id)
+            if limiter.retry_after(self.user_id):
+                store.revoke(self.user_id)
             return False
+        limiter.reset(self.user_id)
+        self.last_verified = timezone.now()
+        TwoFactorAuth.objects.filter(pk=self.pk).update(last_verified=self.last_verified)
+        return True
 
 
 class TwoFactorCode(models.Model):
@@ -122,6 +147,53 @@ class UserProfile(models.Model):
 # ==========================================================
 # 📅 MODÈLE DE BASE DES ÉVÉNEMENTS
 # ==========================================================
+class EventQuerySet(models.QuerySet):
+    """
+    Tient à jour l'index de recherche (utils/search.py) et les statistiques agrégées
+    (utils/stats.py) lors des opérations en masse, qui ne déclenchent pas les signaux post_save
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from .utils import stats
+        from .utils.search import index_events
+        created = super().bulk_create(objs, *args, **kwargs)
+        index_events(self.model, [obj.pk for obj in created if obj.pk is not None])
+        stats.events_created(self.model, created)
+        for obj in created:
+            obj._stats_date = obj.date
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        from .utils import stats
+        from .utils.search import INDEXED_FIELDS, index_events
+        objs = list(objs)
+        before = None
+        if 'date' in fields:
+            before = list(self.model._base_manager.filter(pk__in=[obj.pk for obj in objs]).values_list('pk', 'date'))
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if set(INDEXED_FIELDS).intersection(fields):
+            index_events(self.model, [obj.pk for obj in objs])
+        if before is not None:
+            stats.events_moved(self.model, before)
+            for obj in objs:
+                obj._stats_date = obj.date
+        return rows
+
+    def update(self, **kwargs):
+        from .utils import stats
+        from .utils.search import INDEXED_FIELDS, index_events
+        reindex = bool(set(INDEXED_FIELDS).intersection(kwargs))
+        if not reindex and 'date' not in kwargs:
+            return super().update(**kwargs)
+        before = list(self.values_list('pk', 'date'))
+        rows = super().update(**kwargs)
+        if reindex:
+            index_events(self.model, [pk for pk, _ in before])
+        if 'date' in kwargs:
+            stats.events_moved(self.model, before)
+        return rows
+
+
 class BaseEvent(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
@@ -139,9 +211,27 @@ class BaseEvent(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
 
+    # Compteurs dénormalisés, tenus à jour par Guest / RSVP (voir utils/counters.py)
+    # et réparables avec `manage.py recount_attendance`
+    accepted_count = models.PositiveIntegerField(default=0, editable=False)
+    paid_count = models.PositiveIntegerField(default=0, editable=False)
+    rsvp_yes_count = models.PositiveIntegerField(default=0, editable=False)
+    # Total affiché (statistiques, classement) : public = RSVP + max(acceptés, payés), privé = acceptés
+    participants_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = EventQuerySet.as_manager()
+
     class Meta:
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Date déjà comptée dans les statistiques (utils/stats.py), pour détecter un déplacement
+        if 'date' in field_names:
+            instance._stats_date = instance.date
+        return instance
+
     def __str__(self):
         return self.title
 
@@ -163,8 +253,8 @@ class BaseEvent(models.Model):
 
     @property
     def guest_count(self):
-        """Nombre d'invités acceptés"""
-        return self.guests.filter(status=Guest.STATUS_ACCEPTED).count()
+        """Nombre d'invités acceptés (compteur dénormalisé, sans requête)"""
+        return self.accepted_count
 
 
 # ==========================================================
@@ -177,6 +267,7 @@ class PrivateEvent(BaseEvent):
         indexes = [
             models.Index(fields=['owner', 'date']),
             models.Index(fields=['date']),
+            models.Index(fields=['-participants_count'], name='privateevent_participants_idx'),
         ]
 
 
@@ -199,6 +290,8 @@ class PublicEvent(BaseEvent):
         null=True,
         help_text="Nombre maximum de participants (laisser vide pour illimité)"
     )
+    # Dernier rang attribué dans la liste d'attente (incrémenté à chaque inscription)
+    waitlist_tail = models.PositiveBigIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name = "Événement public"
@@ -207,6 +300,9 @@ class PublicEvent(BaseEvent):
             models.Index(fields=['owner', 'date']),
             models.Index(fields=['date']),
             models.Index(fields=['is_paid']),
+            # ETag du flux JSON : MAX(updated_at) lu sur l'index
+            models.Index(fields=['updated_at'], name='publicevent_updated_idx'),
+            models.Index(fields=['-participants_count'], name='publicevent_participants_idx'),
         ]
 
     @property
@@ -221,10 +317,189 @@ class PublicEvent(BaseEvent):
         return f"{self.title} - {self.date.strftime('%d/%m/%Y')} ({paid_info})"
 
 
+# ==========================================================
+# 🔎 INDEX DE RECHERCHE (moteurs sans FTS5)
+# ==========================================================
+class SearchTerm(models.Model):
+    """
+    Index inversé portable : un mot (minuscules, sans accents) par événement et par ligne.
+    Sur SQLite, les tables virtuelles FTS5 le remplacent (voir utils/search.py).
+    """
+    KIND_CHOICES = [('private', 'Privé'), ('public', 'Public')]
+
+    kind = models.CharField(max_length=7, choices=KIND_CHOICES)
+    event_id = models.PositiveBigIntegerField()
+    term = models.CharField(max_length=64)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        verbose_name = "Terme de recherche"
+        verbose_name_plural = "Termes de recherche"
+        indexes = [
+            models.Index(fields=['kind', 'term'], name='search_term_kind_term_idx'),
+            models.Index(fields=['kind', 'event_id'], name='search_term_kind_event_idx'),
+        ]
+
+
+# ==========================================================
+# 📊 STATISTIQUES AGRÉGÉES
+# ==========================================================
+class EventStat(models.Model):
+    """
+    Agrégats par jour et par mois (date de l'événement) et par type d'événement,
+    tenus à jour à chaque écriture d'événement, d'invité ou de RSVP (utils/stats.py)
+    et recalculables avec `manage.py rebuild_stats`.
+    """
+    PERIOD_DAY = 'day'
+    PERIOD_MONTH = 'month'
+    PERIOD_CHOICES = [(PERIOD_DAY, 'Jour'), (PERIOD_MONTH, 'Mois')]
+
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    kind = models.CharField(max_length=7, choices=[('private', 'Privé'), ('public', 'Public')])
+    events = models.IntegerField(default=0)
+    # Invités acceptés + RSVP « oui »
+    participations = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Statistique agrégée"
+        verbose_name_plural = "Statistiques agrégées"
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start', 'kind'], name='event_stat_unique_period'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.period} {self.period_start} : {self.events} événement(s)"
+
+
 # ==========================================================
 # 👥 INVITÉS (GUESTS)
 # ==========================================================
-class Guest(models.Model):
+class CountedQuerySet(models.QuerySet):
+    """
+    Tient à jour les compteurs de participation des événements lors des
+    opérations en masse, qui ne passent pas par save() ni par les signaux
+    """
+    counted_fields = frozenset()
+
+    @staticmethod
+    def counter_state(obj):
+        raise NotImplementedError
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from .utils import counters
+        with transaction.atomic(using=self.db, savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            if kwargs.get('ignore_conflicts') or kwargs.get('update_conflicts'):
+                # Lignes ignorées ou fusionnées : on ne sait pas ce qui a été inséré
+                counters.recount_keys({self.counter_state(obj)[0] for obj in created} - {None})
+            else:
+                counters.add_states(self.counter_state(obj) for obj in created)
+            for obj in created:
+                obj._counter_state = self.counter_state(obj)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        from .utils import counters
+        objs = list(objs)
+        if not self.counted_fields.intersection(fields):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            keys = counters.event_keys(self.model._base_manager.filter(pk__in=[obj.pk for obj in objs]))
+            rows = super().bulk_update(objs, fields, *args, **kwargs)
+            keys |= {self.counter_state(obj)[0] for obj in objs} - {None}
+            counters.recount_keys(keys)
+            for obj in objs:
+                obj._counter_state = self.counter_state(obj)
+        return rows
+
+    def update(self, **kwargs):
+        from .utils import counters
+        if not self.counted_fields.intersection(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            pks = list(self.values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            counters.recount_keys(counters.event_keys(self.model._base_manager.filter(pk__in=pks)) |
+                                  counters.event_keys_from_values(kwargs))
+        return rows
+
+
+class CountedModel(models.Model):
+    """
+    Guest et RSVP : chaque enregistrement applique aux compteurs de l'événement
+    la différence entre l'état compté avant et après l'écriture (UPDATE avec F())
+    """
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def counter_state(obj):
+        raise NotImplementedError
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not instance.get_deferred_fields():
+            instance._counter_state = cls.counter_state(instance)
+        return instance
+
+    def save(self, *args, **kwargs):
+        from .utils import counters
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self)), savepoint=False):
+            if self._state.adding:
+                old = None
+            elif hasattr(self, '_counter_state'):
+                old = self._counter_state
+            else:
+                # Instance chargée avec des champs différés : état relu en base
+                stored = type(self)._base_manager.filter(pk=self.pk).first()
+                old = self.counter_state(stored) if stored else None
+            super().save(*args, **kwargs)
+            new = self.counter_state(self)
+            if new != old:
+                counters.apply_state_change(old, new)
+            self._counter_state = new
+
+
+class GuestQuerySet(CountedQuerySet):
+    """
+    Garde `email_normalized` synchronisé lors des opérations en masse,
+    qui ne passent pas par Guest.save()
+    """
+    counted_fields = frozenset(('status', 'payment_status', 'event_private', 'event_private_id',
+                                'event_public', 'event_public_id'))
+
+    @staticmethod
+    def counter_state(obj):
+        from .utils.counters import guest_state
+        return guest_state(obj)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from .utils.guests import normalize_email
+        objs = list(objs)
+        for obj in objs:
+            obj.email_normalized = normalize_email(obj.email)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        from .utils.guests import normalize_email
+        objs = list(objs)
+        if 'email' in fields:
+            for obj in objs:
+                obj.email_normalized = normalize_email(obj.email)
+            fields = list(fields) + ['email_normalized']
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        if isinstance(kwargs.get('email'), str):
+            from .utils.guests import normalize_email
+            kwargs['email_normalized'] = normalize_email(kwargs['email'])
+        return super().update(**kwargs)
+
+
+class Guest(CountedModel):
     STATUS_PENDING = 'pending'
     STATUS_ACCEPTED = 'accepted'
     STATUS_DECLINED = 'declined'
@@ -251,6 +526,17 @@ class Guest(models.Model):
     )
 
     email = models.EmailField()
+    # Email en minuscules, maintenu par save() et GuestQuerySet : les recherches
+    # se font par égalité (index) au lieu de email__iexact (LIKE / UPPER, sans index)
+    email_normalized = models.EmailField(editable=False, default='')
+    # Compte correspondant à l'email, résolu une fois (invitation, inscription, changement d'email)
+    user = models.ForeignKey(
+        User,
+        related_name='guest_entries',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
     token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     checked_in = models.BooleanField(default=False)
@@ -271,10 +557,21 @@ class Guest(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
 
+    objects = GuestQuerySet.as_manager()
+    counter_state = staticmethod(GuestQuerySet.counter_state)
+
     def __str__(self):
         event = self.event_private or self.event_public
         return f"{self.email} → {event.title} ({self.get_status_display()})"
 
+    def save(self, *args, **kwargs):
+        from .utils.guests import normalize_email
+        self.email_normalized = normalize_email(self.email)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'email' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'email_normalized'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Invité"
         verbose_name_plural = "Invités"
@@ -293,6 +590,9 @@ class Guest(models.Model):
             models.Index(fields=['event_private', 'status']),
             models.Index(fields=['event_public', 'status']),
             models.Index(fields=['payment_status']),
+            models.Index(fields=['email_normalized', 'status'], name='guest_email_norm_status_idx'),
+            models.Index(fields=['email_normalized', 'event_private'], name='guest_email_norm_priv_idx'),
+            models.Index(fields=['email_normalized', 'event_public'], name='guest_email_norm_pub_idx'),
         ]
 
     def clean(self):
@@ -324,6 +624,9 @@ class Guest(models.Model):
             models.Index(fields=['event_private', 'status']),
             models.Index(fields=['event_public', 'status']),
             models.Index(fields=['payment_status']),
+            models.Index(fields=['email_normalized', 'status'], name='guest_email_norm_status_idx'),
+            models.Index(fields=['email_normalized', 'event_private'], name='guest_email_norm_priv_idx'),
+            models.Index(fields=['email_normalized', 'event_public'], name='guest_email_norm_pub_idx'),
         ]
 
     def clean(self):
@@ -343,7 +646,17 @@ class Guest(models.Model):
 # ==========================================================
 # ✅ RSVP (Participation confirmée à un événement)
 # ==========================================================
-class RSVP(models.Model):
+class RSVPQuerySet(CountedQuerySet):
+    counted_fields = frozenset(('response', 'event_private', 'event_private_id',
+                                'event_public', 'event_public_id'))
+
+    @staticmethod
+    def counter_state(obj):
+        from .utils.counters import rsvp_state
+        return rsvp_state(obj)
+
+
+class RSVP(CountedModel):
     """
     Représente la confirmation de participation d'un utilisateur
     à un événement public ou privé.
@@ -362,6 +675,9 @@ class RSVP(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
 
+    objects = RSVPQuerySet.as_manager()
+    counter_state = staticmethod(RSVPQuerySet.counter_state)
+
     def __str__(self):
         event_name = self.event_private.title if self.event_private else self.event_public.title
         return f"{self.user.username} → {event_name} ({self.response})"
@@ -380,6 +696,133 @@ class RSVP(models.Model):
         ]
 
 
+# ==========================================================
+# ⏳ LISTE D'ATTENTE (événements publics complets)
+# ==========================================================
+def waitlist_sequence():
+    """Ancienne valeur par défaut de WaitlistEntry.sequence, conservée pour la migration 0023"""
+    return time.time_ns()
+
+
+class WaitlistEntry(models.Model):
+    """
+    Demande de participation à un événement public complet, servie dans l'ordre
+    d'arrivée dès qu'une place se libère (voir utils/waitlist.py). `sequence` est le
+    rang d'arrivée dans l'événement : 1, 2, 3... attribués par `PublicEvent.waitlist_tail`
+    """
+    STATUS_WAITING = 'waiting'
+    STATUS_PROMOTED = 'promoted'
+    STATUS_CANCELLED = 'cancelled'
+
+    STATUS_CHOICES = [
+        (STATUS_WAITING, 'En attente'),
+        (STATUS_PROMOTED, 'Place attribuée'),
+        (STATUS_CANCELLED, 'Annulée'),
+    ]
+
+    event = models.ForeignKey(PublicEvent, related_name='waitlist', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='waitlist_entries', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_WAITING)
+    sequence = models.PositiveBigIntegerField(editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    promoted_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.user.username} → {self.event.title} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "Inscription en liste d'attente"
+        verbose_name_plural = "Liste d'attente"
+        constraints = [
+            # Une seule place dans la file par utilisateur et par événement
+            models.UniqueConstraint(
+                fields=['event', 'user'], condition=models.Q(status='waiting'),
+                name='waitlist_one_waiting_entry',
+            ),
+            # Rang d'arrivée unique dans l'événement
+            models.UniqueConstraint(fields=['event', 'sequence'], name='waitlist_unique_sequence'),
+        ]
+        indexes = [
+            # Tête de file : première entrée de l'index (event, status, sequence)
+            models.Index(fields=['event', 'status', 'sequence'], name='waitlist_queue_idx'),
+        ]
+
+
+# ==========================================================
+# 🎟️ PLACES RETENUES PENDANT LE PAIEMENT
+# ==========================================================
+class SeatHold(models.Model):
+    """
+    Place retenue pour un utilisateur le temps de payer (événement public payant).
+    Comptée dans la capacité tant qu'elle n'a pas expiré (voir utils/capacity.py) ;
+    convertie en invité payé au paiement, supprimée en masse une fois expirée.
+    """
+    event = models.ForeignKey(PublicEvent, related_name='seat_holds', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='seat_holds', on_delete=models.CASCADE)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user.username} → {self.event.title} (jusqu'à {self.expires_at:%H:%M})"
+
+    class Meta:
+        verbose_name = "Place retenue"
+        verbose_name_plural = "Places retenues"
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'user'], name='seat_hold_one_per_user'),
+        ]
+        indexes = [
+            # Places retenues actives d'un événement (capacité)
+            models.Index(fields=['event', 'expires_at'], name='seat_hold_event_expiry_idx'),
+            # Purge : une seule suppression par plage d'expiration
+            models.Index(fields=['expires_at'], name='seat_hold_expiry_idx'),
+        ]
+
+
+# ==========================================================
+# 💳 PAIEMENTS (CHECKOUT)
+# ==========================================================
+class Checkout(models.Model):
+    """
+    Un paiement d'inscription à un événement public, identifié par sa clé d'idempotence :
+    une soumission répétée (double clic, rechargement) retrouve cette ligne au lieu
+    de débiter et d'écrire une seconde fois (voir utils/checkout.py)
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_REFUNDED = 'refunded'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'En cours'),
+        (STATUS_SUCCEEDED, 'Réussi'),
+        (STATUS_FAILED, 'Échoué'),
+        (STATUS_REFUNDED, 'Remboursé'),
+    ]
+
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, related_name='checkouts', on_delete=models.CASCADE)
+    event = models.ForeignKey(PublicEvent, related_name='checkouts', on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    # Transaction de l'invité payé (Guest.payment_transaction_id) ; pas de clé étrangère vers
+    # Guest, dont les suppressions en masse n'ont ainsi rien à mettre à jour ici
+    transaction_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} → {self.event.title} : {self.amount} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "Paiement"
+        verbose_name_plural = "Paiements"
+        indexes = [
+            models.Index(fields=['event', 'status']),
+        ]
+
+
 # ==========================================================
 # ✉️ MESSAGES DE CONTACT
 # ==========================================================
@@ -396,4 +839,76 @@ class ContactMessage(models.Model):
     class Meta:
         verbose_name = "Message de contact"
         verbose_name_plural = "Messages de contact"
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+# ==========================================================
+# 📬 FILE D'ATTENTE DES EMAILS SORTANTS (OUTBOX)
+# ==========================================================
+class OutboundEmail(models.Model):
+    """
+    Email en attente d'envoi.
+    Les vues se contentent d'insérer une ligne ; la commande
+    `process_email_queue` vide la file avec reprises et backoff exponentiel.
+    """
+    KIND_PRIVATE_INVITATION = 'private_invitation'
+    KIND_RSVP_CONFIRMATION = 'rsvp_confirmation'
+    KIND_TWO_FACTOR_CODE = 'two_factor_code'
+    KIND_WAITLIST_PROMOTION = 'waitlist_promotion'
+    KIND_PLAIN = 'plain'
+
+    KIND_CHOICES = [
+        (KIND_PRIVATE_INVITATION, 'Invitation à un événement privé'),
+        (KIND_RSVP_CONFIRMATION, 'Confirmation RSVP'),
+        (KIND_TWO_FACTOR_CODE, 'Code 2FA'),
+        (KIND_WAITLIST_PROMOTION, "Place attribuée (liste d'attente)"),
+        (KIND_PLAIN, 'Email simple'),
+    ]
+
+    # Plus la valeur est petite, plus l'email passe tôt
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 5
+    PRIORITY_BULK = 9
+
+    PRIORITY_CHOICES = [
+        (PRIORITY_HIGH, 'Haute'),
+        (PRIORITY_NORMAL, 'Normale'),
+        (PRIORITY_BULK, 'Envoi en masse'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_DEAD = 'dead'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'En attente'),
+        (STATUS_SENDING, 'En cours'),
+        (STATUS_SENT, 'Envoyé'),
+        (STATUS_DEAD, 'Abandonné'),
+    ]
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_NORMAL)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    to_email = models.EmailField()
+    payload = models.JSONField(default=dict, blank=True)
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Email sortant"
+        verbose_name_plural = "Emails sortants"
+        ordering = ['priority', 'next_attempt_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'priority', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} → {self.to_email} ({self.get_status_display()})"
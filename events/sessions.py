@@ -0,0 +1,38 @@
+"""
+Moteur de sessions de Smart Event (SESSION_ENGINE = 'events.sessions').
+
+Sessions en base lues à travers le cache (cached_db), avec un rafraîchissement
+paresseux de l'expiration : au lieu de réécrire la session à chaque requête
+(SESSION_SAVE_EVERY_REQUEST), elle n'est réenregistrée que lorsqu'une fraction
+de SESSION_COOKIE_AGE s'est écoulée depuis le dernier enregistrement.
+Une page en lecture seule ne fait donc aucune écriture dans django_session.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+# Clé interne : dernier enregistrement de la session (epoch)
+REFRESHED_AT_KEY = '_refreshed_at'
+
+
+class SessionStore(CachedDBStore):
+
+    def load(self):
+        data = super().load()
+        if data and self._needs_refresh(data):
+            data[REFRESHED_AT_KEY] = int(time.time())
+            # SessionMiddleware réenregistre la session et renvoie le cookie avec la nouvelle expiration
+            self.modified = True
+        return data
+
+    def _needs_refresh(self, data):
+        fraction = getattr(settings, 'SESSION_REFRESH_FRACTION', 0.1)
+        refreshed_at = data.get(REFRESHED_AT_KEY, 0)
+        return time.time() - refreshed_at >= self.get_session_cookie_age() * fraction
+
+    def save(self, must_create=False):
+        data = getattr(self, '_session_cache', None)
+        if data:
+            data[REFRESHED_AT_KEY] = int(time.time())
+        super().save(must_create)
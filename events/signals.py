@@ -1,7 +1,9 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .models import TwoFactorAuth, UserProfile
+from .models import Guest, PrivateEvent, PublicEvent, RSVP, TwoFactorAuth, UserProfile
+from .utils import counters, search, stats
+from .utils.guests import link_user_guests
 
 User = get_user_model()
 
@@ -28,3 +30,62 @@ def save_user_profile(sender, instance, **kwargs):
     # S'assurer qu'il y a une configuration 2FA pour l'utilisateur
     if not hasattr(instance, 'two_factor_auth'):
         TwoFactorAuth.objects.create(user=instance, is_enabled=False)
+
+
+@receiver(post_save, sender=User)
+def link_guest_entries(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Rattache au compte les invitations reçues à son adresse email,
+    à l'inscription et à chaque changement d'email
+    """
+    if update_fields is not None and 'email' not in update_fields:
+        return  # ex. mise à jour de last_login à la connexion
+    link_user_guests(instance)
+
+
+@receiver(pre_delete, sender=Guest)
+@receiver(pre_delete, sender=RSVP)
+def count_deleted_attendance(sender, instance, origin=None, **kwargs):
+    """Compte les lignes d'une même suppression, retirées ensemble par discount_attendance"""
+    counters.delete_started(origin)
+
+
+@receiver(post_delete, sender=Guest)
+@receiver(post_delete, sender=RSVP)
+def discount_attendance(sender, instance, origin=None, **kwargs):
+    """
+    Retire des compteurs de l'événement une ligne supprimée, y compris via
+    QuerySet.delete() et les suppressions en cascade (ex. compte supprimé) :
+    un UPDATE par événement touché, après la dernière ligne de la suppression
+    """
+    counters.delete_finished(
+        origin, getattr(instance, '_counter_state', None) or sender.counter_state(instance),
+    )
+
+
+@receiver(post_save, sender=PublicEvent)
+@receiver(post_save, sender=PrivateEvent)
+def index_event(sender, instance, update_fields=None, **kwargs):
+    """Réindexe un événement pour la recherche plein texte quand son texte change"""
+    if update_fields is not None and not set(search.INDEXED_FIELDS).intersection(update_fields):
+        return  # ex. mise à jour de l'image seule
+    search.index_events(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=PublicEvent)
+@receiver(post_delete, sender=PrivateEvent)
+def unindex_event(sender, instance, **kwargs):
+    search.unindex_events(sender, [instance.pk])
+
+
+@receiver(post_save, sender=PublicEvent)
+@receiver(post_save, sender=PrivateEvent)
+def count_event(sender, instance, created, **kwargs):
+    """Reporte la création ou le changement de date d'un événement sur les statistiques agrégées"""
+    stats.event_saved(instance, created)
+
+
+@receiver(pre_delete, sender=PublicEvent)
+@receiver(pre_delete, sender=PrivateEvent)
+def discount_event(sender, instance, **kwargs):
+    stats.event_deleting(instance)
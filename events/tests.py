@@ -17,3 +17,1600 @@ class TemplateCheckTest(TestCase):
             for origin in e.tried:
                 print("-", origin)
             raise e  # relance l'erreur pour que le test échoue
+
+
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+import json
+
+from django.core.cache import caches
+
+from .models import OutboundEmail, PrivateEvent, Guest, TwoFactorAuth
+from .utils.email_queue import enqueue_email, process_queue, purge_finished
+from .utils.two_factor_codes import get_code_store
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'sessions-queue-tests'},
+    'two_factor': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': '2fa-queue-tests'},
+})
+class EmailQueueTest(TestCase):
+    def setUp(self):
+        caches['two_factor'].clear()
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pass12345')
+        self.event = PrivateEvent.objects.create(
+            owner=self.owner,
+            title='Soirée',
+            date=timezone.now() + timedelta(days=7),
+            location='Tunis',
+        )
+
+    def test_add_private_event_only_enqueues(self):
+        """La vue crée les invités et met les emails en file sans rien envoyer"""
+        self.client.force_login(self.owner)
+        session = self.client.session
+        session['2fa_verified'] = True
+        session['2fa_verified_at'] = timezone.now().isoformat()
+        session.save()
+
+        response = self.client.post(reverse('add_private_event'), {
+            'title': 'Anniversaire',
+            'date': (timezone.localtime() + timedelta(days=3)).strftime('%Y-%m-%dT%H:%M'),
+            'location': 'Sousse',
+            'guests_emails': 'a@example.com, b@example.com',
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Guest.objects.filter(event_private__title='Anniversaire').count(), 2)
+        queued = OutboundEmail.objects.filter(kind=OutboundEmail.KIND_PRIVATE_INVITATION)
+        self.assertEqual(queued.count(), 2)
+        self.assertTrue(all(q.priority == OutboundEmail.PRIORITY_BULK for q in queued))
+
+        process_queue()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(queued.filter(status=OutboundEmail.STATUS_SENT).count(), 2)
+
+    def test_high_priority_jumps_ahead(self):
+        """Les codes 2FA passent avant les invitations en masse"""
+        enqueue_email(OutboundEmail.KIND_PLAIN, 'bulk@example.com',
+                      {'subject': 'bulk', 'message': 'x'}, priority=OutboundEmail.PRIORITY_BULK)
+        get_code_store().issue(self.owner.id, '123456')
+        enqueue_email(OutboundEmail.KIND_TWO_FACTOR_CODE, 'owner@example.com',
+                      {'subject': 'code', 'user_id': self.owner.id}, priority=OutboundEmail.PRIORITY_HIGH)
+
+        process_queue(batch_size=1)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'code')
+        self.assertIn('123456', mail.outbox[0].body)
+
+    def test_two_factor_code_is_not_stored_in_queue(self):
+        two_fa = TwoFactorAuth.objects.get(user=self.owner)
+        two_fa.is_enabled = True
+        two_fa.send_verification_email()
+        code = get_code_store().active_code(self.owner.id)
+        queued = OutboundEmail.objects.get(kind=OutboundEmail.KIND_TWO_FACTOR_CODE)
+        self.assertNotIn(code, json.dumps(queued.payload))
+
+        # Code consommé avant l'envoi : l'email est abandonné, sans nouvel essai
+        self.assertTrue(two_fa.verify_code(code))
+        self.assertEqual(process_queue(), (0, 0))
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OutboundEmail.STATUS_DEAD)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_rsvp_confirmation_goes_through_queue(self):
+        guest = Guest.objects.create(event_private=self.event, email='invite@example.com')
+
+        self.client.post(reverse('rsvp', args=[guest.token]), {'response': 'accepted'})
+
+        self.assertEqual(len(mail.outbox), 0)
+        queued = OutboundEmail.objects.get(kind=OutboundEmail.KIND_RSVP_CONFIRMATION)
+        self.assertEqual((queued.to_email, queued.payload), ('invite@example.com', {'guest_id': guest.id, 'response': 'accepted'}))
+        self.assertEqual(process_queue(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, ['invite@example.com'])
+
+    @override_settings(EMAIL_QUEUE_RETENTION_DAYS=7)
+    def test_purge_finished_keeps_pending_and_recent(self):
+        old = timezone.now() - timedelta(days=8)
+        sent = enqueue_email(OutboundEmail.KIND_PLAIN, 'a@example.com', {'subject': 's', 'message': 'm'})
+        dead = enqueue_email(OutboundEmail.KIND_PLAIN, 'b@example.com', {'subject': 's', 'message': 'm'})
+        pending = enqueue_email(OutboundEmail.KIND_PLAIN, 'c@example.com', {'subject': 's', 'message': 'm'})
+        recent = enqueue_email(OutboundEmail.KIND_PLAIN, 'd@example.com', {'subject': 's', 'message': 'm'})
+        OutboundEmail.objects.filter(pk=sent.pk).update(status=OutboundEmail.STATUS_SENT, created_at=old)
+        OutboundEmail.objects.filter(pk=dead.pk).update(status=OutboundEmail.STATUS_DEAD, created_at=old)
+        OutboundEmail.objects.filter(pk=pending.pk).update(created_at=old)
+        OutboundEmail.objects.filter(pk=recent.pk).update(status=OutboundEmail.STATUS_SENT)
+
+        self.assertEqual(purge_finished(), 2)
+        self.assertEqual(set(OutboundEmail.objects.values_list('pk', flat=True)), {pending.pk, recent.pk})
+
+    @override_settings(EMAIL_QUEUE_BACKOFF_BASE=60, EMAIL_QUEUE_MAX_ATTEMPTS=2)
+    def test_retry_with_backoff_then_dead_letter(self):
+        """Un email en échec est replanifié puis abandonné"""
+        item = enqueue_email('inconnu', 'x@example.com')
+
+        process_queue()
+        item.refresh_from_db()
+        self.assertEqual(item.status, OutboundEmail.STATUS_PENDING)
+        self.assertEqual(item.attempts, 1)
+        self.assertGreater(item.next_attempt_at, timezone.now() + timedelta(seconds=50))
+
+        # Pas encore l'heure : rien n'est repris
+        self.assertEqual(process_queue(), (0, 0))
+
+        OutboundEmail.objects.filter(id=item.id).update(next_attempt_at=timezone.now())
+        process_queue()
+        item.refresh_from_db()
+        self.assertEqual(item.status, OutboundEmail.STATUS_DEAD)
+
+
+import smtplib
+
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+
+from .utils.email_utils import send_bulk_messages
+
+
+class FlakyBackend(LocmemBackend):
+    """Backend de test qui compte les connexions et coupe la première après un message"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened = 0
+        self.dropped = False
+
+    def open(self):
+        self.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        if not self.dropped and len(mail.outbox) == 1:
+            self.dropped = True
+            raise smtplib.SMTPServerDisconnected('Connexion fermée')
+        if messages[0].to == ['refuse@example.com']:
+            raise smtplib.SMTPRecipientsRefused({'refuse@example.com': (550, b'Unknown')})
+        return super().send_messages(messages)
+
+
+class BulkSendTest(TestCase):
+    def test_one_connection_with_reconnects_and_per_recipient_errors(self):
+        emails = [
+            EmailMessage('s', 'b', 'from@example.com', [to])
+            for to in ['a@example.com', 'b@example.com', 'refuse@example.com', 'c@example.com']
+        ]
+        connection = FlakyBackend()
+
+        results = send_bulk_messages(emails, reconnect_every=100, connection=connection)
+
+        # 1 ouverture initiale + 1 reconnexion après la coupure du serveur
+        self.assertEqual(connection.opened, 2)
+        self.assertEqual(len(mail.outbox), 3)
+        errors = {m.to[0]: e for m, e in results}
+        self.assertIsNone(errors['a@example.com'])
+        self.assertIsNone(errors['b@example.com'])
+        self.assertIsInstance(errors['refuse@example.com'], smtplib.SMTPRecipientsRefused)
+        self.assertIsNone(errors['c@example.com'])
+
+    def test_reconnects_every_n_messages(self):
+        emails = [EmailMessage('s', 'b', 'from@example.com', [f'{i}@example.com']) for i in range(5)]
+        connection = FlakyBackend()
+        connection.dropped = True
+
+        send_bulk_messages(emails, reconnect_every=2, connection=connection)
+
+        self.assertEqual(connection.opened, 3)
+        self.assertEqual(len(mail.outbox), 5)
+
+
+from .utils.email_utils import PrivateEventInvitationRenderer, build_private_event_invitation
+
+
+class InvitationRendererTest(TestCase):
+    def test_renders_once_and_fills_per_guest_fields(self):
+        owner = User.objects.create_user('org', 'org@example.com', 'pass12345')
+        event = PrivateEvent.objects.create(
+            owner=owner, title='Mariage', date=timezone.now() + timedelta(days=30), location='Hammamet'
+        )
+        renderer = PrivateEventInvitationRenderer(event)
+
+        first = build_private_event_invitation(event, 'a@example.com', 'https://x.test/rsvp/1/?a=1&b=2', renderer)
+        second = build_private_event_invitation(event, 'b@example.com', 'https://x.test/rsvp/2/', renderer)
+
+        html, _ = first.alternatives[0]
+        self.assertIn('https://x.test/rsvp/1/?a=1&amp;b=2', html)
+        self.assertIn('https://x.test/rsvp/1/?a=1&b=2', first.body)
+        self.assertIn('https://x.test/rsvp/2/', second.alternatives[0][0])
+        self.assertNotIn('__SMART_EVENT', html + first.body)
+
+        # Le Content-ID de l'image correspond à la référence cid: du HTML
+        image = first.attachments[0]
+        cid = image['Content-ID'].strip('<>')
+        self.assertIn(f'cid:{cid}', html)
+
+
+import os
+import tempfile
+
+from .utils import qr_codes
+
+
+class QRCodeCacheTest(TestCase):
+    def setUp(self):
+        qr_codes.memory_cache.clear()
+
+    def test_memory_and_disk_cache(self):
+        with tempfile.TemporaryDirectory() as media_root, \
+                self.settings(MEDIA_ROOT=media_root, QR_CODE_DISK_CACHE=True):
+            png = qr_codes.get_qr_png('https://x.test/rsvp/1/')
+            self.assertTrue(png.startswith(b'\x89PNG'))
+            self.assertIs(qr_codes.get_qr_png('https://x.test/rsvp/1/'), png)
+
+            # Un autre processus (cache mémoire vide) relit le fichier au lieu de régénérer
+            qr_codes.memory_cache.clear()
+            self.assertEqual(qr_codes._read_disk_cache(('https://x.test/rsvp/1/', 10, 4, '#4a6fa5')), png)
+            self.assertEqual(qr_codes.get_qr_png('https://x.test/rsvp/1/'), png)
+
+    def test_batch_matches_single_render(self):
+        urls = [f'https://x.test/rsvp/{i}/' for i in range(qr_codes.POOL_MIN_BATCH + 5)]
+
+        results = qr_codes.render_qr_batch(urls)
+
+        self.assertEqual(set(results), set(urls))
+        self.assertEqual(results[urls[3]], qr_codes.render_qr_png(urls[3]))
+        self.assertIs(qr_codes.get_qr_png(urls[3]), results[urls[3]])
+
+
+from .models import EventStat, RSVP
+from .utils.guests import parse_guest_emails, sync_private_event_guests
+
+
+class GuestSyncTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('host', 'host@example.com', 'pass12345')
+        self.event = PrivateEvent.objects.create(
+            owner=self.owner,
+            title='Mariage',
+            date=timezone.now() + timedelta(days=30),
+            location='Hammamet',
+        )
+
+    def test_parse_normalizes_and_dedupes(self):
+        self.assertEqual(
+            parse_guest_emails(' A@Example.com, b@example.com,, a@example.com '),
+            ['a@example.com', 'b@example.com'],
+        )
+
+    def test_edit_keeps_tokens_and_statuses(self):
+        sync_private_event_guests(self.event, ['a@example.com', 'b@example.com'])
+        accepted = Guest.objects.get(email='a@example.com')
+        accepted.status = Guest.STATUS_ACCEPTED
+        accepted.save()
+
+        created, removed = sync_private_event_guests(self.event, ['A@example.com', 'c@example.com'])
+
+        self.assertEqual([g.email for g in created], ['c@example.com'])
+        self.assertEqual(removed, 1)
+        kept = Guest.objects.get(email='a@example.com')
+        self.assertEqual((kept.token, kept.status), (accepted.token, Guest.STATUS_ACCEPTED))
+        self.assertFalse(Guest.objects.filter(email='b@example.com').exists())
+
+    def test_constant_number_of_queries(self):
+        emails = [f'guest{i}@example.com' for i in range(200)]
+        sync_private_event_guests(self.event, emails)
+
+        # Lecture + comptes + bulk_create + delete (lignes relues pour les compteurs, + savepoint)
+        # quel que soit le nombre d'invités
+        with self.assertNumQueries(7):
+            sync_private_event_guests(self.event, emails[1:] + ['new@example.com'])
+        self.assertEqual(Guest.objects.filter(event_private=self.event).count(), 200)
+
+    def test_removing_accepted_guests_updates_counters_once(self):
+        emails = [f'guest{i}@example.com' for i in range(300)]
+        Guest.objects.bulk_create([
+            Guest(event_private=self.event, email=email, status=Guest.STATUS_ACCEPTED) for email in emails
+        ])
+        RSVP.objects.create(user=self.owner, event_private=self.event, response='yes')
+
+        # Comme ci-dessus, plus un UPDATE des compteurs et un des statistiques pour les 299 invités retirés
+        with self.assertNumQueries(9):
+            sync_private_event_guests(self.event, emails[:1])
+        self.event.refresh_from_db()
+        self.assertEqual((self.event.accepted_count, self.event.rsvp_yes_count), (1, 1))
+
+        # Cascade : les invités et RSVP restants d'un événement supprimé sont retirés ensemble
+        stat = EventStat.objects.get(kind='private', period=EventStat.PERIOD_MONTH)
+        self.assertEqual(stat.participations, 2)
+        self.event.delete()
+        stat.refresh_from_db()
+        self.assertEqual((stat.events, stat.participations), (0, 0))
+
+
+import time
+from unittest import mock
+
+from django.core.cache import caches
+
+from .models import TwoFactorAuth, TwoFactorCode
+from .utils.two_factor_codes import CacheCodeStore, DatabaseCodeStore
+
+
+@override_settings(
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'sessions-tests'},
+        'two_factor': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': '2fa-tests'},
+    },
+    TWO_FACTOR_CODE_STORE='cache',
+)
+class TwoFactorCodeStoreTest(TestCase):
+    def setUp(self):
+        caches['two_factor'].clear()
+        self.user = User.objects.create_user('secure', 'secure@example.com', 'pass12345')
+        self.two_fa, _ = TwoFactorAuth.objects.update_or_create(user=self.user, defaults={'is_enabled': True})
+
+    def test_cache_store_consumes_once_and_invalidates_previous(self):
+        store = CacheCodeStore('two_factor')
+        store.issue(self.user.id, '111111')
+        store.issue(self.user.id, '222222')
+
+        self.assertFalse(store.consume(self.user.id, '111111'))
+        self.assertTrue(store.consume(self.user.id, '222222'))
+        self.assertFalse(store.consume(self.user.id, '222222'))
+
+    def test_cache_store_rejects_expired_code(self):
+        store = CacheCodeStore('two_factor')
+        store.issue(self.user.id, '333333', ttl=1)
+        # Clé expirée mais encore présente : delete() réussirait quand même
+        with mock.patch('time.time', return_value=time.time() + 2):
+            self.assertFalse(store.consume(self.user.id, '333333'))
+            self.assertIsNone(store.active_code(self.user.id))
+
+    def test_login_code_does_not_touch_code_table(self):
+        self.two_fa.send_verification_email()
+        self.assertTrue(OutboundEmail.objects.filter(kind=OutboundEmail.KIND_TWO_FACTOR_CODE).exists())
+        code = CacheCodeStore('two_factor').active_code(self.user.id)
+
+        self.assertFalse(TwoFactorCode.objects.exists())
+        self.assertFalse(self.two_fa.verify_code('000000' if code != '000000' else '999999'))
+        self.assertTrue(self.two_fa.verify_code(code))
+        self.assertFalse(self.two_fa.verify_code(code))
+        self.two_fa.refresh_from_db()
+        self.assertIsNotNone(self.two_fa.last_verified)
+
+    def _pending_login(self):
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['pending_2fa_user_id'] = self.user.id
+        session.save()
+
+    def test_verify_page_reuses_unexpired_code(self):
+        self._pending_login()
+
+        self.client.get(reverse('two_factor_verify'))
+        self.client.get(reverse('two_factor_verify'))
+        self.client.post(reverse('two_factor_verify'), {'code': '000000'})
+
+        self.assertEqual(OutboundEmail.objects.filter(kind=OutboundEmail.KIND_TWO_FACTOR_CODE).count(), 1)
+
+    def test_resend_is_debounced_and_rate_limited(self):
+        self._pending_login()
+        self.client.get(reverse('two_factor_verify'))
+
+        response = self.client.post(reverse('resend_2fa_code'))
+        self.assertEqual(response.status_code, 429)
+
+        with self.settings(TWO_FACTOR_RESEND_DEBOUNCE=0, TWO_FACTOR_SEND_LIMIT=2):
+            self.assertEqual(self.client.post(reverse('resend_2fa_code')).status_code, 200)
+            self.assertEqual(self.client.post(reverse('resend_2fa_code')).status_code, 429)
+        self.assertEqual(OutboundEmail.objects.filter(kind=OutboundEmail.KIND_TWO_FACTOR_CODE).count(), 2)
+
+    def _sent_code(self):
+        return CacheCodeStore('two_factor').active_code(self.user.id)
+
+    def test_wrong_codes_lock_verification_and_revoke_code(self):
+        self._pending_login()
+        self.client.get(reverse('two_factor_verify'))
+        code = self._sent_code()
+        wrong = '000000' if code != '000000' else '999999'
+
+        statuses = [self.client.post(reverse('two_factor_verify'), {'code': wrong}).status_code for _ in range(5)]
+        self.assertEqual(statuses, [200, 200, 200, 200, 429])
+        # Le bon code ne passe plus : il a été invalidé, et la vérification reste bloquée
+        self.assertEqual(self.client.post(reverse('two_factor_verify'), {'code': code}).status_code, 429)
+        self.assertIsNone(CacheCodeStore('two_factor').active_code(self.user.id))
+        self.assertEqual(self.client.post(reverse('resend_2fa_code')).status_code, 429)
+
+    def test_quick_relogin_still_sends_first_code(self):
+        self._pending_login()
+        self.client.get(reverse('two_factor_verify'))
+        self.assertTrue(self.two_fa.verify_code(self._sent_code()))
+
+        # Reconnexion aussitôt après : aucun code valable, l'espacement des renvois ne bloque pas l'envoi
+        self.client.logout()
+        self._pending_login()
+        response = self.client.get(reverse('two_factor_verify'))
+        self.assertTrue(response.context['code_sent'])
+        self.assertEqual(OutboundEmail.objects.filter(kind=OutboundEmail.KIND_TWO_FACTOR_CODE).count(), 2)
+
+    def test_database_fallback_purges_expired_codes(self):
+        other = User.objects.create_user('other', 'other@example.com', 'pass12345')
+        TwoFactorCode.objects.create(user=other, code='333333', expires_at=timezone.now() - timedelta(minutes=1))
+        store = DatabaseCodeStore()
+
+        store.issue(self.user.id, '444444')
+
+        self.assertEqual(list(TwoFactorCode.objects.values_list('code', flat=True)), ['444444'])
+        self.assertTrue(store.consume(self.user.id, '444444'))
+        self.assertFalse(store.consume(self.user.id, '444444'))
+
+
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from .auth_views import TWO_FACTOR_SESSION_KEY, TwoFactorMiddleware
+
+
+class TwoFactorMiddlewareTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('mw', 'mw@example.com', 'pass12345')
+        TwoFactorAuth.objects.update_or_create(user=self.user, defaults={'is_enabled': True})
+        self.middleware = TwoFactorMiddleware(lambda request: HttpResponse('ok'))
+
+    def _request(self, path='/dashboard/', session=None):
+        request = RequestFactory().get(path)
+        request.user = User.objects.get(pk=self.user.pk)
+        request.session = session if session is not None else {}
+        return request
+
+    def test_verified_session_costs_no_query_after_first_check(self):
+        session = {'2fa_verified': True, '2fa_verified_at': timezone.now().isoformat()}
+        request = self._request(session=session)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.middleware(request).status_code, 200)
+
+        request = self._request(session=session)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.middleware(request).status_code, 200)
+
+    def test_unverified_and_expired_sessions_are_redirected(self):
+        self.assertEqual(self.middleware(self._request()).status_code, 302)
+
+        session = {TWO_FACTOR_SESSION_KEY: [self.user.pk, True, 0]}
+        self.assertEqual(self.middleware(self._request(session=session)).status_code, 302)
+        self.assertEqual(self.middleware(self._request('/static/app.css', session)).status_code, 200)
+
+    def test_toggle_invalidates_cached_state(self):
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['2fa_verified'] = True
+        session['2fa_verified_at'] = timezone.now().isoformat()
+        session.save()
+        self.client.get(reverse('toggle_two_factor'))
+        self.assertTrue(self.client.session[TWO_FACTOR_SESSION_KEY][1])
+
+        self.client.post(reverse('toggle_two_factor'), {})
+
+        self.assertNotIn(TWO_FACTOR_SESSION_KEY, self.client.session)
+        self.assertFalse(TwoFactorAuth.objects.get(user=self.user).is_enabled)
+
+
+from unittest import mock
+
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class LoginWith2FATest(TestCase):
+    def test_password_is_hashed_once_per_login(self):
+        User.objects.create_user('door', 'door@example.com', 'pass12345')
+
+        with mock.patch.object(PBKDF2PasswordHasher, 'verify', autospec=True,
+                               side_effect=lambda self, password, encoded: True) as verify:
+            response = self.client.post(reverse('login'), {'username': 'door', 'password': 'pass12345'})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(verify.call_count, 1)
+
+
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .sessions import REFRESHED_AT_KEY
+
+
+class LazySessionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'pass12345')
+        self.client.force_login(self.user)
+
+    def _session_writes(self, path):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(path)
+        return [q['sql'] for q in ctx.captured_queries
+                if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')]
+
+    def test_read_only_page_does_not_write_session(self):
+        self.client.get(reverse('about'))
+        self.assertEqual(self._session_writes(reverse('about')), [])
+
+    def test_expiry_is_refreshed_after_fraction_of_cookie_age(self):
+        session = self.client.session
+        session[REFRESHED_AT_KEY] = 0
+        session.save(must_create=False)
+
+        self.assertEqual(len(self._session_writes(reverse('about'))), 1)
+        self.assertEqual(self._session_writes(reverse('about')), [])
+
+    def test_purge_deletes_expired_sessions_in_batches(self):
+        Session.objects.bulk_create([
+            Session(session_key=f'expired{i}', session_data='', expire_date=timezone.now() - timedelta(days=1))
+            for i in range(5)
+        ])
+
+        call_command('purge_expired_sessions', batch_size=2, stdout=open(os.devnull, 'w'))
+
+        self.assertFalse(Session.objects.filter(expire_date__lt=timezone.now()).exists())
+        self.assertTrue(Session.objects.exists())
+
+
+from .models import PublicEvent, RSVP
+
+
+class DashboardTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('dash', 'Dash@example.com', 'pass12345')
+        self.host = User.objects.create_user('dashhost', 'dashhost@example.com', 'pass12345')
+        self.client.force_login(self.user)
+
+    def _add_events(self, count):
+        date = timezone.now() + timedelta(days=10)
+        for i in range(count):
+            PrivateEvent.objects.create(owner=self.user, title=f'Mien {i}', date=date, location='Tunis')
+            invited = PrivateEvent.objects.create(owner=self.host, title=f'Invité {i}', date=date, location='Tunis')
+            Guest.objects.create(event_private=invited, email='dash@example.com',
+                                 status=[Guest.STATUS_PENDING, Guest.STATUS_ACCEPTED, Guest.STATUS_DECLINED][i % 3])
+            public = PublicEvent.objects.create(owner=self.host, title=f'Public {i}', date=date, location='Tunis')
+            RSVP.objects.create(user=self.user, event_public=public, response='yes')
+
+    def _dashboard_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_events(self):
+        self.client.get(reverse('dashboard'))  # premier passage : état 2FA mis en session
+        self._add_events(3)
+        _, few = self._dashboard_queries()
+        self._add_events(30)
+        response, many = self._dashboard_queries()
+
+        self.assertEqual(few, many)
+        self.assertEqual(response.context['created_events'].paginator.count, 33)
+        self.assertEqual(response.context['pending_events'].paginator.count, 11)
+        self.assertEqual(response.context['attending_events'].paginator.count, 11 + 33)
+        self.assertEqual(len(response.context['attending_events']), 12)
+
+    def test_sections_are_paginated_independently(self):
+        self._add_events(30)
+
+        response = self.client.get(reverse('dashboard'), {'type': 'private', 'created_page': 3})
+
+        self.assertEqual(response.context['created_events'].number, 3)
+        self.assertEqual(response.context['pending_events'].number, 1)
+        self.assertEqual(response.context['attending_events'].paginator.count, 10)
+        self.assertContains(response, '?type=private&created_page=2')
+
+    def test_invitations_follow_account_after_email_change(self):
+        invited = PrivateEvent.objects.create(
+            owner=self.host, title='Anniversaire', date=timezone.now() + timedelta(days=5), location='Tunis',
+        )
+        Guest.objects.create(event_private=invited, email='dash@example.com', user=self.user)
+        self.user.email = 'renamed@example.com'
+        self.user.save()
+
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual([e.id for e in response.context['pending_events']], [invited.id])
+        self.assertTrue(response.context['pending_events'][0].guest_token)
+
+    def test_sections_are_sliced_in_database(self):
+        self.client.get(reverse('dashboard'))  # premier passage : état 2FA mis en session
+        self._add_events(30)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('dashboard'))
+
+        sliced = [q['sql'] for q in ctx.captured_queries if 'LIMIT 12' in q['sql'] and 'UNION' in q['sql']]
+        self.assertEqual(len(sliced), 2)  # sections créés et participations (privé + public)
+        pending = response.context['pending_events']
+        self.assertEqual(len(pending), 10)
+        self.assertTrue(all(event.guest_token for event in pending))
+
+
+class GuestEmailNormalizedTest(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('norm', 'norm@example.com', 'pass12345')
+        self.event = PrivateEvent.objects.create(
+            owner=owner, title='Gala', date=timezone.now() + timedelta(days=3), location='Tunis',
+        )
+
+    def test_kept_in_sync_on_save_and_bulk_operations(self):
+        guest = Guest.objects.create(event_private=self.event, email=' Mixed@Example.COM ')
+        self.assertEqual(guest.email_normalized, 'mixed@example.com')
+
+        bulk = Guest.objects.bulk_create([Guest(event_private=self.event, email='Bulk@Example.com')])[0]
+        Guest.objects.filter(pk=guest.pk).update(email='Updated@Example.com')
+        bulk.email = 'Renamed@Example.com'
+        Guest.objects.bulk_update([bulk], ['email'])
+
+        self.assertEqual(
+            set(Guest.objects.values_list('email_normalized', flat=True)),
+            {'updated@example.com', 'renamed@example.com'},
+        )
+
+    def test_lookup_uses_normalized_index(self):
+        plan = Guest.objects.filter(email_normalized='a@example.com', status=Guest.STATUS_PENDING).explain()
+        self.assertIn('guest_email_norm_status_idx', plan)
+
+
+class GuestUserLinkTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('linker', 'linker@example.com', 'pass12345')
+        self.event = PrivateEvent.objects.create(
+            owner=self.owner, title='Brunch', date=timezone.now() + timedelta(days=3), location='Tunis',
+        )
+
+    def test_invite_register_and_reconcile(self):
+        member = User.objects.create_user('member', 'Member@Example.com', 'pass12345')
+        created, _ = sync_private_event_guests(self.event, ['member@example.com', 'later@example.com'])
+        by_email = {g.email: g for g in created}
+        self.assertEqual(by_email['member@example.com'].user, member)
+        self.assertIsNone(by_email['later@example.com'].user)
+
+        later = User.objects.create_user('later', 'later@example.com', 'pass12345')
+        self.assertEqual(Guest.objects.get(email='later@example.com').user, later)
+
+        Guest.objects.update(user=None)
+        call_command('reconcile_guest_users', batch_size=1, stdout=open(os.devnull, 'w'))
+        self.assertEqual(Guest.objects.filter(user__isnull=False).count(), 2)
+
+    def test_seat_follows_account_after_email_change(self):
+        from .utils.checkout import has_seat, register_participant
+        public = PublicEvent.objects.create(
+            owner=self.owner, title='Match', date=timezone.now() + timedelta(days=3), location='Tunis',
+            max_participants=1,
+        )
+        member = User.objects.create_user('mover', 'old@example.com', 'pass12345')
+        register_participant(public, member)
+        member.email = 'new@example.com'
+        member.save()
+
+        self.assertTrue(has_seat(public, member))
+        register_participant(public, member)  # garde sa place, sans second invité
+        self.assertEqual(Guest.objects.filter(event_public=public).count(), 1)
+        self.client.force_login(member)
+        response = self.client.get(reverse('event_detail', args=['public', public.id]))
+        self.assertTrue(response.context['user_has_joined'])
+
+    def test_participant_list_does_not_look_up_users_per_guest(self):
+        public = PublicEvent.objects.create(
+            owner=self.owner, title='Concert', date=timezone.now() + timedelta(days=3), location='Tunis',
+        )
+        self.client.force_login(self.owner)
+        url = reverse('event_detail', args=['public', public.id])
+
+        def add_participants(start, count):
+            for i in range(start, start + count):
+                Guest.objects.create(event_public=public, email=f'fan{i}@example.com', status=Guest.STATUS_ACCEPTED)
+                User.objects.create_user(f'fan{i}', f'fan{i}@example.com', 'pass12345')
+
+        self.client.get(url)
+        add_participants(0, 2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        add_participants(2, 8)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(response.context['participants'][0]['user'].username[:3], 'fan')
+
+
+from .utils.participants import public_event_participants
+
+
+class ParticipantsPaginationTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('stage', 'stage@example.com', 'pass12345')
+        self.event = PublicEvent.objects.create(
+            owner=self.owner, title='Festival', date=timezone.now() + timedelta(days=3), location='Carthage',
+        )
+        for i in range(12):
+            user = User.objects.create_user(f'rsvp{i}', f'rsvp{i}@example.com', 'pass12345')
+            RSVP.objects.create(user=user, event_public=self.event, response='yes')
+            Guest.objects.create(event_public=self.event, email=f'guest{i}@example.com', status=Guest.STATUS_ACCEPTED)
+        # Un participant à la fois invité et RSVP n'apparaît qu'une fois
+        Guest.objects.create(event_public=self.event, email='RSVP0@example.com', status=Guest.STATUS_ACCEPTED)
+
+    def test_union_is_deduplicated_and_walked_with_cursors(self):
+        self.event.refresh_from_db()
+        first = page = public_event_participants(self.event, page_size=10)
+        # Total dénormalisé : 13 invités + 12 RSVP (rsvp0, aussi invité, compte deux fois)
+        self.assertEqual(page.count, 25)
+        self.assertFalse(page.has_previous)
+        seen = []
+        while True:
+            seen += [p['guest'].email if p['guest'] else p['user'].username for p in page]
+            if not page.has_next:
+                break
+            page = public_event_participants(self.event, after=page.next_cursor, page_size=10)
+
+        self.assertEqual(len(seen), 24)
+        self.assertEqual(len(set(seen)), 24)
+        self.assertNotIn('rsvp0', seen)
+
+        second = public_event_participants(self.event, after=first.next_cursor, page_size=10)
+        back = public_event_participants(self.event, before=second.previous_cursor, page_size=10)
+        self.assertEqual([p['user'] or p['guest'] for p in back], [p['user'] or p['guest'] for p in first])
+        self.assertFalse(back.has_previous)
+        self.assertTrue(back.has_next)
+
+    def test_search_and_constant_page_cost(self):
+        page = public_event_participants(self.event, q='guest1', page_size=10)
+        self.assertEqual(sorted(p['guest'].email for p in page), ['guest10@example.com', 'guest11@example.com', 'guest1@example.com'])
+        self.assertEqual(page.count, 3)
+
+        # Sans recherche, pas de COUNT : la page seule, puis ses invités et ses RSVP
+        with self.assertNumQueries(3):
+            list(public_event_participants(self.event, page_size=10))
+
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('event_detail', args=['public', self.event.id]))
+        self.assertContains(response, '?after=')
+
+
+class AttendanceCountersTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('counter', 'counter@example.com', 'pass12345')
+        self.event = PublicEvent.objects.create(
+            owner=self.owner, title='Match', date=timezone.now() + timedelta(days=3), location='Radès',
+            max_participants=2,
+        )
+
+    def assertCounters(self, accepted, paid, rsvp):
+        self.event.refresh_from_db()
+        self.assertEqual(
+            (self.event.accepted_count, self.event.paid_count, self.event.rsvp_yes_count), (accepted, paid, rsvp)
+        )
+
+    def test_save_and_delete_paths(self):
+        guest = Guest.objects.create(event_public=self.event, email='a@example.com')
+        self.assertCounters(0, 0, 0)
+        guest.status = Guest.STATUS_ACCEPTED
+        guest.payment_status = 'paid'
+        guest.save()
+        guest.save()  # sans changement : pas de double comptage
+        self.assertCounters(1, 1, 0)
+
+        rsvp = RSVP.objects.create(user=self.owner, event_public=self.event, response='yes')
+        self.assertCounters(1, 1, 1)
+        rsvp.response = 'no'
+        rsvp.save()
+        self.assertCounters(1, 1, 0)
+
+        Guest.objects.get(pk=guest.pk).delete()
+        self.assertCounters(0, 0, 0)
+
+    def test_bulk_paths(self):
+        guests = Guest.objects.bulk_create([
+            Guest(event_public=self.event, email=f'g{i}@example.com', status=Guest.STATUS_ACCEPTED) for i in range(3)
+        ])
+        self.assertCounters(3, 0, 0)
+        Guest.objects.filter(pk=guests[0].pk).update(status=Guest.STATUS_DECLINED)
+        self.assertCounters(2, 0, 0)
+        for guest in guests:
+            guest.payment_status = 'paid'
+        Guest.objects.bulk_update(guests, ['payment_status'])
+        self.assertCounters(2, 3, 0)
+        Guest.objects.filter(email='g1@example.com').delete()
+        self.assertCounters(1, 2, 0)
+
+        # Une cascade (suppression du compte) retire aussi ses RSVP
+        fan = User.objects.create_user('fan', 'fan@example.com', 'pass12345')
+        RSVP.objects.create(user=fan, event_public=self.event, response='yes')
+        self.assertCounters(1, 2, 1)
+        fan.delete()
+        self.assertCounters(1, 2, 0)
+
+    def test_capacity_reads_without_query_and_recount_repairs_drift(self):
+        Guest.objects.create(event_public=self.event, email='a@example.com', status=Guest.STATUS_ACCEPTED)
+        Guest.objects.create(event_public=self.event, email='b@example.com', status=Guest.STATUS_ACCEPTED)
+        event = PublicEvent.objects.get(pk=self.event.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(event.guest_count, 2)
+            self.assertTrue(event.is_full)
+
+        PublicEvent.objects.filter(pk=self.event.pk).update(accepted_count=40, paid_count=7)
+        call_command('recount_attendance', batch_size=1, stdout=open(os.devnull, 'w'))
+        self.assertCounters(2, 0, 0)
+
+
+from .utils import search
+
+
+class SearchIndexTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('finder', 'finder@example.com', 'pass12345')
+        self.date = timezone.now() + timedelta(days=3)
+
+    def make(self, title, description='', location='Tunis'):
+        return PublicEvent.objects.create(
+            owner=self.owner, title=title, description=description, location=location, date=self.date,
+        )
+
+    def titles(self, query):
+        return [e.title for e in search.search_events(PublicEvent.objects.all(), query)]
+
+    def check_backend(self):
+        jazz = self.make('Festival de jazz', 'Concerts en plein air')
+        self.make('Soirée électro', 'Avec un invité jazz', location='Sousse')
+        self.make('Conférence Django', 'Atelier Python', location='Sfax')
+
+        # Préfixe, accents et casse ignorés, tous les mots requis, titre classé avant la description
+        self.assertEqual(self.titles('JAZ'), ['Festival de jazz', 'Soirée électro'])
+        self.assertEqual(self.titles('electro sous'), ['Soirée électro'])
+        self.assertEqual(self.titles('conf pyth'), ['Conférence Django'])
+        self.assertEqual(self.titles('jazz" *'), ['Festival de jazz', 'Soirée électro'])
+
+        jazz.title = 'Nuit blues'
+        jazz.save()
+        self.assertEqual(self.titles('jazz'), ['Soirée électro'])
+        PublicEvent.objects.filter(pk=jazz.pk).update(description='Jazz manouche')
+        self.assertEqual(self.titles('manouche'), ['Nuit blues'])
+        PublicEvent.objects.bulk_create([
+            PublicEvent(owner=self.owner, title='Marathon', location='Carthage', date=self.date),
+        ])
+        self.assertEqual(self.titles('carth'), ['Marathon'])
+        jazz.delete()
+        self.assertEqual(self.titles('manouche'), [])
+
+    def test_fts5_index(self):
+        if not search.uses_fts():
+            self.skipTest("SQLite sans FTS5")
+        self.check_backend()
+
+    def test_inverted_index(self):
+        with mock.patch.object(search, 'uses_fts', return_value=False):
+            self.check_backend()
+
+    def test_ranking_covers_older_matches(self):
+        if not search.uses_fts():
+            self.skipTest("SQLite sans FTS5")
+        self.make('Jazz au jardin')
+        PublicEvent.objects.bulk_create([
+            PublicEvent(owner=self.owner, title=f'Soirée {i}', description='jazz', location='Tunis', date=self.date)
+            for i in range(30)
+        ])
+        # La correspondance la plus ancienne, dans le titre, reste la plus pertinente
+        self.assertEqual(self.titles('jazz')[0], 'Jazz au jardin')
+        self.assertEqual(len(self.titles('jazz')), 31)
+
+    def test_views_use_index(self):
+        self.make('Festival de jazz')
+        self.make('Salon du livre')
+        response = self.client.get(reverse('home'), {'q': 'jaz'})
+        self.assertEqual([e.title for e in response.context['events']], ['Festival de jazz'])
+
+
+from .utils.public_events import keyset_page, upcoming_public_events
+
+
+class PublicEventsKeysetTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('agenda', 'agenda@example.com', 'pass12345')
+        start = timezone.now() + timedelta(days=1)
+        # Des dates en double : l'id départage les événements d'un même créneau
+        self.events = PublicEvent.objects.bulk_create([
+            PublicEvent(owner=self.owner, title=f'Atelier {i}', location='Tunis', date=start + timedelta(hours=i // 3))
+            for i in range(30)
+        ])
+        PublicEvent.objects.create(owner=self.owner, title='Passé', location='Tunis', date=timezone.now() - timedelta(days=1))
+
+    def test_pages_walk_every_upcoming_event_once_at_constant_cost(self):
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(1):
+                events, cursor = keyset_page(upcoming_public_events(), after=cursor, page_size=7)
+            seen += [e.id for e in events]
+            if not cursor:
+                break
+        self.assertEqual(seen, [e.id for e in sorted(self.events, key=lambda e: (e.date, e.id))])
+
+    def test_html_list_and_json_feed(self):
+        response = self.client.get(reverse('public_events'))
+        self.assertEqual(len(response.context['events']), 12)
+        self.assertNotContains(response, 'Passé')
+
+        url = reverse('public_events_feed')
+        response = self.client.get(url, {'after': response.context['next_cursor'], 'size': 20})
+        data = response.json()
+        self.assertEqual(len(data['events']), 18)
+        self.assertIsNone(data['next_cursor'])
+        self.assertEqual(data['events'][0]['url'], reverse('event_detail', args=['public', data['events'][0]['id']]))
+
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        event = PublicEvent.objects.get(title='Atelier 0')
+        event.title = 'Atelier renommé'
+        event.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+import logging
+
+from .utils.trace import trace, tracing
+
+
+class DebugTraceTest(TestCase):
+    def test_home_issues_a_single_query_and_no_trace_by_default(self):
+        PublicEvent.objects.create(
+            owner=User.objects.create_user('host', 'host@example.com', 'pass12345'),
+            title='Salon', location='Tunis', date=timezone.now() + timedelta(days=1),
+        )
+        with self.assertNumQueries(1), self.assertNoLogs('events.trace'):
+            response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Salon')
+        self.assertNotIn('X-Trace-Id', response.headers)
+
+    @override_settings(DEBUG_TRACE=True, DEBUG_TRACE_SAMPLE_RATE=1.0)
+    def test_sampled_request_is_traced_under_one_id(self):
+        with self.assertLogs('events.trace', level='DEBUG') as logs:
+            response = self.client.get(reverse('home'), {'q': 'jazz'})
+        trace_id = response.headers['X-Trace-Id']
+        self.assertEqual([line.split()[0] for line in logs.output], ['DEBUG:events.trace:[%s]' % trace_id] * 3)
+        self.assertIn("home.search query='jazz'", logs.output[1])
+
+    @override_settings(DEBUG_TRACE=True, DEBUG_TRACE_SAMPLE_RATE=0.0)
+    def test_unsampled_request_is_not_traced(self):
+        with self.assertNoLogs('events.trace'):
+            response = self.client.get(reverse('home'))
+        self.assertNotIn('X-Trace-Id', response.headers)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'trace-sessions'},
+        'two_factor': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'trace-2fa'},
+    })
+    def test_two_factor_trace_never_contains_the_code(self):
+        user = User.objects.create_user('secret', 'secret@example.com', 'pass12345')
+        two_fa, _ = TwoFactorAuth.objects.update_or_create(user=user, defaults={'is_enabled': True})
+        with tracing(), self.assertLogs('events.trace', level='DEBUG') as logs:
+            self.assertTrue(two_fa.send_verification_email(force=True))
+            trace('outside.check', logging.INFO, user_id=user.pk)
+        from .utils.two_factor_codes import get_code_store
+        code = get_code_store().active_code(user.pk)
+        self.assertTrue(any('2fa.code_issued' in line for line in logs.output))
+        self.assertFalse(any(code in line for line in logs.output))
+
+
+class PrivateEventsListTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('invitee', 'Invitee@example.com', 'pass12345')
+        self.host = User.objects.create_user('host2', 'host2@example.com', 'pass12345')
+        self.date = timezone.now() + timedelta(days=2)
+        self.client.force_login(self.user)
+        self.url = reverse('private_events')
+
+    def invite(self, count, status=Guest.STATUS_PENDING, title='Dîner'):
+        for i in range(count):
+            event = PrivateEvent.objects.create(owner=self.host, title=f'{title} {i}', location='Tunis', date=self.date)
+            Guest.objects.create(event_private=event, email='invitee@example.com', status=status)
+
+    def test_fixed_query_count_and_statuses(self):
+        PrivateEvent.objects.create(owner=self.user, title='Mon anniversaire', location='Tunis', date=self.date)
+        self.invite(1, Guest.STATUS_ACCEPTED, title='Mariage')
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['page'].paginator.count, 2)
+        statuses = {e.title: e.guest_status for e in response.context['events']}
+        self.assertEqual(statuses, {'Mon anniversaire': None, 'Mariage 0': Guest.STATUS_ACCEPTED})
+
+        self.invite(30)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(response.context['page'].paginator.count, 32)
+        self.assertEqual(len(response.context['events']), 12)
+
+    def test_type_filter_and_search(self):
+        PrivateEvent.objects.create(owner=self.user, title='Pique-nique', location='Bizerte', date=self.date)
+        self.invite(2)
+        response = self.client.get(self.url, {'type': 'invited'})
+        self.assertEqual([e.title for e in response.context['events']], ['Dîner 0', 'Dîner 1'])
+        response = self.client.get(self.url, {'type': 'owned'})
+        self.assertEqual([e.title for e in response.context['events']], ['Pique-nique'])
+        response = self.client.get(self.url, {'q': 'bizer'})
+        self.assertEqual([e.title for e in response.context['events']], ['Pique-nique'])
+
+
+import json
+
+from .models import EventStat
+from .utils import stats
+
+
+class EventStatsTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('stats', 'stats@example.com', 'pass12345')
+        self.date = timezone.now() + timedelta(days=3)
+        self.event = PublicEvent.objects.create(owner=self.owner, title='Festival', location='Carthage', date=self.date)
+
+    def rows(self):
+        return {
+            (s.period, s.period_start, s.kind): (s.events, s.participations)
+            for s in EventStat.objects.all() if s.events or s.participations
+        }
+
+    def month_totals(self, kind='public'):
+        row = EventStat.objects.get(
+            period=EventStat.PERIOD_MONTH, period_start=timezone.localtime(self.event.date).date().replace(day=1),
+            kind=kind,
+        )
+        return row.events, row.participations
+
+    def test_incremental_updates_match_rebuild(self):
+        self.assertEqual(self.month_totals(), (1, 0))
+        Guest.objects.create(event_public=self.event, email='a@example.com', status=Guest.STATUS_ACCEPTED)
+        RSVP.objects.create(user=self.owner, event_public=self.event, response='yes')
+        self.assertEqual(self.month_totals(), (1, 2))
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.participants_count, 2)
+
+        PrivateEvent.objects.bulk_create([
+            PrivateEvent(owner=self.owner, title=f'Dîner {i}', location='Tunis', date=self.date) for i in range(3)
+        ])
+        self.assertEqual(self.month_totals('private'), (3, 0))
+
+        # Déplacement d'un événement (save puis update en masse) : ses participations le suivent
+        self.event.date = self.date + timedelta(days=62)
+        self.event.save()
+        PrivateEvent.objects.filter(title='Dîner 0').update(date=self.date - timedelta(days=62))
+        incremental = self.rows()
+        stats.rebuild()
+        self.assertEqual(incremental, self.rows())
+        self.assertEqual(self.month_totals(), (1, 2))
+
+        self.event.delete()
+        self.assertNotIn('public', {kind for _, _, kind in self.rows()})
+
+    def test_page_reads_rollups(self):
+        url = reverse('statistiques')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(url)
+        self.assertEqual(response.context['total_evenements'], 1)
+
+        PublicEvent.objects.bulk_create([
+            PublicEvent(owner=self.owner, title=f'Concert {i}', location='Sousse', date=timezone.now()) for i in range(20)
+        ])
+        Guest.objects.create(event_public=self.event, email='b@example.com', status=Guest.STATUS_ACCEPTED)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(response.context['total_evenements'], 21)
+        self.assertEqual(response.context['total_participations'], 1)
+        self.assertEqual(response.context['top_evenements'][0]['title'], 'Festival')
+        histogramme = json.loads(response.context['evenements_par_mois'])
+        self.assertEqual(len(histogramme), 12)
+        meme_mois = timezone.localtime(self.date).month == timezone.localtime().month
+        self.assertEqual(histogramme[-1], 20 + meme_mois)
+
+
+from django.test import override_settings
+
+from .utils import admin_stats
+
+
+class AdminStatsTest(TestCase):
+    def setUp(self):
+        caches['admin_stats'].clear()
+        self.admin = User.objects.create_superuser('boss', 'boss@example.com', 'pass12345')
+        self.date = timezone.now() + timedelta(days=5)
+        PublicEvent.objects.create(owner=self.admin, title='Salon', location='Tunis', date=self.date)
+
+    def test_non_superuser_is_redirected(self):
+        user = User.objects.create_user('lambda', 'lambda@example.com', 'pass12345')
+        self.client.force_login(user)
+        self.assertRedirects(self.client.get(reverse('admin_stats')), reverse('home'), fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('admin_stats_chart')).status_code, 403)
+
+    def test_page_and_chart_served_from_snapshot(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin_stats'))
+        self.assertEqual(response.context['public_events_count'], 1)
+        self.assertEqual(response.context['recent_events'][0]['title'], 'Salon')
+
+        # Instantané frais : les nouveaux événements n'apparaissent qu'au prochain recalcul
+        PrivateEvent.objects.create(owner=self.admin, title='Dîner', location='Tunis', date=self.date)
+        with mock.patch.object(admin_stats, 'compute_snapshot', wraps=admin_stats.compute_snapshot) as compute:
+            chart = self.client.get(reverse('admin_stats_chart')).json()
+            self.assertEqual(compute.call_count, 0)
+        self.assertEqual(sum(chart['event_counts']), 1)
+        self.assertEqual(len(chart['months']), 1)
+
+        with override_settings(ADMIN_STATS_TTL=0):
+            response = self.client.get(reverse('admin_stats'))
+        self.assertEqual(response.context['total_events'], 2)
+
+    @override_settings(ADMIN_STATS_TTL=0)
+    def test_concurrent_refresh_serves_stale_snapshot(self):
+        stale = admin_stats.refresh_snapshot()['data']
+        cache = caches['admin_stats']
+        # Un autre worker recalcule déjà : pas de second calcul, l'ancien instantané est servi
+        cache.add(admin_stats.LOCK_KEY, 'other-worker')
+        with mock.patch.object(admin_stats, 'compute_snapshot') as compute:
+            self.assertEqual(admin_stats.get_snapshot(), stale)
+            compute.assert_not_called()
+        cache.delete(admin_stats.LOCK_KEY)
+        with mock.patch.object(admin_stats, 'compute_snapshot', return_value={'total_events': 9}) as compute:
+            self.assertEqual(admin_stats.get_snapshot(), {'total_events': 9})
+            compute.assert_called_once()
+        self.assertIsNone(cache.get(admin_stats.LOCK_KEY))
+
+
+import os
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+from django.test import TransactionTestCase
+
+from .utils.capacity import EventFull
+from .views import register_user_to_public_event
+
+
+class FileDatabaseTestCase(TransactionTestCase):
+    """
+    Tests multi-threads : sous SQLite, ils tournent sur une copie fichier de la base de test,
+    car la base en mémoire partagée refuse les écritures concurrentes au lieu de les faire attendre
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.file_db = connection.vendor == 'sqlite' and connection.is_in_memory_db()
+        if not cls.file_db:
+            return
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.tmpdir.name, 'test_db.sqlite3')
+        connection.ensure_connection()
+        # La connexion en mémoire reste ouverte (la base disparaîtrait avec elle)
+        cls.memory_connection = connection.connection
+        target = sqlite3.connect(path)
+        cls.memory_connection.backup(target)
+        target.close()
+        cls.memory_name = connection.settings_dict['NAME']
+        connection.settings_dict['NAME'] = path
+        connection.connection = None
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.file_db:
+            connection.close()
+            connection.settings_dict['NAME'] = cls.memory_name
+            connection.connection = cls.memory_connection
+            cls.tmpdir.cleanup()
+        super().tearDownClass()
+
+
+class EventCapacityTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('orga', 'orga@example.com', 'pass12345')
+        self.event = PublicEvent.objects.create(
+            owner=self.owner, title='Gala', location='Tunis', date=timezone.now() + timedelta(days=7),
+            max_participants=1,
+        )
+
+    def test_full_event_refuses_new_participants_only(self):
+        register_user_to_public_event(self.owner, self.event)
+        # Une seconde inscription du même participant ne consomme pas de place
+        register_user_to_public_event(self.owner, self.event, paid=True, amount=10, transaction_id='T1')
+        user = User.objects.create_user('late', 'late@example.com', 'pass12345')
+        with self.assertRaises(EventFull):
+            register_user_to_public_event(user, self.event)
+        self.client.force_login(user)
+        response = self.client.get(reverse('join_public_event', args=[self.event.id]))
+        self.assertRedirects(response, reverse('event_detail', args=['public', self.event.id]),
+                             fetch_redirect_response=False)
+        self.event.refresh_from_db()
+        self.assertEqual((self.event.accepted_count, self.event.paid_count), (1, 1))
+        self.assertFalse(Guest.objects.filter(email_normalized='late@example.com').exists())
+
+
+class EventCapacityRushTest(FileDatabaseTestCase):
+    SEATS = 10
+    JOINS = 40
+
+    def test_parallel_joins_never_oversell(self):
+        owner = User.objects.create_user('rush', 'rush@example.com', 'pass12345')
+        event = PublicEvent.objects.create(
+            owner=owner, title='Concert', location='Tunis', date=timezone.now() + timedelta(days=7),
+            max_participants=self.SEATS,
+        )
+        User.objects.bulk_create([User(username=f'fan{i}', email=f'fan{i}@example.com') for i in range(self.JOINS)])
+        fans = list(User.objects.filter(username__startswith='fan'))
+
+        def join(user):
+            try:
+                register_user_to_public_event(user, event)
+                return True
+            except EventFull:
+                return False
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(join, fans))
+
+        self.assertEqual(results.count(True), self.SEATS)
+        event.refresh_from_db()
+        self.assertEqual(event.accepted_count, self.SEATS)
+        self.assertEqual(Guest.objects.filter(event_public=event).count(), self.SEATS)
+
+
+from .models import OutboundEmail, WaitlistEntry
+from .utils.waitlist import join_waitlist, waitlist_position
+
+
+class WaitlistTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('salle', 'salle@example.com', 'pass12345')
+        self.event = PublicEvent.objects.create(
+            owner=self.owner, title='Stand-up', location='Tunis', date=timezone.now() + timedelta(days=7),
+            max_participants=2,
+        )
+        self.seated = [self.user(f'seat{i}') for i in range(2)]
+        for user in self.seated:
+            register_user_to_public_event(user, self.event)
+
+    def user(self, name):
+        return User.objects.create_user(name, f'{name}@example.com', 'pass12345')
+
+    def guest(self, user):
+        return Guest.objects.get(event_public=self.event, email_normalized=user.email)
+
+    def test_full_event_queues_join_attempts(self):
+        fans = [self.user(f'fan{i}') for i in range(2)]
+        for fan in fans:
+            self.client.force_login(fan)
+            for _ in range(3):
+                self.client.get(reverse('join_public_event', args=[self.event.id]))
+        self.assertEqual(WaitlistEntry.objects.filter(event=self.event).count(), 2)
+        self.assertFalse(Guest.objects.filter(user__in=fans).exists())
+        response = self.client.get(reverse('event_detail', args=['public', self.event.id]))
+        self.assertEqual(response.context['waitlist_rank'], 2)
+
+    def test_freed_seats_promote_in_fifo_order(self):
+        fans = [self.user(f'fan{i}') for i in range(3)]
+        entries = [join_waitlist(self.event, fan) for fan in fans]
+        self.assertEqual([waitlist_position(e) for e in entries], [1, 2, 3])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            guest = self.guest(self.seated[0])
+            guest.status = Guest.STATUS_DECLINED
+            guest.save()
+        self.assertEqual(self.guest(fans[0]).status, Guest.STATUS_ACCEPTED)
+        self.assertTrue(RSVP.objects.filter(user=fans[0], event_public=self.event, response='yes').exists())
+        self.assertEqual(waitlist_position(entries[2]), 2)
+        notice = OutboundEmail.objects.get(kind=OutboundEmail.KIND_WAITLIST_PROMOTION)
+        self.assertEqual(notice.to_email, 'fan0@example.com')
+
+        # Un remboursement libère aussi la place ; une capacité augmentée en libère d'autres
+        with self.captureOnCommitCallbacks(execute=True):
+            Guest.objects.filter(pk=self.guest(self.seated[1]).pk).update(payment_status='refunded')
+        self.assertEqual(self.guest(fans[1]).status, Guest.STATUS_ACCEPTED)
+        PublicEvent.objects.filter(pk=self.event.pk).update(max_participants=5)
+        from .utils.waitlist import promote_all
+        self.assertEqual(promote_all(), 1)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.accepted_count, 3)
+        self.assertFalse(WaitlistEntry.objects.filter(status=WaitlistEntry.STATUS_WAITING).exists())
+
+    def test_position_is_one_indexed_head_lookup(self):
+        entries = [join_waitlist(self.event, self.user(f'fan{i}')) for i in range(4)]
+        self.assertEqual([e.sequence for e in entries], [1, 2, 3, 4])
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(waitlist_position(entries[3]), 4)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {ctx.captured_queries[0]['sql']}")
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('waitlist_queue_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+        # Deux promus : la tête avance, le rang d'arrivée ne change pas
+        PublicEvent.objects.filter(pk=self.event.pk).update(max_participants=4)
+        from .utils.waitlist import promote_waitlist
+        self.assertEqual(promote_waitlist(self.event.id), 2)
+        entries[3].refresh_from_db()
+        self.assertEqual((entries[3].sequence, waitlist_position(entries[3])), (4, 2))
+
+
+from decimal import Decimal
+
+from .models import SeatHold
+from .utils.capacity import free_seats, sweep_expired_holds
+
+CARD = {'card_holder': 'TEST', 'card_number': '4242424242424242', 'expiry_date': '12/99', 'cvv': '123'}
+
+
+class SeatHoldTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('scene', 'scene@example.com', 'pass12345')
+        self.event = PublicEvent.objects.create(
+            owner=self.owner, title='Opéra', location='Tunis', date=timezone.now() + timedelta(days=7),
+            is_paid=True, price=Decimal('20.00'), max_participants=2,
+        )
+        self.buyers = [User.objects.create_user(f'buyer{i}', f'buyer{i}@example.com', 'pass12345') for i in range(3)]
+        self.payment_url = reverse('event_payment', args=[self.event.id])
+
+    def open_checkout(self, user):
+        self.client.force_login(user)
+        return self.client.get(self.payment_url)
+
+    def test_holds_count_in_capacity_until_paid_or_expired(self):
+        self.assertEqual(self.open_checkout(self.buyers[0]).status_code, 200)
+        self.open_checkout(self.buyers[0])  # rechargement : même place retenue
+        self.assertEqual(SeatHold.objects.count(), 1)
+        response = self.client.get(reverse('event_detail', args=['public', self.event.id]))
+        self.assertEqual(response.context['seats_left'], 1)
+
+        self.open_checkout(self.buyers[1])
+        # Deux places retenues : le troisième acheteur passe en liste d'attente, sans place retenue
+        self.open_checkout(self.buyers[2])
+        self.assertTrue(WaitlistEntry.objects.filter(user=self.buyers[2]).exists())
+        self.assertEqual(SeatHold.objects.count(), 2)
+
+        self.client.force_login(self.buyers[0])
+        self.client.post(self.payment_url, {**CARD, 'amount': '20.00'})
+        guest = Guest.objects.get(event_public=self.event, email_normalized='buyer0@example.com')
+        self.assertEqual((guest.status, guest.payment_status), (Guest.STATUS_ACCEPTED, 'paid'))
+        self.assertFalse(SeatHold.objects.filter(user=self.buyers[0]).exists())
+        self.assertEqual(free_seats(self.event), 0)
+
+        # Place expirée : libre aussitôt, puis purgée en une suppression et attribuée à la file
+        SeatHold.objects.filter(user=self.buyers[1]).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(free_seats(self.event), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(2):
+                self.assertEqual(sweep_expired_holds(), 1)
+        # Événement payant : le promu reçoit une place retenue, pas une place acceptée sans échéance
+        self.assertFalse(Guest.objects.filter(event_public=self.event, email_normalized='buyer2@example.com').exists())
+        hold = SeatHold.objects.get(event=self.event, user=self.buyers[2])
+        self.assertGreater(hold.expires_at, timezone.now())
+        self.assertIn(reverse('event_payment', args=[self.event.id]),
+                      OutboundEmail.objects.get(to_email='buyer2@example.com').payload['message'])
+
+        self.client.force_login(self.buyers[2])
+        self.client.post(self.payment_url, {**CARD, 'amount': '20.00'})
+        promoted = Guest.objects.get(event_public=self.event, email_normalized='buyer2@example.com')
+        self.assertEqual((promoted.status, promoted.payment_status), (Guest.STATUS_ACCEPTED, 'paid'))
+        self.assertFalse(SeatHold.objects.exists())
+
+    def test_unpaid_promotion_passes_to_next_in_line(self):
+        for buyer in self.buyers[:2]:
+            self.open_checkout(buyer)
+        late = User.objects.create_user('late', 'late@example.com', 'pass12345')
+        for user in (self.buyers[2], late):
+            join_waitlist(self.event, user)
+
+        # buyer0 n'a pas payé : sa place passe à buyer2, qui ne paie pas non plus, puis à late
+        for expired, promoted in ((self.buyers[0], self.buyers[2]), (self.buyers[2], late)):
+            SeatHold.objects.filter(user=expired).update(expires_at=timezone.now() - timedelta(seconds=1))
+            with self.captureOnCommitCallbacks(execute=True):
+                sweep_expired_holds()
+            self.assertTrue(SeatHold.objects.filter(user=promoted, expires_at__gt=timezone.now()).exists())
+        self.assertFalse(Guest.objects.filter(event_public=self.event).exists())
+
+    def test_event_page_payment_form_holds_a_seat(self):
+        self.client.force_login(self.buyers[0])
+        detail_url = reverse('event_detail', args=['public', self.event.id])
+        self.client.get(detail_url, HTTP_SEC_PURPOSE='prefetch')
+        self.assertFalse(SeatHold.objects.exists())
+
+        response = self.client.get(detail_url)
+        hold = SeatHold.objects.get(event=self.event, user=self.buyers[0])
+        self.assertEqual(response.context['seat_hold'], hold)
+        self.assertContains(response, 'Votre place est retenue')
+
+    def test_no_hold_for_unlimited_capacity_or_prefetch(self):
+        self.client.force_login(self.buyers[0])
+        self.client.get(self.payment_url, HTTP_SEC_PURPOSE='prefetch')
+        self.assertFalse(SeatHold.objects.exists())
+
+        PublicEvent.objects.filter(pk=self.event.pk).update(max_participants=None)
+        for url in (self.payment_url, reverse('payment', args=[self.event.id])):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse(SeatHold.objects.exists())
+
+
+import threading
+
+from django.db import OperationalError
+from django.db.models.signals import post_save
+from django.test import Client
+
+from .models import Checkout
+from .utils.checkout import CheckoutError, MockGateway, PaymentDeclined, checkout, resolve_stale_checkouts
+
+
+class CountingGateway(MockGateway):
+    """Passerelle locale qui compte ses appels (partagée entre les threads du test)"""
+    charges = []
+    refunds = []
+    decline = False
+    lock = threading.Lock()
+
+    def charge(self, *, amount, idempotency_key, description=''):
+        if CountingGateway.decline:
+            raise PaymentDeclined("Carte refusée.")
+        with CountingGateway.lock:
+            CountingGateway.charges.append(idempotency_key)
+        return super().charge(amount=amount, idempotency_key=idempotency_key, description=description)
+
+    def refund(self, transaction_id):
+        CountingGateway.refunds.append(transaction_id)
+
+    @classmethod
+    def reset(cls):
+        cls.charges, cls.refunds, cls.decline = [], [], False
+
+
+@override_settings(PAYMENT_GATEWAY='events.tests.CountingGateway')
+class CheckoutTest(TestCase):
+    def setUp(self):
+        CountingGateway.reset()
+        self.owner = User.objects.create_user('caisse', 'caisse@example.com', 'pass12345')
+        self.event = PublicEvent.objects.create(
+            owner=self.owner, title='Gala', location='Tunis', date=timezone.now() + timedelta(days=7),
+            is_paid=True, price=Decimal('30.00'), max_participants=5,
+        )
+        self.buyer = User.objects.create_user('acheteur', 'acheteur@example.com', 'pass12345')
+
+    def test_double_submit_charges_and_writes_once(self):
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse('event_payment', args=[self.event.id]))
+        key = response.context['idempotency_key']
+        data = {**CARD, 'amount': '30.00', 'idempotency_key': key}
+        for url in (reverse('payment', args=[self.event.id]), reverse('payment', args=[self.event.id])):
+            self.assertRedirects(self.client.post(url, data), reverse('dashboard'), fetch_redirect_response=False)
+
+        self.assertEqual(CountingGateway.charges, [key])
+        record = Checkout.objects.get()
+        self.assertEqual(record.status, Checkout.STATUS_SUCCEEDED)
+        guest = Guest.objects.get(event_public=self.event)
+        self.assertEqual(guest.payment_status, 'paid')
+        self.assertEqual(guest.payment_transaction_id, record.transaction_id)
+        self.event.refresh_from_db()
+        self.assertEqual((self.event.accepted_count, self.event.paid_count), (1, 1))
+
+    def test_already_paid_is_not_charged_again(self):
+        first = checkout(self.event, self.buyer, '30.00', 'cle-1')
+        second = checkout(self.event, self.buyer, '30.00', 'cle-2')
+        self.assertEqual(second.status, Checkout.STATUS_SUCCEEDED)
+        self.assertEqual(second.transaction_id, first.transaction_id)
+        self.assertEqual(len(CountingGateway.charges), 1)
+
+    def test_declined_payment_can_be_retried_with_same_key(self):
+        CountingGateway.decline = True
+        with self.assertRaises(PaymentDeclined):
+            checkout(self.event, self.buyer, '30.00', 'cle')
+        self.assertEqual(Checkout.objects.get().status, Checkout.STATUS_FAILED)
+        self.assertFalse(Guest.objects.exists())
+
+        CountingGateway.decline = False
+        self.assertEqual(checkout(self.event, self.buyer, '30.00', 'cle').status, Checkout.STATUS_SUCCEEDED)
+        self.assertEqual(Checkout.objects.count(), 1)
+
+    def test_full_event_refunds_the_charge(self):
+        self.event.max_participants = 1
+        self.event.save()
+        register_user_to_public_event(self.owner, self.event)
+        with self.assertRaises(EventFull):
+            checkout(self.event, self.buyer, '30.00', 'cle')
+        record = Checkout.objects.get()
+        self.assertEqual(record.status, Checkout.STATUS_REFUNDED)
+        self.assertEqual(CountingGateway.refunds, [record.transaction_id])
+        self.assertFalse(Guest.objects.filter(user=self.buyer).exists())
+
+    def test_registration_error_refunds_and_fails_the_checkout(self):
+        with mock.patch('events.utils.checkout.register_participant', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(CheckoutError):
+                checkout(self.event, self.buyer, '30.00', 'cle')
+        record = Checkout.objects.get()
+        self.assertEqual(record.status, Checkout.STATUS_FAILED)
+        self.assertEqual(CountingGateway.refunds, [record.transaction_id])
+
+        # Même clé : nouvel essai, cette fois abouti
+        self.assertEqual(checkout(self.event, self.buyer, '30.00', 'cle').status, Checkout.STATUS_SUCCEEDED)
+        self.assertEqual(len(CountingGateway.charges), 2)
+
+    def test_stale_pending_checkouts_are_resolved(self):
+        charged = Checkout.objects.create(
+            idempotency_key='debite', user=self.buyer, event=self.event, amount=30, transaction_id='MOCK-1',
+        )
+        interrupted = Checkout.objects.create(idempotency_key='interrompu', user=self.buyer, event=self.event, amount=30)
+        recent = Checkout.objects.create(idempotency_key='recent', user=self.owner, event=self.event, amount=30)
+        Checkout.objects.filter(pk__in=[charged.pk, interrupted.pk]).update(
+            updated_at=timezone.now() - timedelta(hours=1),
+        )
+
+        self.assertEqual(resolve_stale_checkouts(), 2)
+        self.assertEqual(CountingGateway.refunds, ['MOCK-1'])
+        statuses = dict(Checkout.objects.values_list('idempotency_key', 'status'))
+        self.assertEqual(statuses, {
+            'debite': Checkout.STATUS_FAILED, 'interrompu': Checkout.STATUS_FAILED, 'recent': Checkout.STATUS_PENDING,
+        })
+
+    def test_wrong_amount_is_rejected_before_any_charge(self):
+        self.client.force_login(self.buyer)
+        self.client.post(reverse('event_payment', args=[self.event.id]), {**CARD, 'amount': '10.00'})
+        self.assertFalse(Checkout.objects.exists())
+        self.assertEqual(CountingGateway.charges, [])
+
+
+@override_settings(PAYMENT_GATEWAY='events.tests.CountingGateway')
+class CheckoutRushTest(FileDatabaseTestCase):
+    SUBMITS = 50
+
+    def test_duplicate_submits_collapse_to_one_write(self):
+        CountingGateway.reset()
+        owner = User.objects.create_user('guichet', 'guichet@example.com', 'pass12345')
+        event = PublicEvent.objects.create(
+            owner=owner, title='Festival', location='Tunis', date=timezone.now() + timedelta(days=7),
+            is_paid=True, price=Decimal('15.00'), max_participants=100,
+        )
+        buyer = User.objects.create_user('presse', 'presse@example.com', 'pass12345')
+        url = reverse('event_payment', args=[event.id])
+        data = {**CARD, 'amount': '15.00', 'idempotency_key': 'double-clic'}
+        clients = []
+        for _ in range(self.SUBMITS):
+            client = Client()
+            client.force_login(buyer)
+            clients.append(client)
+
+        guest_writes = []
+        counter = lambda sender, instance, **kwargs: guest_writes.append(instance.pk)
+        post_save.connect(counter, sender=Guest)
+
+        def submit(client):
+            try:
+                return client.post(url, data).status_code
+            finally:
+                connections.close_all()
+
+        try:
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                statuses = list(pool.map(submit, clients))
+        finally:
+            post_save.disconnect(counter, sender=Guest)
+
+        self.assertEqual(set(statuses), {302})
+        self.assertEqual(len(CountingGateway.charges), 1)
+        self.assertEqual(len(guest_writes), 1)
+        self.assertEqual(Checkout.objects.count(), 1)
+        self.assertEqual(Guest.objects.filter(event_public=event, payment_status='paid').count(), 1)
+        event.refresh_from_db()
+        self.assertEqual((event.accepted_count, event.paid_count), (1, 1))
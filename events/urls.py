@@ -96,6 +96,7 @@ urlpatterns = [
     # Admin Statistics
     # ==============================
     path('admin/stats/', views.admin_stats, name='admin_stats'),
+    path('admin/stats/chart/', views.admin_stats_chart, name='admin_stats_chart'),
 
     # ==============================
     # Public pages
@@ -108,6 +109,7 @@ urlpatterns = [
     # Public/Private event lists
     # ==============================
     path('public/', views.public_events, name='public_events'),
+    path('public/feed/', views.public_events_feed, name='public_events_feed'),
     path('private/', views.private_events, name='private_events'),
 
     path('join-public-event/<int:event_id>/', views.join_public_event, name='join_public_event'),
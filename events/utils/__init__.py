@@ -1,6 +1,6 @@
 # This file makes the utils directory a Python package
 
 # Import des utilitaires pour les rendre disponibles lors de l'import du package
-from .email_utils import send_private_event_invitation, generate_qr_code
+from .email_utils import send_private_event_invitation, generate_qr_code, send_bulk_messages
 
-__all__ = ['send_private_event_invitation', 'generate_qr_code']
+__all__ = ['send_private_event_invitation', 'generate_qr_code', 'send_bulk_messages']
@@ -0,0 +1,125 @@
+"""
+Instantané du tableau de bord administrateur (admin_stats), mis en cache.
+
+L'instantané (totaux, derniers événements, histogramme mensuel lu dans les
+agrégats EventStat) est recalculé au plus une fois par ADMIN_STATS_TTL secondes :
+- frais : servi tel quel ;
+- périmé (jusqu'à ADMIN_STATS_STALE_TTL secondes de plus) : une seule requête,
+  celle qui obtient le verrou, le recalcule ; les autres servent l'ancien sans attendre ;
+- absent : la requête qui obtient le verrou le calcule, les autres l'attendent
+  brièvement plutôt que de lancer chacune le même calcul.
+`manage.py refresh_admin_stats` le recalcule (tâche périodique), les pages
+n'ont alors jamais à le faire.
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Sum
+
+SNAPSHOT_KEY = 'admin_stats:snapshot'
+LOCK_KEY = 'admin_stats:refresh_lock'
+# Durée maximale d'un recalcul : au-delà, le verrou expire (processus tué...)
+LOCK_TIMEOUT = 30
+# Attente d'un instantané en cours de calcul, quand il n'y en a aucun en cache
+WAIT_TIMEOUT = 5
+WAIT_INTERVAL = 0.05
+
+
+def _cache():
+    return caches[getattr(settings, 'ADMIN_STATS_CACHE_ALIAS', 'default')]
+
+
+def _ttl():
+    return getattr(settings, 'ADMIN_STATS_TTL', 60)
+
+
+def compute_snapshot():
+    """Calcule l'instantané (valeurs simples, sérialisables) en quelques requêtes"""
+    from ..models import EventStat, PrivateEvent, PublicEvent, User
+
+    by_kind = dict(
+        EventStat.objects.filter(period=EventStat.PERIOD_MONTH)
+        .values('kind').annotate(n=Sum('events')).values_list('kind', 'n')
+    )
+    public_count = by_kind.get('public') or 0
+    private_count = by_kind.get('private') or 0
+
+    recent = []
+    for model, is_public in ((PublicEvent, True), (PrivateEvent, False)):
+        for event in model.objects.select_related('owner').order_by('-created_at', '-pk')[:5]:
+            recent.append({
+                'title': event.title,
+                'date': event.date,
+                'location': event.location,
+                'is_public': is_public,
+                'owner': event.owner.username,
+                'created_at': event.created_at,
+            })
+    recent.sort(key=lambda e: (e['created_at'] is not None, e['created_at']), reverse=True)
+
+    # Histogramme : événements par mois de l'événement, publics et privés confondus
+    months = (
+        EventStat.objects.filter(period=EventStat.PERIOD_MONTH, events__gt=0)
+        .values('period_start').annotate(n=Sum('events')).order_by('period_start')
+        .values_list('period_start', 'n')
+    )
+    labels, counts = [], []
+    for start, count in months:
+        labels.append(start.strftime('%b %Y'))
+        counts.append(count)
+
+    return {
+        'total_users': User.objects.count(),
+        'total_events': public_count + private_count,
+        'public_events_count': public_count,
+        'private_events_count': private_count,
+        'recent_events': recent[:5],
+        'months': labels,
+        'event_counts': counts,
+    }
+
+
+def refresh_snapshot():
+    """Recalcule l'instantané et le met en cache ; le retourne"""
+    snapshot = {'computed_at': time.time(), 'data': compute_snapshot()}
+    stale_ttl = getattr(settings, 'ADMIN_STATS_STALE_TTL', 3600)
+    _cache().set(SNAPSHOT_KEY, snapshot, timeout=_ttl() + stale_ttl)
+    return snapshot
+
+
+def _refresh_if_leader():
+    """Recalcule l'instantané si aucun autre recalcul n'est en cours ; None sinon"""
+    cache = _cache()
+    token = uuid.uuid4().hex
+    if not cache.add(LOCK_KEY, token, timeout=LOCK_TIMEOUT):
+        return None
+    try:
+        return refresh_snapshot()
+    finally:
+        if cache.get(LOCK_KEY) == token:
+            cache.delete(LOCK_KEY)
+
+
+def get_snapshot():
+    """Données de l'instantané, éventuellement périmées (voir docstring du module)"""
+    cache = _cache()
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is not None and time.time() - snapshot['computed_at'] < _ttl():
+        return snapshot['data']
+
+    refreshed = _refresh_if_leader()
+    if refreshed is not None:
+        return refreshed['data']
+    if snapshot is not None:
+        return snapshot['data']
+
+    # Premier calcul en cours dans une autre requête : l'attendre plutôt que le dupliquer
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        snapshot = cache.get(SNAPSHOT_KEY)
+        if snapshot is not None:
+            return snapshot['data']
+    return compute_snapshot()
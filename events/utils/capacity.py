@@ -0,0 +1,152 @@
+"""
+Places limitées des événements publics (max_participants).
+
+Une place se réserve dans la transaction qui enregistre l'invité : un UPDATE
+conditionnel sur le compteur matérialisé accepted_count (« encore de la place ? »)
+verrouille la ligne de l'événement jusqu'à la fin de la transaction. Les inscriptions
+concurrentes sont ainsi sérialisées et relisent le compteur déjà incrémenté par
+l'inscription précédente (utils/counters.py) : l'événement ne peut pas être survendu.
+
+Les places retenues pendant un paiement (SeatHold, SEAT_HOLD_TTL secondes) comptent
+dans la capacité jusqu'à leur expiration ; `manage.py sweep_seat_holds` supprime
+ensuite les places expirées en une requête.
+"""
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+class EventFull(Exception):
+    """Plus aucune place disponible"""
+
+
+def active_holds(exclude_user=None):
+    """Sous-requête : places retenues non expirées de l'événement (sauf celle de `exclude_user`)"""
+    from ..models import SeatHold
+
+    holds = SeatHold.objects.filter(event=OuterRef('pk'), expires_at__gt=timezone.now())
+    if exclude_user is not None:
+        holds = holds.exclude(user=exclude_user)
+    return Coalesce(
+        Subquery(holds.order_by().values('event').annotate(n=Count('pk')).values('n')), Value(0),
+    )
+
+
+def has_room(exclude_user=None):
+    """Condition SQL : capacité illimitée, ou supérieure aux invités acceptés + places retenues"""
+    return (
+        Q(max_participants__isnull=True) | Q(max_participants=0) |
+        Q(max_participants__gt=F('accepted_count') + active_holds(exclude_user))
+    )
+
+
+@contextmanager
+def seat_transaction():
+    """
+    Transaction d'une réservation de place (à la place de transaction.atomic()).
+    Sous SQLite, la transaction la plus externe s'ouvre en BEGIN IMMEDIATE : le verrou
+    d'écriture est pris dès le début, et les réservations concurrentes attendent (timeout)
+    au lieu d'échouer en « database is locked » en passant de la lecture à l'écriture.
+    Les autres transactions du projet gardent le mode par défaut
+    """
+    connection = transaction.get_connection()
+    immediate = connection.vendor == 'sqlite' and not connection.in_atomic_block
+    previous = getattr(connection, 'transaction_mode', None)
+    if immediate:
+        connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic():
+            # BEGIN émis : les transactions suivantes de la connexion reprennent le mode par défaut
+            if immediate:
+                connection.transaction_mode = previous
+            yield
+    finally:
+        if immediate:
+            connection.transaction_mode = previous
+
+
+def claim_seat(event, user=None):
+    """
+    À appeler dans seat_transaction(), avant d'accepter un invité : vrai s'il reste une place
+    (celle que `user` retient compte comme libre pour lui), la ligne de l'événement restant
+    verrouillée jusqu'au commit
+    """
+    from ..models import PublicEvent
+
+    # SET accepted_count = accepted_count : UPDATE sans effet, pour le verrou et la condition
+    return PublicEvent.objects.filter(pk=event.pk).filter(has_room(user)).update(
+        accepted_count=F('accepted_count'),
+    ) > 0
+
+
+def free_seats(event):
+    """Places disponibles (places retenues déduites), None si la capacité est illimitée"""
+    from ..models import PublicEvent
+
+    if not event.max_participants:
+        return None
+    taken = PublicEvent.objects.filter(pk=event.pk).annotate(
+        taken=F('accepted_count') + active_holds(),
+    ).values_list('max_participants', 'taken').first()
+    if taken is None:
+        return 0
+    return max(taken[0] - taken[1], 0)
+
+
+# ----------------------------------------------------------
+# Places retenues pendant le paiement
+# ----------------------------------------------------------
+def hold_expiry(now=None):
+    """Échéance d'une place retenue maintenant (SEAT_HOLD_TTL secondes)"""
+    return (now or timezone.now()) + timedelta(seconds=getattr(settings, 'SEAT_HOLD_TTL', 600))
+
+
+def hold_seat(event, user):
+    """
+    Retient une place pour `user` pendant SEAT_HOLD_TTL secondes (page de paiement) ;
+    une place encore retenue est rendue telle quelle, sans prolongation. Lève EventFull
+    """
+    from ..models import SeatHold
+
+    now = timezone.now()
+    with seat_transaction():
+        hold = SeatHold.objects.filter(event=event, user=user).first()
+        if hold is not None and hold.expires_at > now:
+            return hold
+        if not claim_seat(event, user):
+            raise EventFull
+        hold, _ = SeatHold.objects.update_or_create(
+            event=event, user=user,
+            defaults={'expires_at': hold_expiry(now)},
+        )
+        return hold
+
+
+def release_hold(event, user):
+    """Libère la place retenue par `user` (convertie en inscription, ou abandonnée)"""
+    from ..models import SeatHold
+
+    SeatHold.objects.filter(event=event, user=user).delete()
+
+
+def sweep_expired_holds(now=None):
+    """
+    Supprime les places retenues expirées (une suppression sur la plage d'expiration indexée)
+    et fait avancer les listes d'attente concernées ; retourne le nombre de places libérées
+    """
+    from ..models import SeatHold
+    from .waitlist import schedule_promotion
+
+    expired = SeatHold.objects.filter(expires_at__lte=now or timezone.now())
+    event_ids = list(expired.order_by().values_list('event_id', flat=True).distinct())
+    if not event_ids:
+        return 0
+    deleted, _ = expired.delete()
+    for event_id in event_ids:
+        schedule_promotion(event_id)
+    return deleted
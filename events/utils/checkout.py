@@ -0,0 +1,308 @@
+"""
+Inscription payante aux événements publics (checkout), commune aux trois formulaires
+de paiement (page de l'événement, `payment_view`, `event_payment`).
+
+- Chaque soumission porte une clé d'idempotence (champ caché généré à l'affichage du
+  formulaire) : la ligne Checkout est créée sous cette clé unique, et seule la requête
+  qui la crée débite. Un double clic ou un rechargement retrouve la ligne existante,
+  sans second débit ni seconde écriture.
+- Le débit passe par la passerelle configurée (PAYMENT_GATEWAY), hors transaction :
+  la ligne de l'événement n'est pas verrouillée pendant l'appel réseau.
+- Place, invité, RSVP et statut du paiement sont ensuite écrits en une transaction.
+  Si l'événement s'est rempli entre-temps, ou si cette écriture échoue, le paiement
+  est remboursé.
+- `manage.py resolve_stale_checkouts` solde les paiements restés « en cours » plus de
+  CHECKOUT_PENDING_TIMEOUT secondes (processus interrompu entre le débit et l'écriture).
+"""
+import logging
+import uuid
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .capacity import EventFull, claim_seat, release_hold, seat_transaction
+from .guests import guest_match, normalize_email
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+DEFAULT_PENDING_TIMEOUT = 15 * 60  # secondes
+
+
+class CheckoutError(Exception):
+    """Paiement refusé avant ou pendant le débit ; le message s'affiche tel quel"""
+
+
+class PaymentDeclined(CheckoutError):
+    """Débit refusé par la passerelle"""
+
+
+# ----------------------------------------------------------
+# Passerelles de paiement
+# ----------------------------------------------------------
+class BasePaymentGateway:
+    """
+    Passerelle de paiement.
+    `charge` débite et retourne l'identifiant de transaction (lève PaymentDeclined) ;
+    la clé d'idempotence est transmise pour que la passerelle dédoublonne elle aussi.
+    `refund` rembourse une transaction.
+    """
+
+    def charge(self, *, amount, idempotency_key, description=''):
+        raise NotImplementedError
+
+    def refund(self, transaction_id):
+        raise NotImplementedError
+
+
+class MockGateway(BasePaymentGateway):
+    """Passerelle locale (développement, tests) : tout débit réussit"""
+
+    def charge(self, *, amount, idempotency_key, description=''):
+        # Identifiant aléatoire : deux paiements dans la même seconde ne se confondent pas
+        return f"MOCK-{uuid.uuid4().hex}"
+
+    def refund(self, transaction_id):
+        return None
+
+
+def get_gateway():
+    """
+    Retourne la passerelle configurée par PAYMENT_GATEWAY
+    ('mock', ou chemin d'une classe BasePaymentGateway)
+    """
+    backend = getattr(settings, 'PAYMENT_GATEWAY', 'mock')
+    if backend == 'mock':
+        return MockGateway()
+    return import_string(backend)()
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def idempotency_key_from(data):
+    """Clé soumise avec le formulaire ; une nouvelle clé si elle manque ou est invalide"""
+    key = (data.get('idempotency_key') or '').strip()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return new_idempotency_key()
+    return key
+
+
+# ----------------------------------------------------------
+# Inscription
+# ----------------------------------------------------------
+def has_seat(event, user):
+    """Vrai si l'utilisateur occupe déjà une place (invité accepté, non remboursé)"""
+    from ..models import Guest
+
+    return Guest.objects.filter(
+        guest_match(user), event_public=event, status=Guest.STATUS_ACCEPTED,
+    ).exclude(payment_status='refunded').exists()
+
+
+def register_participant(event, user, *, paid=False, amount=None, transaction_id=None):
+    """
+    Inscrit un utilisateur à un événement public (gratuit ou payé), en une transaction
+    qui réserve sa place : lève EventFull si l'événement est complet. L'invité et le RSVP
+    sont lus une fois puis créés, ou mis à jour seulement sur les champs qui changent
+    """
+    from ..models import Guest, RSVP
+
+    email = normalize_email(user.email)
+
+    with seat_transaction():
+        # Verrou sur l'événement, puis capacité (un participant déjà accepté garde sa place,
+        # une place retenue pour le paiement est convertie)
+        if not claim_seat(event, user) and not has_seat(event, user):
+            raise EventFull
+        release_hold(event, user)
+
+        now = timezone.now()
+        values = {'status': Guest.STATUS_ACCEPTED}
+        if paid:
+            values.update({
+                'payment_status': 'paid',
+                'payment_amount': Decimal(str(amount)) if amount else None,
+                'payment_transaction_id': transaction_id,
+                'payment_date': now,
+            })
+
+        # Invitation rattachée au compte d'abord (l'email a pu changer depuis)
+        guest = Guest.objects.filter(guest_match(user), event_public=event).order_by(
+            F('user').asc(nulls_last=True),
+        ).first()
+        if guest is None:
+            guest = Guest.objects.create(event_public=event, email=email, user=user, **values)
+        else:
+            changed = [field for field, value in values.items() if getattr(guest, field) != value]
+            for field in changed:
+                setattr(guest, field, values[field])
+            if changed:
+                guest.save(update_fields=changed)
+
+        rsvp = RSVP.objects.filter(event_public=event, user=user).first()
+        if rsvp is None:
+            RSVP.objects.create(event_public=event, user=user, response='yes', created_at=now)
+        elif rsvp.response != 'yes':
+            rsvp.response = 'yes'
+            rsvp.save(update_fields=['response'])
+
+        return guest
+
+
+# ----------------------------------------------------------
+# Paiement
+# ----------------------------------------------------------
+def _open_checkout(event, user, amount, idempotency_key):
+    """
+    Crée la ligne Checkout de cette clé ; retourne (ligne, à traiter). Une ligne existante
+    n'est à traiter que si son paiement a échoué et que cette requête la reprend
+    """
+    from ..models import Checkout
+
+    try:
+        with transaction.atomic():
+            return Checkout.objects.create(
+                idempotency_key=idempotency_key, user=user, event=event, amount=amount,
+            ), True
+    except IntegrityError:
+        # Resoumission : la requête qui a créé la ligne la traite (ou l'a déjà traitée)
+        pass
+
+    record = Checkout.objects.get(idempotency_key=idempotency_key)
+    if record.user_id != user.pk or record.event_id != event.pk:
+        raise CheckoutError("Ce formulaire de paiement n'est plus valable, veuillez recommencer.")
+    retried = record.status == Checkout.STATUS_FAILED and Checkout.objects.filter(
+        pk=record.pk, status=Checkout.STATUS_FAILED,
+    ).update(
+        status=Checkout.STATUS_PENDING, amount=amount, transaction_id=None, error='', updated_at=timezone.now(),
+    ) > 0
+    if retried:
+        record.refresh_from_db()
+    return record, retried
+
+
+def _update_checkout(record, **fields):
+    from ..models import Checkout
+
+    fields['updated_at'] = timezone.now()
+    Checkout.objects.filter(pk=record.pk).update(**fields)
+    for field, value in fields.items():
+        setattr(record, field, value)
+    return record
+
+
+def _refund(gateway, transaction_id):
+    """Rembourse une transaction ; faux si la passerelle échoue (remboursement à faire à la main)"""
+    try:
+        gateway.refund(transaction_id)
+        return True
+    except Exception as e:
+        logger.error(f"Erreur lors du remboursement {transaction_id}: {str(e)}")
+        return False
+
+
+def checkout(event, user, amount, idempotency_key, gateway=None):
+    """
+    Paiement d'une inscription ; retourne la ligne Checkout (statut succeeded, ou celui
+    de la soumission d'origine pour une resoumission). Lève CheckoutError (montant,
+    refus de la passerelle) ou EventFull (événement complet, paiement remboursé)
+    """
+    from ..models import Checkout, Guest
+
+    try:
+        amount = Decimal(str(amount))
+    except (InvalidOperation, TypeError, ValueError):
+        raise CheckoutError("Montant invalide.")
+    if event.price is None or amount != Decimal(str(event.price)):
+        raise CheckoutError(f"Le montant doit être de {event.price or 0:.2f} DT.")
+
+    record, owned = _open_checkout(event, user, amount, idempotency_key)
+    if not owned:
+        return record
+
+    # Déjà payé (autre formulaire, autre onglet) : rien à débiter
+    paid_guest = Guest.objects.filter(
+        guest_match(user), event_public=event, status=Guest.STATUS_ACCEPTED, payment_status='paid',
+    ).first()
+    if paid_guest is not None:
+        return _update_checkout(
+            record, status=Checkout.STATUS_SUCCEEDED, transaction_id=paid_guest.payment_transaction_id,
+        )
+
+    gateway = gateway or get_gateway()
+    try:
+        transaction_id = gateway.charge(
+            amount=amount, idempotency_key=idempotency_key, description=f"{event.title} ({user.username})",
+        )
+    except PaymentDeclined as e:
+        _update_checkout(record, status=Checkout.STATUS_FAILED, error=str(e)[:255])
+        raise
+    except Exception as e:
+        logger.error(f"Erreur lors du paiement {idempotency_key}: {str(e)}")
+        _update_checkout(record, status=Checkout.STATUS_FAILED, error=str(e)[:255])
+        raise CheckoutError("Le paiement n'a pas pu être effectué, veuillez réessayer.")
+
+    # Débit noté aussitôt : une ligne restée en cours sera remboursée (resolve_stale_checkouts)
+    _update_checkout(record, transaction_id=transaction_id)
+
+    try:
+        with seat_transaction():
+            register_participant(event, user, paid=True, amount=amount, transaction_id=transaction_id)
+            return _update_checkout(record, status=Checkout.STATUS_SUCCEEDED)
+    except EventFull:
+        # Complet entre l'affichage du formulaire et le débit : remboursé
+        if _refund(gateway, transaction_id):
+            _update_checkout(record, status=Checkout.STATUS_REFUNDED)
+        else:
+            _update_checkout(record, status=Checkout.STATUS_FAILED, error="Remboursement à vérifier (événement complet)")
+        raise
+    except Exception as e:
+        # Écriture impossible (base verrouillée...) : ni inscription ni paiement en suspens
+        logger.error(f"Erreur lors de l'inscription du paiement {idempotency_key}: {str(e)}")
+        refunded = _refund(gateway, transaction_id)
+        _update_checkout(
+            record, status=Checkout.STATUS_FAILED,
+            error="Inscription impossible, paiement remboursé" if refunded else "Inscription impossible, remboursement à vérifier",
+        )
+        raise CheckoutError(
+            "Votre inscription n'a pas pu être enregistrée"
+            + (" et votre paiement a été remboursé" if refunded else "")
+            + ", veuillez réessayer."
+        )
+
+
+def resolve_stale_checkouts(now=None, gateway=None):
+    """
+    Solde les paiements restés en cours plus de CHECKOUT_PENDING_TIMEOUT secondes :
+    débités (transaction notée) → remboursés, puis échoués ; sans débit noté → échoués
+    (la passerelle dédoublonne un nouvel essai par la clé d'idempotence).
+    Retourne le nombre de lignes soldées
+    """
+    from ..models import Checkout
+
+    cutoff = (now or timezone.now()) - timedelta(
+        seconds=getattr(settings, 'CHECKOUT_PENDING_TIMEOUT', DEFAULT_PENDING_TIMEOUT),
+    )
+    stale = Checkout.objects.filter(status=Checkout.STATUS_PENDING, updated_at__lt=cutoff)
+    gateway = gateway or get_gateway()
+    resolved = 0
+    for record in stale.order_by('pk'):
+        # UPDATE conditionnel d'abord : une ligne reprise entre-temps n'est ni soldée ni remboursée
+        if not stale.filter(pk=record.pk).update(
+            status=Checkout.STATUS_FAILED, error="Paiement interrompu", updated_at=timezone.now(),
+        ):
+            continue
+        resolved += 1
+        if record.transaction_id:
+            refunded = _refund(gateway, record.transaction_id)
+            Checkout.objects.filter(pk=record.pk).update(
+                error="Paiement interrompu, remboursé" if refunded else "Paiement interrompu, remboursement à vérifier",
+            )
+    return resolved
@@ -0,0 +1,228 @@
+"""
+Compteurs de participation dénormalisés sur les événements
+(accepted_count, paid_count, rsvp_yes_count, et leur total participants_count).
+
+Chaque écriture d'un Guest ou d'un RSVP (save, bulk_create, suppression) applique
+la différence d'état « compté » par un UPDATE atomique avec F() ; bulk_update et
+update() recomptent les événements touchés. Les suppressions (QuerySet.delete(),
+cascades) sont regroupées : un UPDATE par événement, quel que soit le nombre de lignes.
+`recount_events` répare toute dérive.
+Les variations sont reportées sur les statistiques agrégées (utils/stats.py).
+"""
+import threading
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+COUNTER_FIELDS = ('accepted_count', 'paid_count', 'rsvp_yes_count')
+
+# Suppressions en cours : {id(origine): [origine, lignes restantes, états retirés]}
+_deleting = threading.local()
+
+def _event_key(obj):
+    if obj.event_private_id:
+        return ('private', obj.event_private_id)
+    if obj.event_public_id:
+        return ('public', obj.event_public_id)
+    return None
+
+
+def guest_state(guest):
+    """Contribution d'un invité aux compteurs : (événement, {compteur: 0/1})"""
+    from ..models import Guest
+
+    return _event_key(guest), {
+        # Un invité remboursé libère sa place
+        'accepted_count': int(guest.status == Guest.STATUS_ACCEPTED and guest.payment_status != 'refunded'),
+        'paid_count': int(guest.payment_status == 'paid'),
+    }
+
+
+def rsvp_state(rsvp):
+    """Contribution d'un RSVP aux compteurs"""
+    return _event_key(rsvp), {'rsvp_yes_count': int(rsvp.response == 'yes')}
+
+
+def _event_model(kind):
+    from ..models import PrivateEvent, PublicEvent
+
+    return PrivateEvent if kind == 'private' else PublicEvent
+
+
+def _shifted(field, delta):
+    # Plancher à 0 : une dérive éventuelle ne doit pas faire échouer l'écriture (colonnes positives)
+    if not delta:
+        return F(field)
+    return F(field) + delta if delta > 0 else Greatest(F(field) + delta, Value(0))
+
+
+def participants_expression(kind, counts=None):
+    """participants_count recalculé à partir des compteurs (après application de `counts`)"""
+    counts = counts or {}
+    accepted = _shifted('accepted_count', counts.get('accepted_count', 0))
+    if kind == 'private':
+        return accepted
+    return _shifted('rsvp_yes_count', counts.get('rsvp_yes_count', 0)) + Greatest(
+        accepted, _shifted('paid_count', counts.get('paid_count', 0)),
+    )
+
+
+def apply_deltas(deltas):
+    """
+    `deltas` : {(type, id): Counter({compteur: delta})} → un UPDATE ... SET x = x + delta par événement
+    (participants_count compris), reporté sur les statistiques agrégées
+    """
+    from . import stats, waitlist
+
+    for (kind, event_id), counts in deltas.items():
+        changes = {field: _shifted(field, delta) for field, delta in counts.items() if delta}
+        if changes:
+            stats.add_participations(
+                kind, event_id, counts.get('accepted_count', 0), counts.get('rsvp_yes_count', 0),
+            )
+            # Toutes les expressions du SET lisent les valeurs d'avant la mise à jour
+            changes['participants_count'] = participants_expression(kind, counts)
+            _event_model(kind).objects.filter(pk=event_id).update(**changes)
+            if kind == 'public' and counts.get('accepted_count', 0) < 0:
+                waitlist.schedule_promotion(event_id)
+
+
+def apply_state_change(old, new):
+    """Applique la différence entre deux états comptés (None = absent)"""
+    deltas = defaultdict(Counter)
+    if old and old[0]:
+        for field, value in old[1].items():
+            deltas[old[0]][field] -= value
+    if new and new[0]:
+        for field, value in new[1].items():
+            deltas[new[0]][field] += value
+    apply_deltas(deltas)
+
+
+def add_states(states, sign=1):
+    """Ajoute (ou retire, sign=-1) en une passe les contributions de plusieurs lignes"""
+    deltas = defaultdict(Counter)
+    for key, counts in states:
+        if key:
+            for field, value in counts.items():
+                deltas[key][field] += sign * value
+    apply_deltas(deltas)
+
+
+def _pending_deletes():
+    if not hasattr(_deleting, 'pending'):
+        _deleting.pending = {}
+    return _deleting.pending
+
+
+def delete_started(origin):
+    """
+    pre_delete d'une ligne comptée : Django envoie tous les pre_delete d'une suppression
+    (même `origin`) avant ses post_delete, on sait donc combien de lignes attendre
+    """
+    if origin is None:
+        return
+    pending = _pending_deletes()
+    entry = pending.get(id(origin))
+    if entry is None or entry[0] is not origin:
+        # Nouvelle suppression (ou reste d'une suppression interrompue par une erreur)
+        entry = pending[id(origin)] = [origin, 0, []]
+    entry[1] += 1
+
+
+def delete_finished(origin, state):
+    """
+    post_delete d'une ligne comptée : son état est mis de côté, puis retiré des compteurs
+    avec ceux des autres lignes de la même suppression à la dernière d'entre elles
+    """
+    entry = _pending_deletes().get(id(origin)) if origin is not None else None
+    if entry is None or entry[0] is not origin:
+        apply_state_change(state, None)
+        return
+    entry[1] -= 1
+    entry[2].append(state)
+    if entry[1] <= 0:
+        del _pending_deletes()[id(origin)]
+        add_states(entry[2], sign=-1)
+
+
+def event_keys(queryset):
+    """Événements (type, id) référencés par un queryset de Guest ou de RSVP"""
+    keys = set()
+    for private_id, public_id in queryset.values_list('event_private_id', 'event_public_id').distinct():
+        if private_id:
+            keys.add(('private', private_id))
+        if public_id:
+            keys.add(('public', public_id))
+    return keys
+
+
+def event_keys_from_values(values):
+    """Événements cibles d'un `update(event_public=...)` / `update(event_private_id=...)`"""
+    keys = set()
+    for kind in ('private', 'public'):
+        for field in (f'event_{kind}', f'event_{kind}_id'):
+            target = values.get(field)
+            if target is not None:
+                keys.add((kind, getattr(target, 'pk', target)))
+    return keys
+
+
+def _count(model, fk, *conditions, **filters):
+    subquery = (
+        model.objects.filter(*conditions, **{fk: OuterRef('pk')}, **filters)
+        .order_by().values(fk).annotate(c=Count('pk')).values('c')
+    )
+    return Coalesce(Subquery(subquery), Value(0))
+
+
+def recount_events(model, ids=None):
+    """
+    Recalcule les compteurs d'un modèle d'événement (tous, ou seulement `ids`)
+    en un seul UPDATE avec sous-requêtes
+    """
+    from ..models import Guest, PrivateEvent, RSVP
+
+    kind = 'private' if model is PrivateEvent else 'public'
+    fk = f'event_{kind}'
+    queryset = model.objects.all() if ids is None else model.objects.filter(pk__in=ids)
+    rows = queryset.update(
+        accepted_count=_count(Guest, fk, ~Q(payment_status='refunded'), status=Guest.STATUS_ACCEPTED),
+        paid_count=_count(Guest, fk, payment_status='paid'),
+        rsvp_yes_count=_count(RSVP, fk, response='yes'),
+    )
+    queryset.update(participants_count=participants_expression(kind))
+    return rows
+
+
+def recount_keys(keys):
+    """
+    Recompte une liste d'événements (type, id), reporte les écarts sur les statistiques
+    et fait avancer la liste d'attente des événements qui ont perdu des participants
+    """
+    from . import stats, waitlist
+
+    by_kind = defaultdict(list)
+    for kind, event_id in keys:
+        by_kind[kind].append(event_id)
+    for kind, ids in by_kind.items():
+        model = _event_model(kind)
+        participations = F('accepted_count') + F('rsvp_yes_count')
+        before = {
+            pk: (accepted, total)
+            for pk, accepted, total in model.objects.filter(pk__in=ids).annotate(p=participations)
+            .values_list('pk', 'accepted_count', 'p')
+        }
+        recount_events(model, ids)
+        after = model.objects.filter(pk__in=ids).annotate(p=participations).values_list(
+            'pk', 'date', 'accepted_count', 'p',
+        )
+        changes = defaultdict(lambda: (0, 0))
+        for pk, date, accepted, total in after:
+            old_accepted, old_total = before.get(pk, (accepted, total))
+            if total != old_total:
+                changes[date] = (0, changes[date][1] + total - old_total)
+            if kind == 'public' and accepted < old_accepted:
+                waitlist.schedule_promotion(pk)
+        stats.bump_many(kind, changes)
@@ -0,0 +1,23 @@
+"""
+Curseurs opaques de pagination par clé (keyset) : un couple (date, entier)
+encodé en base64 urlsafe, sans padding.
+"""
+import base64
+from datetime import datetime
+
+
+def encode_cursor(sort_at, row_key):
+    raw = f"{sort_at.isoformat()}|{row_key}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Retourne (sort_at, row_key) ou None si le curseur est invalide"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        sort_at, row_key = raw.rsplit('|', 1)
+        return datetime.fromisoformat(sort_at), int(row_key)
+    except (ValueError, UnicodeDecodeError):
+        return None
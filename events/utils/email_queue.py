@@ -0,0 +1,269 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger('email_utils')
+
+# Valeurs par défaut, surchargeables dans settings.py
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_BACKOFF_BASE = 30          # secondes
+DEFAULT_BACKOFF_MAX = 60 * 60      # 1 heure
+DEFAULT_LOCK_TIMEOUT = 10 * 60     # un worker qui plante libère ses emails après 10 min
+DEFAULT_RETENTION_DAYS = 7         # emails envoyés ou abandonnés conservés une semaine
+
+
+class ObsoleteEmail(Exception):
+    """Email devenu sans objet (ex. code 2FA expiré) : abandonné sans nouvel essai"""
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue_email(kind, to_email, payload=None, priority=None):
+    """
+    Ajoute un email dans la file d'attente et retourne la ligne créée
+    """
+    from ..models import OutboundEmail
+
+    return OutboundEmail.objects.create(
+        kind=kind,
+        to_email=to_email,
+        payload=payload or {},
+        priority=OutboundEmail.PRIORITY_NORMAL if priority is None else priority,
+        max_attempts=_setting('EMAIL_QUEUE_MAX_ATTEMPTS', 5),
+    )
+
+
+def enqueue_private_event_invitations(event, invitations):
+    """
+    Met en file les invitations d'un événement privé en une seule requête.
+    `invitations` est une liste de tuples (email, rsvp_url).
+    """
+    from ..models import OutboundEmail
+
+    max_attempts = _setting('EMAIL_QUEUE_MAX_ATTEMPTS', 5)
+    rows = [
+        OutboundEmail(
+            kind=OutboundEmail.KIND_PRIVATE_INVITATION,
+            to_email=email,
+            payload={'event_id': event.id, 'rsvp_url': rsvp_url},
+            priority=OutboundEmail.PRIORITY_BULK,
+            max_attempts=max_attempts,
+        )
+        for email, rsvp_url in invitations
+    ]
+    return OutboundEmail.objects.bulk_create(rows)
+
+
+def backoff_delay(attempts):
+    """Délai avant la prochaine tentative : base * 2^(tentatives-1), plafonné"""
+    base = _setting('EMAIL_QUEUE_BACKOFF_BASE', DEFAULT_BACKOFF_BASE)
+    ceiling = _setting('EMAIL_QUEUE_BACKOFF_MAX', DEFAULT_BACKOFF_MAX)
+    return timedelta(seconds=min(base * (2 ** max(attempts - 1, 0)), ceiling))
+
+
+# ----------------------------------------------------------
+# Construction des messages, selon le type d'email
+# ----------------------------------------------------------
+def _build_private_invitation(item, cache):
+    from ..models import PrivateEvent
+    from .email_utils import PrivateEventInvitationRenderer, build_private_event_invitation
+
+    # Un seul rendu du template par événement pour tout le lot
+    event_id = item.payload['event_id']
+    key = ('private_invitation', event_id)
+    if key not in cache:
+        event = PrivateEvent.objects.select_related('owner').get(id=event_id)
+        cache[key] = PrivateEventInvitationRenderer(event)
+    renderer = cache[key]
+    return build_private_event_invitation(renderer.event, item.to_email, item.payload['rsvp_url'], renderer=renderer)
+
+
+def _build_rsvp_confirmation(item, cache):
+    from ..models import Guest
+    from .email_utils import build_rsvp_confirmation
+
+    guest = Guest.objects.select_related('event_private__owner', 'event_public__owner').get(
+        id=item.payload['guest_id']
+    )
+    return build_rsvp_confirmation(guest, guest.event, item.payload['response'])
+
+
+def _build_two_factor_code(item, cache):
+    from .two_factor_codes import code_ttl, get_code_store
+
+    # Le code n'est jamais écrit dans la file : seul le code encore valable est envoyé
+    user_id = item.payload.get('user_id')
+    code = get_code_store().active_code(user_id) if user_id else None
+    if not code:
+        raise ObsoleteEmail("Code 2FA expiré, consommé ou remplacé")
+    return EmailMessage(
+        item.payload.get('subject', ''),
+        f'Votre code de vérification est : {code}\n\nCe code est valable {code_ttl() // 60} minutes.',
+        item.payload.get('from_email') or settings.DEFAULT_FROM_EMAIL,
+        [item.to_email],
+    )
+
+
+def _build_plain(item, cache):
+    return EmailMessage(
+        item.payload.get('subject', ''),
+        item.payload.get('message', ''),
+        item.payload.get('from_email') or settings.DEFAULT_FROM_EMAIL,
+        [item.to_email],
+    )
+
+
+BUILDERS = {
+    'private_invitation': _build_private_invitation,
+    'rsvp_confirmation': _build_rsvp_confirmation,
+    'two_factor_code': _build_two_factor_code,
+    'waitlist_promotion': _build_plain,
+    'plain': _build_plain,
+}
+
+
+# ----------------------------------------------------------
+# Worker
+# ----------------------------------------------------------
+def claim_batch(batch_size=None):
+    """
+    Réserve les prochains emails à envoyer, par ordre de priorité.
+    Chaque ligne est réservée par un UPDATE conditionnel : deux workers
+    ne peuvent jamais prendre le même email.
+    """
+    from ..models import OutboundEmail
+
+    batch_size = batch_size or _setting('EMAIL_QUEUE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    now = timezone.now()
+    stale = now - timedelta(seconds=_setting('EMAIL_QUEUE_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT))
+
+    ready = Q(status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=now) | \
+        Q(status=OutboundEmail.STATUS_SENDING, locked_at__lt=stale)
+
+    candidate_ids = list(
+        OutboundEmail.objects.filter(ready)
+        .order_by('priority', 'next_attempt_at', 'id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+
+    claimed = []
+    for item_id in candidate_ids:
+        updated = OutboundEmail.objects.filter(ready, id=item_id).update(
+            status=OutboundEmail.STATUS_SENDING,
+            locked_at=now,
+        )
+        if updated:
+            claimed.append(item_id)
+
+    return list(
+        OutboundEmail.objects.filter(id__in=claimed).order_by('priority', 'next_attempt_at', 'id')
+    )
+
+
+def mark_sent(item):
+    from ..models import OutboundEmail
+
+    item.status = OutboundEmail.STATUS_SENT
+    item.attempts += 1
+    item.sent_at = timezone.now()
+    item.locked_at = None
+    item.last_error = ''
+    item.save(update_fields=['status', 'attempts', 'sent_at', 'locked_at', 'last_error'])
+
+
+def mark_failed(item, error):
+    """Replanifie l'email avec backoff, ou le passe en lettre morte"""
+    from ..models import OutboundEmail
+
+    item.attempts += 1
+    item.locked_at = None
+    item.last_error = str(error)[:2000]
+    if item.attempts >= item.max_attempts:
+        item.status = OutboundEmail.STATUS_DEAD
+        logger.error(f"❌ Email {item.id} abandonné après {item.attempts} tentatives : {item.last_error}")
+    else:
+        item.status = OutboundEmail.STATUS_PENDING
+        item.next_attempt_at = timezone.now() + backoff_delay(item.attempts)
+        logger.warning(f"Échec de l'email {item.id} (tentative {item.attempts}), nouvel essai à {item.next_attempt_at}")
+    item.save(update_fields=['status', 'attempts', 'locked_at', 'last_error', 'next_attempt_at'])
+
+
+def mark_dead(item, error):
+    """Abandonne l'email sans nouvel essai"""
+    from ..models import OutboundEmail
+
+    item.status = OutboundEmail.STATUS_DEAD
+    item.attempts += 1
+    item.locked_at = None
+    item.last_error = str(error)[:2000]
+    item.save(update_fields=['status', 'attempts', 'locked_at', 'last_error'])
+
+
+def purge_finished(now=None):
+    """
+    Supprime les emails envoyés ou abandonnés depuis plus de EMAIL_QUEUE_RETENTION_DAYS jours
+    (la table ne grossit pas indéfiniment) ; retourne le nombre de lignes supprimées
+    """
+    from ..models import OutboundEmail
+
+    cutoff = (now or timezone.now()) - timedelta(days=_setting('EMAIL_QUEUE_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+    deleted, _ = OutboundEmail.objects.filter(
+        status__in=[OutboundEmail.STATUS_SENT, OutboundEmail.STATUS_DEAD], created_at__lt=cutoff,
+    ).delete()
+    return deleted
+
+
+def process_queue(batch_size=None):
+    """
+    Traite un lot d'emails. Retourne (envoyés, échoués).
+    """
+    from ..models import OutboundEmail
+    from .email_utils import send_bulk_messages
+    from .qr_codes import render_qr_batch
+
+    with transaction.atomic():
+        batch = claim_batch(batch_size)
+
+    # Les QR codes des invitations du lot sont générés en parallèle avant l'envoi
+    rsvp_urls = [item.payload.get('rsvp_url') for item in batch
+                 if item.kind == OutboundEmail.KIND_PRIVATE_INVITATION]
+    if rsvp_urls:
+        try:
+            render_qr_batch([url for url in rsvp_urls if url])
+        except Exception as e:
+            logger.warning(f"Pré-génération des QR codes impossible: {str(e)}")
+
+    sent = failed = 0
+    ready = []
+    cache = {}
+    for item in batch:
+        builder = BUILDERS.get(item.kind)
+        try:
+            if builder is None:
+                raise ValueError(f"Type d'email inconnu : {item.kind}")
+            ready.append((item, builder(item, cache)))
+        except ObsoleteEmail as e:
+            logger.info(f"Email {item.id} abandonné : {str(e)}")
+            mark_dead(item, e)
+        except Exception as e:
+            logger.error(f"Impossible de préparer l'email {item.id}: {str(e)}")
+            mark_failed(item, e)
+            failed += 1
+
+    # Tout le lot passe par une seule connexion SMTP
+    results = send_bulk_messages([message for _, message in ready]) if ready else []
+    for (item, _), (_, error) in zip(ready, results):
+        if error is None:
+            mark_sent(item)
+            sent += 1
+        else:
+            mark_failed(item, error)
+            failed += 1
+    return sent, failed
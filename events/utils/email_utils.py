@@ -1,111 +1,149 @@
 import logging
-import qrcode
+import smtplib
 from io import BytesIO
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.defaultfilters import date as date_filter
 from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.html import escape
+from email.utils import make_msgid
+
+from .qr_codes import get_qr_png
 
 logger = logging.getLogger('email_utils')
 
 def generate_qr_code(url, size=10, border=4, fill_color="#4a6fa5"):
     """
-    Génère un QR code à partir d'une URL
+    Génère un QR code à partir d'une URL (mis en cache, voir utils.qr_codes)
     """
     try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=size,
-            border=border,
-        )
-        qr.add_data(url)
-        qr.make(fit=True)
-        
-        qr_img = qr.make_image(fill_color=fill_color, back_color="white")
-        
-        buffer = BytesIO()
-        qr_img.save(buffer, format='PNG')
-        buffer.seek(0)
-        
-        return buffer
+        return BytesIO(get_qr_png(url, size, border, fill_color))
     except Exception as e:
         logger.error(f"Erreur lors de la génération du QR code: {str(e)}")
         return None
 
-def send_private_event_invitation(event, guest_email, rsvp_url, request=None):
+
+# Marqueurs remplacés pour chaque invité dans le rendu pré-calculé
+RSVP_URL_PLACEHOLDER = '__SMART_EVENT_RSVP_URL__'
+QR_CID_PLACEHOLDER = '__SMART_EVENT_QR_CID__'
+
+
+class PrivateEventInvitationRenderer:
     """
-    Envoie une invitation par email pour un événement privé avec QR code
+    Rendu de l'invitation d'un événement privé, calculé une seule fois par événement.
+
+    Le template HTML et le texte brut sont rendus avec des marqueurs ;
+    pour chaque invité on ne fait plus que remplacer le lien RSVP
+    et le Content-ID du QR code.
     """
-    try:
+    template_name = 'emails/private_event_invitation.html'
+
+    def __init__(self, event):
+        self.event = event
+        self.subject = f"🎉 Invitation : {event.title}"
+        self.reply_to = [event.owner.email]  # Permettre de répondre à l'organisateur
+
         # Préparer le contexte pour le template
         context = {
             'event': event,
-            'rsvp_url': rsvp_url,
+            'rsvp_url': RSVP_URL_PLACEHOLDER,
             'site_name': 'Smart Event',
             'current_year': timezone.now().year
         }
-        
-        # Rendre le contenu HTML
-        html_content = render_to_string('emails/private_event_invitation.html', context)
-        
+
+        # Rendre le contenu HTML (le style du template est inclus une fois pour toutes)
+        html = render_to_string(self.template_name, context)
+        self.html_template = html.replace('cid:qrcode', f'cid:{QR_CID_PLACEHOLDER}')
+
+        # Date formatée une seule fois, comme dans le template HTML
+        local_date = timezone.localtime(event.date)
+        date_display = f"{date_filter(local_date, 'l d F Y')} à {date_filter(local_date, 'H:i')}"
+
         # Créer le message texte brut
-        text_content = f"""
-        🎉 Invitation à l'événement : {event.title}
-        {'=' * 50}
-        
-        Bonjour,
-        
-        Vous avez été invité(e) à participer à l'événement :
-        📌 {event.title}
-        
-        📅 Date : {event.date.strftime('%A %d %B %Y à %H:%M')}
-        📍 Lieu : {event.location}
-        
-        🔗 Lien de confirmation :
-        {rsvp_url}
-        
-        Scannez le QR code ci-joint pour accéder rapidement à la page de confirmation.
-        
-        Cordialement,
-        L'équipe Smart Event
-        """
-        
-        # Générer le QR code
-        qr_buffer = generate_qr_code(rsvp_url)
-        
-        if qr_buffer is None:
-            logger.error("Impossible de générer le QR code, l'email sera envoyé sans QR code")
-        
-        # Créer l'email
-        subject = f"🎉 Invitation : {event.title}"
-        
-        email = EmailMultiAlternatives(
-            subject=subject,
-            body=text_content,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[guest_email],
-            reply_to=[event.owner.email]  # Permettre de répondre à l'organisateur
-        )
-        
-        # Ajouter la version HTML
-        email.attach_alternative(html_content, "text/html")
+        self.text_template = f"""
+    🎉 Invitation à l'événement : {event.title}
+    {'=' * 50}
+    
+    Bonjour,
+    
+    Vous avez été invité(e) à participer à l'événement :
+    📌 {event.title}
+    
+    📅 Date : {date_display}
+    📍 Lieu : {event.location}
+    
+    🔗 Lien de confirmation :
+    {RSVP_URL_PLACEHOLDER}
+    
+    Scannez le QR code ci-joint pour accéder rapidement à la page de confirmation.
+    
+    Cordialement,
+    L'équipe Smart Event
+    """
+
+    def render(self, rsvp_url, qr_cid='qrcode'):
+        """Retourne (html, texte) pour un invité"""
+        html = self.html_template.replace(RSVP_URL_PLACEHOLDER, escape(rsvp_url))
+        html = html.replace(QR_CID_PLACEHOLDER, qr_cid)
+        text = self.text_template.replace(RSVP_URL_PLACEHOLDER, rsvp_url)
+        return html, text
+
+
+def build_private_event_invitation(event, guest_email, rsvp_url, renderer=None):
+    """
+    Construit (sans l'envoyer) l'email d'invitation d'un événement privé avec QR code.
+    Passer le même `renderer` pour tous les invités d'un événement évite de rendre
+    le template à chaque fois.
+    """
+    renderer = renderer or PrivateEventInvitationRenderer(event)
+
+    # Content-ID propre à chaque message pour l'image du QR code
+    qr_cid = make_msgid('qrcode', domain='smart-event')[1:-1]
+    html_content, text_content = renderer.render(rsvp_url, qr_cid)
+    
+    # Générer le QR code
+    qr_buffer = generate_qr_code(rsvp_url)
+    
+    if qr_buffer is None:
+        logger.error("Impossible de générer le QR code, l'email sera envoyé sans QR code")
+    
+    # Créer l'email
+    email = EmailMultiAlternatives(
+        subject=renderer.subject,
+        body=text_content,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[guest_email],
+        reply_to=renderer.reply_to
+    )
+    
+    # Ajouter la version HTML
+    email.attach_alternative(html_content, "text/html")
+    
+    # Ajouter le QR code en pièce jointe inline si disponible
+    if qr_buffer:
+        try:
+            from email.mime.image import MIMEImage
+            
+            # Créer une pièce jointe MIME pour l'image
+            mime_image = MIMEImage(qr_buffer.getvalue())
+            mime_image.add_header('Content-ID', f'<{qr_cid}>')
+            mime_image.add_header('Content-Disposition', 'inline', filename='qrcode.png')
+            
+            # Attacher l'image au message
+            email.attach(mime_image)
+        except Exception as e:
+            logger.error(f"Erreur lors de l'ajout du QR code: {str(e)}")
         
-        # Ajouter le QR code en pièce jointe inline si disponible
-        if qr_buffer:
-            try:
-                from email.mime.image import MIMEImage
-                
-                # Créer une pièce jointe MIME pour l'image
-                mime_image = MIMEImage(qr_buffer.getvalue())
-                mime_image.add_header('Content-ID', '<qrcode>')
-                mime_image.add_header('Content-Disposition', 'inline', filename='qrcode.png')
-                
-                # Attacher l'image au message
-                email.attach(mime_image)
-                logger.info("QR code ajouté avec succès à l'email")
-            except Exception as e:
-                logger.error(f"Erreur lors de l'ajout du QR code: {str(e)}")
+    return email
+
+
+def send_private_event_invitation(event, guest_email, rsvp_url, request=None):
+    """
+    Envoie une invitation par email pour un événement privé avec QR code
+    """
+    try:
+        email = build_private_event_invitation(event, guest_email, rsvp_url)
         
         # Envoyer l'email
         email_sent = email.send(fail_silently=False)
@@ -122,70 +160,120 @@ def send_private_event_invitation(event, guest_email, rsvp_url, request=None):
         return False
 
 
-def send_rsvp_confirmation(guest, event, response):
+def build_rsvp_confirmation(guest, event, response):
+    """
+    Construit (sans l'envoyer) l'email de confirmation de réponse à une invitation
+    """
+    # Déterminer le statut de la réponse
+    status_display = "acceptée" if response == "accepted" else "déclinée"
+    
+    # Préparer le contexte pour le template
+    context = {
+        'event': event,
+        'status_display': status_display,
+        'guest': guest,
+        'site_name': 'Smart Event',
+        'current_year': timezone.now().year
+    }
+    
+    # Rendre le contenu HTML
+    html_content = render_to_string('emails/rsvp_confirmation.html', context)
+    
+    # Créer le message texte brut
+    text_content = f"""
+    Confirmation de votre réponse - {event.title}
+    
+    Bonjour,
+    
+    Nous vous confirmons que votre réponse à l'invitation pour l'événement "{event.title}" a bien été enregistrée.
+    
+    Votre réponse : {status_display}
+    
+    Détails de l'événement :
+    📅 Date : {event.date.strftime('%A %d %B %Y à %H:%M')}
+    📍 Lieu : {event.location}
+    
+    Merci pour votre réponse !
+    
+    Cordialement,
+    L'équipe Smart Event
     """
-    Envoie une confirmation de réponse à une invitation par email
+    
+    # Créer l'email
+    subject = f"✅ Confirmation - Votre réponse pour : {event.title}"
+    
+    email = EmailMultiAlternatives(
+        subject=subject,
+        body=text_content,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[guest.email],
+        reply_to=[event.owner.email]  # Permettre de répondre à l'organisateur
+    )
+    
+    # Ajouter la version HTML
+    email.attach_alternative(html_content, "text/html")
+
+    return email
+
+
+def send_bulk_messages(email_messages, reconnect_every=None, connection=None):
     """
+    Envoie plusieurs emails à travers une seule connexion SMTP.
+
+    La connexion est rouverte tous les `reconnect_every` messages
+    (EMAIL_BATCH_RECONNECT_EVERY par défaut) ou lorsque le serveur la coupe.
+    Retourne une liste de tuples (message, erreur) — erreur vaut None si l'envoi a réussi.
+    """
+    if reconnect_every is None:
+        reconnect_every = getattr(settings, 'EMAIL_BATCH_RECONNECT_EVERY', 100)
+    connection = connection or get_connection(fail_silently=False)
+
+    results = []
+    sent_on_connection = 0
     try:
-        # Déterminer le statut de la réponse
-        status_display = "acceptée" if response == "accepted" else "déclinée"
-        
-        # Préparer le contexte pour le template
-        context = {
-            'event': event,
-            'status_display': status_display,
-            'guest': guest,
-            'site_name': 'Smart Event',
-            'current_year': timezone.now().year
-        }
-        
-        # Rendre le contenu HTML
-        html_content = render_to_string('emails/rsvp_confirmation.html', context)
-        
-        # Créer le message texte brut
-        text_content = f"""
-        Confirmation de votre réponse - {event.title}
-        
-        Bonjour,
-        
-        Nous vous confirmons que votre réponse à l'invitation pour l'événement "{event.title}" a bien été enregistrée.
-        
-        Votre réponse : {status_display}
-        
-        Détails de l'événement :
-        📅 Date : {event.date.strftime('%A %d %B %Y à %H:%M')}
-        📍 Lieu : {event.location}
-        
-        Merci pour votre réponse !
-        
-        Cordialement,
-        L'équipe Smart Event
-        """
-        
-        # Créer l'email
-        subject = f"✅ Confirmation - Votre réponse pour : {event.title}"
-        
-        email = EmailMultiAlternatives(
-            subject=subject,
-            body=text_content,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[guest.email],
-            reply_to=[event.owner.email]  # Permettre de répondre à l'organisateur
-        )
-        
-        # Ajouter la version HTML
-        email.attach_alternative(html_content, "text/html")
-        
-        # Envoyer l'email
-        email_sent = email.send(fail_silently=False)
-        
-        if email_sent == 1:
-            logger.info(f"Email de confirmation RSVP envoyé avec succès à {guest.email} pour l'événement {event.id}")
-            return True
-        else:
-            logger.error(f"Échec de l'envoi de l'email de confirmation RSVP à {guest.email}")
-            return False
-            
-    except Exception as e:
-        logger.error(f"Erreur lors de l'envoi de l'email de confirmation RSVP à {guest.email}: {str(e)}", exc_info=True)
-        return False
+        try:
+            connection.open()
+        except Exception as e:
+            # Chaque message retentera d'ouvrir la connexion et remontera sa propre erreur
+            logger.error(f"Impossible d'ouvrir la connexion SMTP: {str(e)}")
+
+        for message in email_messages:
+            if reconnect_every and sent_on_connection >= reconnect_every:
+                connection.close()
+                sent_on_connection = 0
+                try:
+                    connection.open()
+                except Exception as e:
+                    logger.error(f"Impossible de rouvrir la connexion SMTP: {str(e)}")
+
+            error = None
+            for _ in range(2):
+                try:
+                    sent = connection.send_messages([message])
+                    error = None if sent == 1 else "Le serveur n'a pas accepté le message"
+                    break
+                except smtplib.SMTPServerDisconnected as e:
+                    # Le serveur a coupé la connexion : on en ouvre une nouvelle et on réessaie une fois
+                    logger.warning(f"Connexion SMTP perdue, reconnexion ({str(e)})")
+                    error = e
+                    connection.close()
+                    sent_on_connection = 0
+                    try:
+                        connection.open()
+                    except Exception as e:
+                        error = e
+                        break
+                except Exception as e:
+                    error = e
+                    break
+
+            sent_on_connection += 1
+            results.append((message, error))
+            if error is None:
+                logger.info(f"✅ Email envoyé avec succès à {', '.join(message.to)}")
+            else:
+                logger.error(f"❌ Échec de l'envoi de l'email à {', '.join(message.to)}: {str(error)}")
+    finally:
+        connection.close()
+
+    return results
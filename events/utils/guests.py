@@ -0,0 +1,124 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+
+def normalize_email(email):
+    """Forme canonique d'une adresse email pour les comparaisons"""
+    return (email or '').strip().lower()
+
+
+def parse_guest_emails(emails_str):
+    """
+    Découpe la liste d'emails saisie (séparés par des virgules),
+    normalise chaque adresse et supprime les doublons en gardant l'ordre
+    """
+    emails = (normalize_email(e) for e in (emails_str or '').split(','))
+    return list(dict.fromkeys(e for e in emails if e))
+
+
+def users_by_email(emails):
+    """
+    Retourne {email normalisé: utilisateur} pour les comptes existants, en une requête.
+    Si plusieurs comptes partagent une adresse, le plus ancien l'emporte.
+    """
+    from django.contrib.auth import get_user_model
+
+    emails = {normalize_email(e) for e in emails if e}
+    if not emails:
+        return {}
+    users = {}
+    for user in (get_user_model().objects.annotate(email_lower=Lower('email'))
+                 .filter(email_lower__in=emails).order_by('-id')):
+        users[user.email_lower] = user
+    return users
+
+
+def guest_match(user):
+    """
+    Condition SQL : invitations de l'utilisateur, rattachées à son compte ou, pas encore
+    rattachées, envoyées à son adresse. Un changement d'email ne lui fait rien perdre
+    """
+    mine = Q(user=user)
+    if user.email:
+        mine |= Q(user__isnull=True, email_normalized=normalize_email(user.email))
+    return mine
+
+
+def link_guests_to_users(guests):
+    """Renseigne `user` sur des invités (non sauvegardés ou non liés) d'après leur email"""
+    pending = [g for g in guests if g.user_id is None]
+    users = users_by_email(g.email for g in pending)
+    for guest in pending:
+        guest.user = users.get(normalize_email(guest.email))
+    return guests
+
+
+def link_user_guests(user):
+    """Rattache au compte les invitations reçues à son adresse email (une seule requête UPDATE)"""
+    from ..models import Guest
+
+    if not user.email:
+        return 0
+    return Guest.objects.filter(
+        email_normalized=normalize_email(user.email), user__isnull=True
+    ).update(user=user)
+
+
+def sync_private_event_guests(event, emails):
+    """
+    Aligne la liste des invités d'un événement privé sur `emails`.
+
+    Seule la différence est appliquée : les invités déjà présents gardent
+    leur token (lien RSVP) et leur statut. Le tout coûte un nombre constant
+    de requêtes : une lecture, la résolution des comptes, un bulk_create et un delete.
+    Retourne (invités créés, nombre d'invités supprimés).
+    """
+    from ..models import Guest
+
+    wanted = list(dict.fromkeys(filter(None, (normalize_email(e) for e in emails))))
+
+    with transaction.atomic():
+        existing = {}
+        for guest_id, email in Guest.objects.filter(event_private=event).values_list('id', 'email_normalized'):
+            existing.setdefault(email, []).append(guest_id)
+
+        to_create = [
+            Guest(event_private=event, email=email, status=Guest.STATUS_PENDING)
+            for email in wanted if email not in existing
+        ]
+        wanted_set = set(wanted)
+        to_delete = [
+            guest_id
+            for email, ids in existing.items()
+            # Les doublons déjà en base (même adresse, casse différente) sont aussi nettoyés
+            for guest_id in (ids if email not in wanted_set else ids[1:])
+        ]
+
+        created = Guest.objects.bulk_create(link_guests_to_users(to_create)) if to_create else []
+        removed = Guest.objects.filter(id__in=to_delete).delete()[0] if to_delete else 0
+
+    return created, removed
+
+
+def reconcile_guest_users(batch_size=500):
+    """
+    Rattache par lots les invités sans compte aux utilisateurs de même email.
+    Retourne le nombre d'invités rattachés.
+    """
+    from ..models import Guest
+
+    linked = 0
+    last_id = 0
+    while True:
+        batch = list(
+            Guest.objects.filter(id__gt=last_id, user__isnull=True)
+            .order_by('id').only('id', 'email', 'user')[:batch_size]
+        )
+        if not batch:
+            return linked
+        to_update = [g for g in link_guests_to_users(batch) if g.user_id]
+        if to_update:
+            Guest.objects.bulk_update(to_update, ['user'])
+            linked += len(to_update)
+        last_id = batch[-1].id
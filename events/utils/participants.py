@@ -0,0 +1,157 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.db.models import DateTimeField, Exists, F, IntegerField, OuterRef, Q, Value
+from django.db.models.functions import Coalesce, Lower
+
+from .cursors import decode_cursor, encode_cursor
+
+DEFAULT_PAGE_SIZE = 10
+
+# Les lignes sans date de création sont classées en dernier
+_NO_DATE = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class ParticipantsPage:
+    """Une page de participants, avec les curseurs des pages voisines"""
+
+    def __init__(self, items, count, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.count = count
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def _participant_rows(event, q):
+    """
+    Les deux branches de l'union, sous forme de valeurs :
+    `sort_at` (date d'inscription) et `row_key` (clé unique : id*2 pour un invité, id*2+1 pour un RSVP).
+    """
+    from ..models import Guest, RSVP
+
+    guests = Guest.objects.filter(event_public=event, status=Guest.STATUS_ACCEPTED)
+    if event.is_paid and event.price is not None:
+        # Pour les événements payants, ne montrer que ceux qui ont payé
+        guests = guests.filter(payment_status='paid')
+
+    # Un RSVP n'apparaît que si son auteur n'est pas déjà dans la liste des invités
+    rsvps = RSVP.objects.filter(event_public=event, response='yes').annotate(
+        email_lower=Lower('user__email'),
+    ).exclude(
+        Exists(guests.filter(Q(user=OuterRef('user')) | Q(email_normalized=OuterRef('email_lower'))))
+    )
+
+    if q:
+        user_match = (Q(user__username__icontains=q) | Q(user__email__icontains=q) |
+                      Q(user__first_name__icontains=q) | Q(user__last_name__icontains=q))
+        guests = guests.filter(Q(email_normalized__contains=q.lower()) | user_match)
+        rsvps = rsvps.filter(user_match)
+
+    guests = guests.annotate(
+        sort_at=Coalesce('created_at', Value(_NO_DATE), output_field=DateTimeField()),
+        row_key=F('id') * 2,
+    )
+    rsvps = rsvps.annotate(
+        sort_at=Coalesce('created_at', Value(_NO_DATE), output_field=DateTimeField()),
+        row_key=F('id') * 2 + Value(1, output_field=IntegerField()),
+    )
+    return guests, rsvps
+
+
+def public_event_participants(event, q='', after=None, before=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Participants d'un événement public (invités acceptés + RSVP « oui » sans invitation),
+    du plus récent au plus ancien. Union, dédoublonnage, recherche, tri et pagination
+    par curseur (keyset) sont faits en SQL : le coût d'une page dépend de sa taille,
+    pas du nombre de participants.
+    Sans recherche, le total est le compteur dénormalisé `participants_count` (celui des
+    cartes d'événements) ; seule une recherche compte ses résultats.
+    """
+    from ..models import Guest, RSVP
+
+    guests, rsvps = _participant_rows(event, q)
+    if q:
+        count = guests.values('row_key').union(rsvps.values('row_key'), all=True).count()
+    else:
+        count = event.participants_count
+
+    backwards = False
+    cursor = decode_cursor(after)
+    if cursor:
+        keyset = Q(sort_at__lt=cursor[0]) | Q(sort_at=cursor[0], row_key__lt=cursor[1])
+    else:
+        cursor = decode_cursor(before)
+        backwards = bool(cursor)
+        keyset = (Q(sort_at__gt=cursor[0]) | Q(sort_at=cursor[0], row_key__gt=cursor[1])) if cursor else Q()
+
+    ordering = ('sort_at', 'row_key') if backwards else ('-sort_at', '-row_key')
+    rows = list(
+        guests.filter(keyset).values('sort_at', 'row_key')
+        .union(rsvps.filter(keyset).values('sort_at', 'row_key'), all=True)
+        .order_by(*ordering)[:page_size + 1]
+    )
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    # Chargement des lignes de la page uniquement
+    guest_ids = [r['row_key'] // 2 for r in rows if r['row_key'] % 2 == 0]
+    rsvp_ids = [r['row_key'] // 2 for r in rows if r['row_key'] % 2 == 1]
+    guests_by_id = Guest.objects.select_related('user__userprofile').in_bulk(guest_ids) if guest_ids else {}
+    rsvps_by_id = RSVP.objects.select_related('user__userprofile').in_bulk(rsvp_ids) if rsvp_ids else {}
+
+    items = []
+    for row in rows:
+        if row['row_key'] % 2 == 0:
+            guest = guests_by_id[row['row_key'] // 2]
+            items.append({
+                'guest': guest,
+                'user': guest.user,
+                'is_rsvp': False,
+                'is_accepted': guest.status == Guest.STATUS_ACCEPTED,
+                'is_paid': guest.payment_status == 'paid',
+            })
+        else:
+            rsvp = rsvps_by_id[row['row_key'] // 2]
+            items.append({
+                'guest': None,
+                'user': rsvp.user,
+                'is_rsvp': True,
+                'is_accepted': True,  # Un RSVP 'yes' est considéré comme accepté
+                'is_paid': False,  # Les RSVP ne sont pas considérés comme payants
+            })
+
+    # En reculant, la page suivante existe forcément ; en avançant, la précédente aussi (sauf en tête)
+    has_next = backwards or has_more
+    has_previous = has_more if backwards else cursor is not None
+    next_cursor = previous_cursor = None
+    if rows:
+        if has_next:
+            next_cursor = encode_cursor(rows[-1]['sort_at'], rows[-1]['row_key'])
+        if has_previous:
+            previous_cursor = encode_cursor(rows[0]['sort_at'], rows[0]['row_key'])
+    return ParticipantsPage(items, count, next_cursor, previous_cursor)
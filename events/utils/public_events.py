@@ -0,0 +1,78 @@
+"""
+Liste des événements publics à venir, paginée par clé (date, id).
+
+Chaque page reprend après le dernier événement de la précédente
+(`date > d OR (date = d AND id > i)`, servi par l'index sur la date) :
+une page profonde coûte autant que la première, contrairement à OFFSET.
+"""
+import hashlib
+
+from django.db.models import Count, Max, Min, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .cursors import decode_cursor, encode_cursor
+from .search import search_events
+
+PAGE_SIZE = 12
+MAX_PAGE_SIZE = 50
+
+
+def upcoming_public_events(query=''):
+    from ..models import PublicEvent
+
+    events = PublicEvent.objects.filter(date__gte=timezone.now())
+    if query:
+        events = search_events(events, query, ranked=False)
+    return events
+
+
+def keyset_page(queryset, after=None, page_size=PAGE_SIZE):
+    """Retourne (événements de la page, curseur de la page suivante ou None)"""
+    cursor = decode_cursor(after)
+    if cursor:
+        queryset = queryset.filter(Q(date__gt=cursor[0]) | Q(date=cursor[0], id__gt=cursor[1]))
+    events = list(queryset.order_by('date', 'id')[:page_size + 1])
+    if len(events) <= page_size:
+        return events, None
+    last = events[page_size - 1]
+    return events[:page_size], encode_cursor(last.date, last.id)
+
+
+def page_size_param(request):
+    try:
+        size = int(request.GET.get('size', PAGE_SIZE))
+    except ValueError:
+        return PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def event_card(event):
+    """Carte compacte d'un événement pour le flux JSON (uniquement des champs couverts par updated_at)"""
+    return {
+        'id': event.id,
+        'title': event.title,
+        'date': event.date.isoformat(),
+        'location': event.location,
+        'is_paid': event.is_paid,
+        'price': str(event.price) if event.is_paid and event.price is not None else None,
+        'image': event.image.url if event.image else None,
+        'url': reverse('event_detail', args=['public', event.id]),
+    }
+
+
+def feed_etag(request):
+    """
+    ETag du flux : dernière modification (index sur updated_at), nombre d'événements
+    (suppressions) et premier événement à venir (événements passés sortis de la liste),
+    combinés aux paramètres de la requête
+    """
+    from ..models import PublicEvent
+
+    state = PublicEvent.objects.aggregate(newest=Max('updated_at'), total=Count('pk'))
+    first = PublicEvent.objects.filter(date__gte=timezone.now()).aggregate(first=Min('date'))['first']
+    raw = '|'.join(str(part) for part in (
+        state['newest'], state['total'], first,
+        request.GET.get('q', ''), request.GET.get('after', ''), page_size_param(request),
+    ))
+    return hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
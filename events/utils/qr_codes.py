@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+
+logger = logging.getLogger('email_utils')
+
+DEFAULT_FILL_COLOR = "#4a6fa5"
+
+# En dessous de ce nombre de QR codes à générer, le pool de processus coûte plus qu'il ne rapporte
+POOL_MIN_BATCH = 20
+
+_executor = None
+
+
+def render_qr_png(url, size=10, border=4, fill_color=DEFAULT_FILL_COLOR):
+    """
+    Génère le PNG d'un QR code (sans cache).
+    Fonction pure, utilisable dans un processus du pool.
+    """
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=size,
+        border=border,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+
+    qr_img = qr.make_image(fill_color=fill_color, back_color="white")
+
+    buffer = BytesIO()
+    qr_img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _render_qr_args(args):
+    return render_qr_png(*args)
+
+
+# ----------------------------------------------------------
+# Cache disque (optionnel), adressé par le contenu de la clé
+# ----------------------------------------------------------
+def _disk_cache_path(key):
+    if not getattr(settings, 'QR_CODE_DISK_CACHE', False):
+        return None
+    digest = hashlib.sha256('|'.join(str(part) for part in key).encode('utf-8')).hexdigest()
+    return os.path.join(settings.MEDIA_ROOT, 'qrcodes', digest[:2], f"{digest}.png")
+
+
+def _read_disk_cache(key):
+    path = _disk_cache_path(key)
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+    return None
+
+
+def _write_disk_cache(key, png):
+    path = _disk_cache_path(key)
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(png)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Impossible d'écrire le QR code en cache disque: {str(e)}")
+
+
+# ----------------------------------------------------------
+# Cache mémoire (LRU) par processus
+# ----------------------------------------------------------
+class _LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            png = self._data.get(key)
+            if png is not None:
+                self._data.move_to_end(key)
+            return png
+
+    def set(self, key, png):
+        with self._lock:
+            self._data[key] = png
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+memory_cache = _LRUCache(getattr(settings, 'QR_CODE_CACHE_SIZE', 1024))
+
+
+# ----------------------------------------------------------
+# API publique
+# ----------------------------------------------------------
+def get_qr_png(url, size=10, border=4, fill_color=DEFAULT_FILL_COLOR):
+    """
+    Retourne le PNG d'un QR code : cache mémoire (LRU), puis cache disque, puis génération
+    """
+    key = (url, size, border, fill_color)
+    png = memory_cache.get(key)
+    if png is None:
+        png = _read_disk_cache(key)
+        if png is None:
+            png = render_qr_png(url, size, border, fill_color)
+            _write_disk_cache(key, png)
+        memory_cache.set(key, png)
+    return png
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'QR_CODE_POOL_WORKERS', None))
+    return _executor
+
+
+def render_qr_batch(urls, size=10, border=4, fill_color=DEFAULT_FILL_COLOR):
+    """
+    Génère les QR codes de toute une liste d'invités et remplit le cache.
+    Les QR codes absents du cache sont répartis sur tous les cœurs.
+    Retourne un dict {url: png}.
+    """
+    results = {}
+    missing = []
+    for url in dict.fromkeys(urls):
+        key = (url, size, border, fill_color)
+        png = memory_cache.get(key) or _read_disk_cache(key)
+        if png is None:
+            missing.append(url)
+        else:
+            results[url] = png
+
+    if len(missing) >= POOL_MIN_BATCH:
+        try:
+            args = [(url, size, border, fill_color) for url in missing]
+            rendered = list(_get_executor().map(_render_qr_args, args, chunksize=8))
+        except Exception as e:
+            logger.warning(f"Pool de génération des QR codes indisponible, génération locale: {str(e)}")
+            rendered = [render_qr_png(url, size, border, fill_color) for url in missing]
+    else:
+        rendered = [render_qr_png(url, size, border, fill_color) for url in missing]
+
+    for url, png in zip(missing, rendered):
+        _write_disk_cache((url, size, border, fill_color), png)
+        results[url] = png
+
+    # Alimente le cache mémoire pour que get_qr_png ne recalcule rien
+    for url, png in results.items():
+        memory_cache.set((url, size, border, fill_color), png)
+
+    return results
@@ -0,0 +1,53 @@
+import math
+import time
+
+from django.core.cache import caches
+
+
+class SlidingWindowLimiter:
+    """
+    Limiteur à fenêtre glissante stocké dans le cache Django.
+    Autorise au plus `limit` actions par `window` secondes, espacées
+    d'au moins `min_interval` secondes (anti double-clic, sauf `debounce=False`).
+    """
+
+    def __init__(self, name, limit, window, min_interval=0, cache_alias='default'):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.min_interval = min_interval
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, key):
+        return f"ratelimit:{self.name}:{key}"
+
+    def _recent(self, key, now):
+        return [t for t in self.cache.get(self._key(key), []) if t > now - self.window]
+
+    def retry_after(self, key, debounce=True):
+        """Secondes à attendre avant la prochaine action autorisée (0 si autorisée)"""
+        now = time.time()
+        recent = self._recent(key, now)
+        wait = 0
+        if recent and self.min_interval and debounce:
+            wait = recent[-1] + self.min_interval - now
+        if len(recent) >= self.limit:
+            wait = max(wait, recent[-self.limit] + self.window - now)
+        return max(0, math.ceil(wait))
+
+    def hit(self, key, debounce=True):
+        """Enregistre une action si elle est autorisée ; retourne False sinon"""
+        now = time.time()
+        if self.retry_after(key, debounce):
+            return False
+        recent = self._recent(key, now)
+        recent.append(now)
+        self.cache.set(self._key(key), recent[-self.limit:], timeout=self.window)
+        return True
+
+    def reset(self, key):
+        self.cache.delete(self._key(key))
@@ -0,0 +1,196 @@
+"""
+Index de recherche plein texte des événements (titre, description, lieu).
+
+- SQLite avec FTS5 : une table virtuelle `<table>_fts` par type d'événement,
+  dont le rowid est l'id de l'événement (tokenizer unicode61, accents ignorés).
+- Autres moteurs : index inversé portable (SearchTerm : un mot par ligne).
+
+L'index est tenu à jour par les signaux (save / delete) et par EventQuerySet
+(bulk_create, bulk_update, update). `manage.py rebuild_search_index` le reconstruit.
+Les recherches se font par préfixe sur chaque mot, tous les mots étant requis,
+et sont classées par pertinence (titre > lieu > description).
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+from django.db import connections, router
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+from django.db.models.expressions import RawSQL
+
+INDEXED_FIELDS = ('title', 'description', 'location')
+# Poids de chaque champ dans le classement
+FIELD_WEIGHTS = {'title': 10, 'location': 5, 'description': 1}
+# Au-delà, les mots de la requête sont ignorés (requêtes abusives)
+MAX_QUERY_TERMS = 8
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Mots en minuscules et sans accents, comme le tokenizer unicode61 de FTS5"""
+    if not text:
+        return []
+    folded = unicodedata.normalize('NFKD', text.lower())
+    folded = ''.join(c for c in folded if not unicodedata.combining(c))
+    return _WORD_RE.findall(folded)
+
+
+def fts_table(model):
+    return f'{model._meta.db_table}_fts'
+
+
+@lru_cache(maxsize=None)
+def _fts5_compiled(alias):
+    connection = connections[alias]
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return any(row[0] == 'ENABLE_FTS5' for row in cursor.fetchall())
+
+
+def uses_fts(alias='default'):
+    """Vrai si la base `alias` utilise les tables FTS5 plutôt que l'index inversé"""
+    return _fts5_compiled(alias)
+
+
+def _kind(model):
+    from ..models import PrivateEvent
+    return 'private' if issubclass(model, PrivateEvent) else 'public'
+
+
+# ----------------------------------------------------------
+# Mise à jour de l'index
+# ----------------------------------------------------------
+# Nombre d'ids par requête (limite de paramètres SQL)
+CHUNK_SIZE = 500
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def index_events(model, ids):
+    """(Ré)indexe les événements `ids` de `model` en quelques requêtes ensemblistes par lot"""
+    for chunk in _chunks(ids):
+        _index_chunk(model, chunk)
+
+
+def _index_chunk(model, ids):
+    alias = router.db_for_write(model)
+    if uses_fts(alias):
+        table, fts = model._meta.db_table, fts_table(model)
+        placeholders = ', '.join(['%s'] * len(ids))
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {fts} WHERE rowid IN ({placeholders})', ids)
+            cursor.execute(
+                f'INSERT INTO {fts} (rowid, {", ".join(INDEXED_FIELDS)}) '
+                f'SELECT id, {", ".join(INDEXED_FIELDS)} FROM {table} WHERE id IN ({placeholders})',
+                ids,
+            )
+        return
+
+    from ..models import SearchTerm
+    kind = _kind(model)
+    SearchTerm.objects.using(alias).filter(kind=kind, event_id__in=ids).delete()
+    terms = []
+    for event_id, *values in model.objects.using(alias).filter(pk__in=ids).values_list('pk', *INDEXED_FIELDS):
+        weights = {}
+        for field, value in zip(INDEXED_FIELDS, values):
+            for word in tokenize(value):
+                weights[word] = max(weights.get(word, 0), FIELD_WEIGHTS[field])
+        terms += [SearchTerm(kind=kind, event_id=event_id, term=word[:64], weight=weight)
+                  for word, weight in weights.items()]
+    SearchTerm.objects.using(alias).bulk_create(terms, batch_size=1000)
+
+
+def unindex_events(model, ids):
+    for chunk in _chunks(ids):
+        _unindex_chunk(model, chunk)
+
+
+def _unindex_chunk(model, ids):
+    alias = router.db_for_write(model)
+    if uses_fts(alias):
+        placeholders = ', '.join(['%s'] * len(ids))
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {fts_table(model)} WHERE rowid IN ({placeholders})', ids)
+        return
+
+    from ..models import SearchTerm
+    SearchTerm.objects.using(alias).filter(kind=_kind(model), event_id__in=ids).delete()
+
+
+def rebuild_index(model, batch_size=1000):
+    """Reconstruit l'index d'un type d'événement, par lots ; retourne le nombre d'événements indexés"""
+    total = 0
+    last_id = 0
+    while True:
+        ids = list(model.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        index_events(model, ids)
+        total += len(ids)
+        last_id = ids[-1]
+    return total
+
+
+# ----------------------------------------------------------
+# Recherche
+# ----------------------------------------------------------
+def search_events(queryset, query, ranked=True):
+    """
+    Restreint `queryset` (PublicEvent ou PrivateEvent) aux événements correspondant à `query`.
+    Avec `ranked`, les résultats sont annotés avec `search_rank` (plus petit = plus pertinent)
+    et triés par pertinence ; sinon l'ordre du queryset est conservé (listes par date).
+    Une requête sans mot exploitable laisse le queryset inchangé.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return queryset
+    model = queryset.model
+
+    if uses_fts(queryset.db):
+        table, fts = model._meta.db_table, fts_table(model)
+        # "mot"* : préfixe ; les guillemets neutralisent la syntaxe FTS5 (OR, NEAR, -...)
+        match = ' '.join(f'"{term}"*' for term in terms)
+        if not ranked:
+            return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', (match,)))
+
+        # Toutes les correspondances sont classées, seul le LIMIT de l'appelant borne les lignes
+        # chargées. bm25 est calculé une fois par correspondance dans une CTE matérialisée,
+        # que chaque ligne relit par id (un MATCH par ligne coûterait une recherche par ligne)
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in INDEXED_FIELDS)
+        rank = RawSQL(
+            f'WITH ranked AS MATERIALIZED ('
+            f'SELECT rowid AS id, bm25({fts}, {weights}) AS rank FROM {fts} WHERE {fts} MATCH %s'
+            f') SELECT rank FROM ranked WHERE ranked.id = {table}.id',
+            (match,),
+        )
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', (match,)),
+        ).annotate(search_rank=rank).order_by('search_rank', 'pk')
+
+    from ..models import SearchTerm
+    kind = _kind(model)
+    prefixes = {f't{i}': Q(term__startswith=term) for i, term in enumerate(terms)}
+    any_term = Q()
+    for prefix in prefixes.values():
+        any_term |= prefix
+    hits = SearchTerm.objects.filter(any_term, kind=kind)
+    matching = (
+        hits.values('event_id')
+        .annotate(**{name: Count('pk', filter=prefix) for name, prefix in prefixes.items()})
+        .filter(**{f'{name}__gt': 0 for name in prefixes})
+        .values('event_id')
+    )
+    queryset = queryset.filter(pk__in=matching)
+    if not ranked:
+        return queryset
+    score = hits.filter(event_id=OuterRef('pk')).order_by().values('event_id').annotate(
+        score=Sum('weight')
+    ).values('score')
+    return queryset.annotate(search_rank=-Subquery(score)).order_by('search_rank', 'pk')
@@ -0,0 +1,168 @@
+"""
+Agrégats de la page statistiques (EventStat) : nombre d'événements et de
+participations par jour et par mois de l'événement, et par type.
+
+Les lignes sont mises à jour de façon incrémentale :
+- création, déplacement ou suppression d'un événement (signaux et EventQuerySet) ;
+- variation des compteurs de participation (utils/counters.py), reportée sur
+  les lignes de la date de l'événement par un UPDATE avec sous-requête.
+`manage.py rebuild_stats` recalcule tout à partir des événements.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, F, Q, Subquery, Sum, Value
+from django.db.models.functions import Greatest, TruncDate, TruncMonth
+from django.utils import timezone
+
+
+def _kind(model):
+    from ..models import PrivateEvent
+    return 'private' if issubclass(model, PrivateEvent) else 'public'
+
+
+def periods(date):
+    """Lignes (période, début) concernées par un événement à cette date (fuseau courant)"""
+    from ..models import EventStat
+
+    day = timezone.localtime(date).date()
+    return [(EventStat.PERIOD_DAY, day), (EventStat.PERIOD_MONTH, day.replace(day=1))]
+
+
+def _bump_row(period, start, kind, events, participations):
+    from ..models import EventStat
+
+    changes = {}
+    if events:
+        changes['events'] = F('events') + events
+    if participations:
+        changes['participations'] = F('participations') + participations
+    if not changes:
+        return
+    row = EventStat.objects.filter(period=period, period_start=start, kind=kind)
+    if row.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            EventStat.objects.create(
+                period=period, period_start=start, kind=kind, events=events, participations=participations,
+            )
+    except IntegrityError:
+        # Ligne créée entre-temps par une autre requête
+        row.update(**changes)
+
+
+def bump(kind, date, events=0, participations=0):
+    for period, start in periods(date):
+        _bump_row(period, start, kind, events, participations)
+
+
+def bump_many(kind, changes):
+    """`changes` : {datetime: (événements, participations)} → une mise à jour par ligne touchée"""
+    totals = Counter()
+    for date, (events, participations) in changes.items():
+        for key in periods(date):
+            totals[key + ('events',)] += events
+            totals[key + ('participations',)] += participations
+    for period, start in {key[:2] for key in totals}:
+        _bump_row(period, start, kind, totals[(period, start, 'events')], totals[(period, start, 'participations')])
+
+
+def add_participations(kind, event_id, accepted=0, rsvp_yes=0):
+    """
+    Reporte une variation des compteurs d'un événement sur ses lignes jour et mois.
+    Appelé avant la mise à jour des compteurs : une baisse est bornée par leur valeur
+    actuelle (remis à zéro à la suppression de l'événement, voir event_deleting)
+    """
+    from ..models import EventStat, PrivateEvent, PublicEvent
+
+    if not accepted and not rsvp_yes:
+        return
+    event = (PrivateEvent if kind == 'private' else PublicEvent).objects.filter(pk=event_id)
+    delta = event.annotate(delta=(
+        (Value(accepted) if accepted >= 0 else Greatest(Value(accepted), -F('accepted_count'))) +
+        (Value(rsvp_yes) if rsvp_yes >= 0 else Greatest(Value(rsvp_yes), -F('rsvp_yes_count')))
+    )).values('delta')[:1]
+    day = event.annotate(start=TruncDate('date')).values('start')[:1]
+    month = event.annotate(start=TruncMonth('date', output_field=DateField())).values('start')[:1]
+    EventStat.objects.filter(kind=kind).filter(
+        Q(period=EventStat.PERIOD_DAY, period_start=Subquery(day)) |
+        Q(period=EventStat.PERIOD_MONTH, period_start=Subquery(month))
+    ).update(participations=F('participations') + Subquery(delta))
+
+
+def event_saved(event, created):
+    """Compte un nouvel événement, ou déplace ses chiffres si sa date a changé de jour"""
+    kind = _kind(type(event))
+    old_date = getattr(event, '_stats_date', None)
+    if created:
+        bump(kind, event.date, events=1)
+    elif old_date is not None and periods(old_date) != periods(event.date):
+        # Compteurs relus en base : ils évoluent par UPDATE sans mettre à jour l'instance
+        counts = type(event)._base_manager.filter(pk=event.pk).values('accepted_count', 'rsvp_yes_count').first()
+        participations = counts['accepted_count'] + counts['rsvp_yes_count'] if counts else 0
+        bump(kind, old_date, events=-1, participations=-participations)
+        bump(kind, event.date, events=1, participations=participations)
+    event._stats_date = event.date
+
+
+def event_deleting(event):
+    """
+    Avant la suppression d'un événement : retire l'événement et ses participations des
+    statistiques, puis remet ses compteurs à zéro. Les suppressions en cascade de ses
+    invités et RSVP n'ont alors plus rien à retirer, qu'elles passent avant ou après lui
+    """
+    model = type(event)
+    row = model._base_manager.filter(pk=event.pk)
+    counts = row.values('date', 'accepted_count', 'rsvp_yes_count').first()
+    if counts is None:
+        return
+    bump(_kind(model), counts['date'], events=-1,
+         participations=-(counts['accepted_count'] + counts['rsvp_yes_count']))
+    row.update(accepted_count=0, paid_count=0, rsvp_yes_count=0, participants_count=0)
+
+
+def events_created(model, events):
+    changes = Counter(event.date for event in events)
+    bump_many(_kind(model), {date: (count, 0) for date, count in changes.items()})
+
+
+def events_moved(model, before):
+    """
+    Après un update(date=...) en masse : `before` = [(id, ancienne date)] ;
+    les nouvelles dates et les participations sont relues en une requête
+    """
+    old_dates = dict(before)
+    changes = {}
+    rows = model._base_manager.filter(pk__in=old_dates).values_list('pk', 'date', 'accepted_count', 'rsvp_yes_count')
+    for pk, date, accepted, rsvp_yes in rows:
+        if periods(old_dates[pk]) == periods(date):
+            continue
+        for when, sign in ((old_dates[pk], -1), (date, 1)):
+            events, participations = changes.get(when, (0, 0))
+            changes[when] = (events + sign, participations + sign * (accepted + rsvp_yes))
+    bump_many(_kind(model), changes)
+
+
+def rebuild():
+    """Recalcule toutes les lignes à partir des événements et de leurs compteurs ; retourne leur nombre"""
+    from ..models import EventStat, PrivateEvent, PublicEvent
+
+    rows = []
+    for model in (PrivateEvent, PublicEvent):
+        for period, trunc in (
+            (EventStat.PERIOD_DAY, TruncDate('date')),
+            (EventStat.PERIOD_MONTH, TruncMonth('date', output_field=DateField())),
+        ):
+            aggregates = model.objects.annotate(start=trunc).order_by().values('start').annotate(
+                n=Count('pk'), participations=Sum(F('accepted_count') + F('rsvp_yes_count')),
+            )
+            rows += [
+                EventStat(period=period, period_start=row['start'], kind=_kind(model),
+                          events=row['n'], participations=row['participations'] or 0)
+                for row in aggregates
+            ]
+    with transaction.atomic():
+        EventStat.objects.all().delete()
+        EventStat.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -0,0 +1,72 @@
+"""
+Traces de débogage structurées, remplaçant les print() des vues.
+
+    from .utils.trace import trace
+    trace('2fa.code_issued', user_id=user.pk)
+
+Les traces sont désactivées par défaut (DEBUG_TRACE = False) : TraceMiddleware
+se retire alors de la chaîne et `trace()` se limite à la lecture d'une
+ContextVar. Activées, elles sont échantillonnées par requête
+(DEBUG_TRACE_SAMPLE_RATE) : une requête retenue trace tout son parcours, sous un
+identifiant commun, vers le logger 'events.trace' au niveau demandé.
+Les secrets (codes 2FA, mots de passe) ne doivent jamais être passés en champ.
+"""
+import logging
+import random
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+logger = logging.getLogger('events.trace')
+
+# Identifiant de la requête tracée en cours, None si elle n'est pas échantillonnée
+_trace_id = ContextVar('events_trace_id', default=None)
+
+
+def trace(event, level=logging.DEBUG, **fields):
+    """Émet `event key=value ...` si la requête courante est tracée"""
+    trace_id = _trace_id.get()
+    if trace_id is None:
+        return
+    if not logger.isEnabledFor(level):
+        return
+    details = ' '.join(f'{key}={value!r}' for key, value in fields.items())
+    logger.log(level, f"[{trace_id}] {event} {details}".rstrip(), extra={'trace_id': trace_id, 'fields': fields})
+
+
+def trace_enabled():
+    """Vrai si la requête courante est tracée (pour éviter de calculer des champs coûteux)"""
+    return _trace_id.get() is not None
+
+
+@contextmanager
+def tracing(trace_id=None):
+    """Trace le bloc (commandes de gestion, tests) indépendamment de l'échantillonnage"""
+    token = _trace_id.set(trace_id or uuid.uuid4().hex[:12])
+    try:
+        yield _trace_id.get()
+    finally:
+        _trace_id.reset(token)
+
+
+class TraceMiddleware:
+    """Échantillonne les requêtes à tracer ; absent de la chaîne quand DEBUG_TRACE est faux"""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'DEBUG_TRACE', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'DEBUG_TRACE_SAMPLE_RATE', 1.0)
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        with tracing() as trace_id:
+            trace('request.start', method=request.method, path=request.path)
+            response = self.get_response(request)
+            trace('request.end', status=response.status_code)
+        response['X-Trace-Id'] = trace_id
+        return response
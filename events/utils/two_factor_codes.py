@@ -0,0 +1,178 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CODE_TTL = 15 * 60  # secondes
+
+
+def code_ttl():
+    return getattr(settings, 'TWO_FACTOR_CODE_TTL', DEFAULT_CODE_TTL)
+
+
+class BaseCodeStore:
+    """
+    Stockage des codes 2FA.
+    `issue` enregistre un nouveau code (et invalide le précédent),
+    `consume` vérifie et consomme un code en une seule opération atomique.
+    """
+
+    def issue(self, user_id, code, ttl=None):
+        raise NotImplementedError
+
+    def consume(self, user_id, code):
+        raise NotImplementedError
+
+    def active_code(self, user_id):
+        """Code encore valable pour cet utilisateur, ou None"""
+        raise NotImplementedError
+
+    def revoke(self, user_id):
+        """Invalide le code en cours (trop d'essais erronés)"""
+        raise NotImplementedError
+
+
+class CacheCodeStore(BaseCodeStore):
+    """
+    Codes stockés dans le cache Django, expirés nativement par le TTL.
+    Le code fait partie de la clé : consommer un code revient à supprimer
+    sa clé, et seul l'appel qui la supprime réellement obtient True.
+    La clé porte aussi son échéance : les caches locmem et fichier laissent
+    `delete()` réussir sur une clé expirée, l'échéance est donc vérifiée avant.
+    """
+
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+
+    def _current_key(self, user_id):
+        return f"2fa:current:{user_id}"
+
+    def _code_key(self, user_id, code):
+        return f"2fa:code:{user_id}:{code}"
+
+    def issue(self, user_id, code, ttl=None):
+        ttl = ttl or code_ttl()
+        previous = self.cache.get(self._current_key(user_id))
+        if previous and previous != code:
+            self.cache.delete(self._code_key(user_id, previous))
+        self.cache.set_many({
+            self._code_key(user_id, code): time.time() + ttl,
+            self._current_key(user_id): code,
+        }, timeout=ttl)
+
+    def consume(self, user_id, code):
+        code = str(code or '')
+        if not code.isdigit():
+            return False
+        key = self._code_key(user_id, code)
+        expires_at = self.cache.get(key)
+        if not isinstance(expires_at, (int, float)) or expires_at <= time.time():
+            return False
+        if not self.cache.delete(key):
+            return False
+        self.cache.delete(self._current_key(user_id))
+        return True
+
+    def active_code(self, user_id):
+        code = self.cache.get(self._current_key(user_id))
+        if code and self.cache.has_key(self._code_key(user_id, code)):
+            return code
+        return None
+
+    def revoke(self, user_id):
+        code = self.cache.get(self._current_key(user_id))
+        if code:
+            self.cache.delete(self._code_key(user_id, code))
+        self.cache.delete(self._current_key(user_id))
+
+
+class DatabaseCodeStore(BaseCodeStore):
+    """
+    Repli sur la table TwoFactorCode (sans cache partagé entre les processus).
+    Les codes expirés sont purgés à chaque émission pour que la table ne grossisse pas.
+    """
+
+    def issue(self, user_id, code, ttl=None):
+        from ..models import TwoFactorCode
+
+        now = timezone.now()
+        TwoFactorCode.objects.filter(Q(user_id=user_id) | Q(expires_at__lte=now)).delete()
+        TwoFactorCode.objects.create(
+            user_id=user_id,
+            code=code,
+            expires_at=now + timedelta(seconds=ttl or code_ttl()),
+        )
+
+    def consume(self, user_id, code):
+        from ..models import TwoFactorCode
+
+        # UPDATE conditionnel : un code ne peut être consommé qu'une fois
+        return TwoFactorCode.objects.filter(
+            user_id=user_id,
+            code=code,
+            expires_at__gt=timezone.now(),
+            is_used=False,
+        ).update(is_used=True) == 1
+
+    def active_code(self, user_id):
+        from ..models import TwoFactorCode
+
+        return TwoFactorCode.objects.filter(
+            user_id=user_id,
+            expires_at__gt=timezone.now(),
+            is_used=False,
+        ).values_list('code', flat=True).first()
+
+    def revoke(self, user_id):
+        from ..models import TwoFactorCode
+
+        TwoFactorCode.objects.filter(user_id=user_id).delete()
+
+
+def code_send_limiter():
+    """
+    Limite les envois de codes par utilisateur : au plus TWO_FACTOR_SEND_LIMIT
+    codes par fenêtre glissante de TWO_FACTOR_SEND_WINDOW secondes, espacés
+    d'au moins TWO_FACTOR_RESEND_DEBOUNCE secondes
+    """
+    from .rate_limit import SlidingWindowLimiter
+
+    return SlidingWindowLimiter(
+        '2fa-send',
+        limit=getattr(settings, 'TWO_FACTOR_SEND_LIMIT', 5),
+        window=getattr(settings, 'TWO_FACTOR_SEND_WINDOW', 60 * 60),
+        min_interval=getattr(settings, 'TWO_FACTOR_RESEND_DEBOUNCE', 60),
+        cache_alias=getattr(settings, 'TWO_FACTOR_CACHE_ALIAS', 'default'),
+    )
+
+
+def code_attempt_limiter():
+    """
+    Compte les codes erronés par utilisateur : au-delà de TWO_FACTOR_VERIFY_LIMIT échecs
+    par fenêtre de TWO_FACTOR_VERIFY_WINDOW secondes, le code en cours est invalidé et
+    la vérification refusée jusqu'à la fin de la fenêtre
+    """
+    from .rate_limit import SlidingWindowLimiter
+
+    return SlidingWindowLimiter(
+        '2fa-verify',
+        limit=getattr(settings, 'TWO_FACTOR_VERIFY_LIMIT', 5),
+        window=getattr(settings, 'TWO_FACTOR_VERIFY_WINDOW', 15 * 60),
+        cache_alias=getattr(settings, 'TWO_FACTOR_CACHE_ALIAS', 'default'),
+    )
+
+
+def get_code_store():
+    """
+    Retourne le stockage configuré par TWO_FACTOR_CODE_STORE ('cache' ou 'db')
+    """
+    backend = getattr(settings, 'TWO_FACTOR_CODE_STORE', 'cache')
+    if backend == 'db':
+        return DatabaseCodeStore()
+    return CacheCodeStore(getattr(settings, 'TWO_FACTOR_CACHE_ALIAS', 'default'))
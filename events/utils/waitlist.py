@@ -0,0 +1,214 @@
+"""
+Liste d'attente des événements publics complets.
+
+- Une demande sur un événement complet devient une simple insertion dans la file
+  (WaitlistEntry), sans transaction de réservation vouée à l'échec.
+- Le rang d'une inscription est l'écart entre son rang d'arrivée (1, 2, 3... par
+  événement) et celui de la tête de file, lue sur l'index (event, status, sequence).
+- Dès qu'une place se libère (invité décliné, remboursé ou supprimé, capacité
+  augmentée), `schedule_promotion` programme après le commit une promotion par lots :
+  les premiers de la file deviennent invités acceptés (événement gratuit) ou reçoivent
+  une place retenue SEAT_HOLD_TTL secondes le temps de payer (événement payant) ;
+  leur avis part par la file d'emails.
+`manage.py promote_waitlists` rattrape les promotions manquées.
+"""
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+
+from .capacity import claim_seat, free_seats, has_room, hold_expiry, seat_transaction
+from .guests import normalize_email
+
+# Inscriptions promues par transaction
+PROMOTION_BATCH_SIZE = 100
+
+
+def join_waitlist(event, user):
+    """
+    Place l'utilisateur dans la file (une seule fois) ; retourne son inscription en attente.
+    Son rang d'arrivée est le suivant de l'événement (waitlist_tail), attribué dans la
+    transaction de l'insertion : pas de doublon ni de trou entre deux inscriptions
+    """
+    from ..models import PublicEvent, WaitlistEntry
+
+    waiting = WaitlistEntry.objects.filter(event=event, user=user, status=WaitlistEntry.STATUS_WAITING)
+    entry = waiting.first()
+    if entry is not None:
+        return entry
+    try:
+        with transaction.atomic():
+            # L'incrément verrouille la ligne de l'événement jusqu'à l'insertion
+            PublicEvent.objects.filter(pk=event.pk).update(waitlist_tail=F('waitlist_tail') + 1)
+            sequence = PublicEvent.objects.filter(pk=event.pk).values_list('waitlist_tail', flat=True).get()
+            return WaitlistEntry.objects.create(event=event, user=user, sequence=sequence)
+    except IntegrityError:
+        # Double clic : l'autre requête l'a inscrit entre-temps
+        return waiting.get()
+
+
+def waitlist_position(entry):
+    """
+    Rang (1 = prochain servi) d'une inscription en attente : écart entre son rang d'arrivée
+    et celui de la tête de file, lu en une recherche sur l'index (event, status, sequence).
+    La file n'est servie que par la tête ; une inscription annulée au milieu (admin) laisse
+    un trou, et le rang affiché est alors un majorant
+    """
+    from ..models import WaitlistEntry
+
+    head = WaitlistEntry.objects.filter(
+        event_id=entry.event_id, status=WaitlistEntry.STATUS_WAITING,
+    ).order_by('sequence').values_list('sequence', flat=True).first()
+    if head is None:
+        return 1
+    return entry.sequence - head + 1
+
+
+def user_waitlist_entry(event, user):
+    from ..models import WaitlistEntry
+
+    return WaitlistEntry.objects.filter(event=event, user=user, status=WaitlistEntry.STATUS_WAITING).first()
+
+
+def schedule_promotion(event_id):
+    """Promotion après le commit de la transaction qui a libéré des places"""
+    transaction.on_commit(partial(promote_waitlist, event_id))
+
+
+def promote_waitlist(event_id, batch_size=PROMOTION_BATCH_SIZE):
+    """Attribue les places libres aux premiers de la file, par lots ; retourne le nombre de promus"""
+    from ..models import WaitlistEntry
+
+    waiting = WaitlistEntry.objects.filter(event_id=event_id, status=WaitlistEntry.STATUS_WAITING)
+    promoted = 0
+    # Sans file, aucune transaction ni verrou
+    while waiting.exists():
+        count = _promote_batch(event_id, batch_size)
+        if not count:
+            break
+        promoted += count
+    return promoted
+
+
+def _promote_batch(event_id, batch_size):
+    from ..models import OutboundEmail, PublicEvent, WaitlistEntry
+
+    with seat_transaction():
+        event = PublicEvent.objects.filter(pk=event_id).first()
+        # Verrou sur l'événement (comme une inscription), puis places libres relues
+        if event is None or not claim_seat(event):
+            return 0
+        # Places retenues pendant un paiement déduites
+        seats = free_seats(event)
+        limit = batch_size if seats is None else min(batch_size, seats)
+        entries = list(
+            WaitlistEntry.objects.filter(event_id=event_id, status=WaitlistEntry.STATUS_WAITING)
+            .select_related('user').order_by('sequence')[:limit]
+        )
+        if not entries:
+            return 0
+
+        now = timezone.now()
+        by_email = {normalize_email(entry.user.email): entry for entry in entries if entry.user.email}
+        site_url = getattr(settings, 'SITE_URL', '').rstrip('/')
+        subject = f"Une place s'est libérée : {event.title}"
+        message = f"Bonne nouvelle ! Une place s'est libérée pour « {event.title} » et elle vous est attribuée.\n\n"
+        if event.is_paid and event.price:
+            # Payant : place retenue le temps de payer, rendue à la file si le paiement n'arrive pas
+            expires_at = _hold_promoted(event, by_email.values(), now)
+            link = site_url + reverse('event_payment', args=[event.id])
+            message += (
+                f"Elle vous est retenue jusqu'à {timezone.localtime(expires_at):%H:%M} : "
+                f"réglez le paiement ({event.price:.2f} DT) ici : {link}"
+            )
+        else:
+            _accept_promoted(event, by_email, now)
+            link = site_url + reverse('event_detail', args=['public', event.id])
+            message += f"Retrouvez l'événement ici : {link}"
+
+        # Sans email, impossible d'inscrire l'utilisateur : inscription annulée
+        promoted_ids = [entry.id for entry in by_email.values()]
+        WaitlistEntry.objects.filter(pk__in=promoted_ids).update(
+            status=WaitlistEntry.STATUS_PROMOTED, promoted_at=now,
+        )
+        WaitlistEntry.objects.filter(pk__in=[e.id for e in entries]).exclude(pk__in=promoted_ids).update(
+            status=WaitlistEntry.STATUS_CANCELLED,
+        )
+
+        max_attempts = getattr(settings, 'EMAIL_QUEUE_MAX_ATTEMPTS', 5)
+        OutboundEmail.objects.bulk_create([
+            OutboundEmail(
+                kind=OutboundEmail.KIND_WAITLIST_PROMOTION,
+                to_email=email,
+                payload={'subject': subject, 'message': message, 'event_id': event.id},
+                max_attempts=max_attempts,
+            )
+            for email in by_email
+        ])
+        return len(entries)
+
+
+def _hold_promoted(event, entries, now):
+    """
+    Événement payant : une place retenue (SeatHold) par promu ; le paiement la convertit
+    en invité payé, `sweep_expired_holds` la rend à la file à l'échéance. Retourne l'échéance
+    """
+    from ..models import SeatHold
+
+    expires_at = hold_expiry(now)
+    users = [entry.user_id for entry in entries]
+    # Place retenue expirée d'une visite précédente : remplacée
+    SeatHold.objects.filter(event=event, user_id__in=users).delete()
+    SeatHold.objects.bulk_create([SeatHold(event=event, user_id=user_id, expires_at=expires_at) for user_id in users])
+    return expires_at
+
+
+def _accept_promoted(event, by_email, now):
+    """Événement gratuit : les promus deviennent invités acceptés, avec un RSVP « oui »"""
+    from ..models import Guest, RSVP
+
+    existing = {
+        guest.email_normalized: guest
+        for guest in Guest.objects.filter(event_public=event, email_normalized__in=by_email)
+    }
+    to_update, to_create = [], []
+    for email, entry in by_email.items():
+        guest = existing.get(email)
+        if guest is None:
+            to_create.append(Guest(
+                event_public=event, email=email, user=entry.user, status=Guest.STATUS_ACCEPTED,
+            ))
+        else:
+            guest.status = Guest.STATUS_ACCEPTED
+            guest.user = entry.user
+            if guest.payment_status == 'refunded':
+                guest.payment_status = 'pending'
+            to_update.append(guest)
+    Guest.objects.bulk_update(to_update, ['status', 'user', 'payment_status'])
+    Guest.objects.bulk_create(to_create)
+
+    users = [entry.user_id for entry in by_email.values()]
+    rsvps = list(RSVP.objects.filter(event_public=event, user_id__in=users))
+    for rsvp in rsvps:
+        rsvp.response = 'yes'
+    RSVP.objects.bulk_update(rsvps, ['response'])
+    with_rsvp = {rsvp.user_id for rsvp in rsvps}
+    RSVP.objects.bulk_create([
+        RSVP(event_public=event, user_id=user_id, response='yes', created_at=now)
+        for user_id in users if user_id not in with_rsvp
+    ])
+
+
+def promote_all(batch_size=PROMOTION_BATCH_SIZE):
+    """Promotion sur tous les événements ayant une file ; retourne le nombre de promus"""
+    from ..models import PublicEvent, WaitlistEntry
+
+    event_ids = (
+        WaitlistEntry.objects.filter(status=WaitlistEntry.STATUS_WAITING)
+        .values_list('event_id', flat=True).distinct()
+    )
+    open_events = PublicEvent.objects.filter(pk__in=list(event_ids)).filter(has_room()).values_list('pk', flat=True)
+    return sum(promote_waitlist(event_id, batch_size) for event_id in open_events)
@@ -1,8 +1,5 @@
 from decimal import Decimal, InvalidOperation
 import json
-import qrcode
-import qrcode.image.svg
-from io import BytesIO
 from django.core.files import File
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
@@ -12,12 +9,18 @@ from django.core.mail import EmailMultiAlternatives, BadHeaderError
 from django.http import HttpResponse, HttpResponseRedirect
 from django.conf import settings
 from django.utils.timezone import localtime, now
-from django.db.models import Q, Count, Sum, F, ExpressionWrapper, fields
+from django.db import transaction
+from django.db.models import (
+    Q, Count, Sum, F, ExpressionWrapper, fields, Value, CharField,
+    Case, When, OuterRef, Subquery,
+)
 from django.db.models.functions import TruncDate, TruncMonth, TruncYear
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth import get_user_model
-from django.http import Http404
+from django.http import Http404, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.utils import timezone
 from decimal import Decimal
@@ -25,7 +28,7 @@ from decimal import Decimal
 # Récupérer le modèle User personnalisé
 User = get_user_model()
 
-from .models import PrivateEvent, PublicEvent, Guest, UserProfile, ContactMessage, RSVP, User
+from .models import PrivateEvent, PublicEvent, Guest, UserProfile, ContactMessage, RSVP, User, EventStat, Checkout, OutboundEmail
 from .forms import (
     PrivateEventForm,
     PublicEventForm,
@@ -36,6 +39,17 @@ from .forms import (
     MockPaymentForm
 )
 from .forms import UserUpdateForm, ProfileUpdateForm  # Ajout des imports manquants
+from .utils.admin_stats import get_snapshot as get_admin_stats
+from .utils.capacity import EventFull, free_seats, hold_seat
+from .utils.checkout import (
+    CheckoutError, checkout, has_seat, idempotency_key_from, new_idempotency_key, register_participant,
+)
+from .utils.guests import guest_match, normalize_email, parse_guest_emails, sync_private_event_guests
+from .utils.participants import public_event_participants
+from .utils.public_events import event_card, feed_etag, keyset_page, page_size_param, upcoming_public_events
+from .utils.search import search_events
+from .utils.trace import trace
+from .utils.waitlist import join_waitlist, schedule_promotion, user_waitlist_entry, waitlist_position
 
 # ================================
 # Public Pages
@@ -50,21 +64,13 @@ def home(request):
     # Récupérer les événements publics (tous pour le moment)
     events = PublicEvent.objects.all().order_by('date')
     
-    # Appliquer la recherche si un terme est fourni
+    # Appliquer la recherche si un terme est fourni (index plein texte, résultats classés)
     if query:
-        events = events.filter(
-            Q(title__icontains=query) |
-            Q(description__icontains=query) |
-            Q(location__icontains=query)
-        )
+        events = search_events(events, query)
     
-    # Limiter à 6 événements pour l'affichage
+    # Limiter à 6 événements pour l'affichage (une seule requête, évaluée par le template)
     events = events[:6]
-    
-    # Ajouter un message de débogage
-    print(f"Événements trouvés : {events.count()}")
-    for event in events:
-        print(f"- {event.title} ({event.date})")
+    trace('home.search', query=query)
     
     context = {
         'events': events,
@@ -123,98 +129,91 @@ def contact(request):
 
 def public_events(request):
     """
-    Vue pour afficher la liste des événements publics
+    Vue pour afficher la liste des événements publics à venir,
+    page par page (pagination par clé, voir utils/public_events.py)
     """
-    # Récupérer les paramètres de filtrage
     query = request.GET.get('q', '')
-    category = request.GET.get('category', '')
-    
-    # Filtrer les événements publics à venir
-    events = PublicEvent.objects.filter(date__gte=timezone.now())
-    
-    # Appliquer les filtres
-    if query:
-        events = events.filter(
-            Q(title__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(location__icontains=query)
-        )
-    
-    if category:
-        events = events.filter(category=category)
-    
-    # Trier par date
-    events = events.order_by('date')
-    
+    events, next_cursor = keyset_page(
+        upcoming_public_events(query), after=request.GET.get('after'), page_size=page_size_param(request),
+    )
+
     # Préparer le contexte
     context = {
         'events': events,
+        'next_cursor': next_cursor,
         'query': query,
-        'category': category,
         'now': timezone.now(),
     }
-    
+
     return render(request, 'events/public_events.html', context)
 
+
+@condition(etag_func=feed_etag)
+def public_events_feed(request):
+    """
+    Flux JSON des événements publics à venir pour le défilement infini :
+    cartes compactes et curseur opaque de la page suivante.
+    Le client revalide avec If-None-Match (304 sans corps si rien n'a changé).
+    """
+    events, next_cursor = keyset_page(
+        upcoming_public_events(request.GET.get('q', '')),
+        after=request.GET.get('after'),
+        page_size=page_size_param(request),
+    )
+    response = JsonResponse({'events': [event_card(e) for e in events], 'next_cursor': next_cursor})
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
 @login_required
 def private_events(request):
     """
     Vue pour afficher la liste des événements privés de l'utilisateur connecté
+    (organisés ou reçus en invitation). Sélection, statut d'invitation, recherche,
+    tri et pagination sont faits en base : le nombre de requêtes ne dépend pas
+    du nombre d'invitations.
     """
     user = request.user
-    
-    # Récupérer les événements privés où l'utilisateur est propriétaire ou invité
-    owned_events = PrivateEvent.objects.filter(owner=user).order_by('date')
-    
-    # Récupérer les événements où l'utilisateur est invité
-    invited_events = PrivateEvent.objects.filter(
-        guests__email__iexact=user.email
-    ).exclude(owner=user).distinct().order_by('date')
-    
-    # Récupérer le statut de chaque événement pour l'utilisateur
-    event_status = {}
-    for event in invited_events:
-        try:
-            guest = Guest.objects.get(event_private=event, email__iexact=user.email)
-            event_status[event.id] = {
-                'status': guest.get_status_display(),
-                'status_class': 'text-warning' if guest.status == 'pending' else 
-                              'text-success' if guest.status == 'accepted' else 
-                              'text-danger'
-            }
-        except Guest.DoesNotExist:
-            event_status[event.id] = {'status': 'Invité', 'status_class': 'text-muted'}
-    
-    # Récupérer les paramètres de filtrage
     query = request.GET.get('q', '')
     event_type = request.GET.get('type', 'all')  # 'all', 'owned', 'invited'
-    
-    # Filtrer les événements selon le type sélectionné
+
+    # Invitations de l'utilisateur : par compte rattaché ou par email
+    mine = Q(user=user)
+    if user.email:
+        mine |= Q(email_normalized=normalize_email(user.email))
+    my_guests = Guest.objects.filter(mine, event_private__isnull=False)
+    invited = Q(pk__in=my_guests.values('event_private'))
+
     if event_type == 'owned':
-        events = owned_events
+        events = PrivateEvent.objects.filter(owner=user)
     elif event_type == 'invited':
-        events = invited_events
+        events = PrivateEvent.objects.filter(invited).exclude(owner=user)
     else:  # 'all'
-        events = list(owned_events) + list(invited_events)
-    
-    # Appliquer le filtre de recherche
+        events = PrivateEvent.objects.filter(Q(owner=user) | invited)
+
+    # Statut de l'invitation (la plus favorable en cas de doublon), lu pour les seuls événements de la page
+    status_priority = Case(
+        When(status=Guest.STATUS_ACCEPTED, then=Value(0)),
+        When(status=Guest.STATUS_PENDING, then=Value(1)),
+        default=Value(2),
+    )
+    events = events.annotate(
+        guest_status=Subquery(
+            my_guests.filter(event_private=OuterRef('pk')).order_by(status_priority).values('status')[:1]
+        ),
+    )
+
+    # Appliquer le filtre de recherche (index plein texte)
     if query:
-        events = [
-            event for event in events 
-            if (query.lower() in event.title.lower() or 
-                query.lower() in event.location.lower() or
-                query.lower() in event.description.lower())
-        ]
-    
-    # Trier les événements par date
-    events = sorted(events, key=lambda x: x.date)
-    
+        events = search_events(events, query, ranked=False)
+
+    # Trier les événements par date, puis paginer
+    page = _paginate_list(request, events.order_by('date', 'id'), 'page')
+
     # Préparer le contexte
     context = {
-        'owned_events': owned_events,
-        'invited_events': invited_events,
-        'events': events,
-        'event_status': event_status,
+        'events': page,
+        'page': page,
         'query': query,
         'event_type': event_type,
         'now': timezone.now(),
@@ -262,75 +261,112 @@ from django.utils.timezone import localtime, now
 from django.shortcuts import render
 from .models import PrivateEvent, PublicEvent, Guest
 
-@login_required
-def dashboard(request):
-    user = request.user
-    user_email = user.email.strip().lower() if user.email else None
-    event_type = request.GET.get('type', 'all')
+DASHBOARD_PAGE_SIZE = 12
 
-    # Événements privés
-    private_created = PrivateEvent.objects.filter(owner=user)
-    private_pending = PrivateEvent.objects.filter(
-        guests__email__iexact=user_email, guests__status=Guest.STATUS_PENDING
-    )
-    private_attending = PrivateEvent.objects.filter(
-        guests__email__iexact=user_email, guests__status=Guest.STATUS_ACCEPTED
+
+def _dashboard_sections(user, event_type):
+    """
+    Querysets des sections du tableau de bord, par type d'événement :
+    {section: {'private': qs, 'public': qs}}. Le statut retenu pour une invitation
+    en double est le plus favorable, comme dans `private_events`.
+    """
+    my_guests = Guest.objects.filter(guest_match(user))
+    status_priority = Case(
+        When(status=Guest.STATUS_ACCEPTED, then=Value(0)),
+        When(status=Guest.STATUS_PENDING, then=Value(1)),
+        default=Value(2),
     )
-    private_declined = PrivateEvent.objects.filter(
-        guests__email__iexact=user_email, guests__status=Guest.STATUS_DECLINED
+    sections = {'created': {}, 'pending': {}, 'attending': {}, 'declined': {}}
+
+    if event_type in ('all', 'private'):
+        private = PrivateEvent.objects.annotate(
+            guest_status=Subquery(
+                my_guests.filter(event_private=OuterRef('pk')).order_by(status_priority).values('status')[:1]
+            ),
+        )
+        sections['created']['private'] = private.filter(owner=user)
+        sections['pending']['private'] = private.filter(guest_status=Guest.STATUS_PENDING)
+        sections['attending']['private'] = private.filter(guest_status=Guest.STATUS_ACCEPTED)
+        sections['declined']['private'] = private.filter(guest_status=Guest.STATUS_DECLINED)
+
+    if event_type in ('all', 'public'):
+        # Public : participation par RSVP ou par paiement
+        attending = Q(pk__in=RSVP.objects.filter(user=user, response='yes').values('event_public')) | Q(
+            pk__in=my_guests.filter(payment_status='paid').values('event_public')
+        )
+        sections['created']['public'] = PublicEvent.objects.filter(owner=user)
+        sections['attending']['public'] = PublicEvent.objects.filter(attending)
+
+    return sections
+
+
+def _dashboard_page(request, querysets, param):
+    """
+    Pagine une section en base : l'union (type, id, date) de ses querysets est comptée
+    puis découpée (COUNT + LIMIT/OFFSET), et seuls les événements de la page sont chargés,
+    annotés avec le jeton d'invitation de l'utilisateur (`guest_token`).
+    """
+    if not querysets:
+        return _paginate_list(request, [], param)
+
+    rows = [
+        qs.annotate(kind=Value(kind, output_field=CharField())).values('kind', 'id', 'date')
+        for kind, qs in querysets.items()
+    ]
+    combined = rows[0].union(*rows[1:]) if len(rows) > 1 else rows[0]
+    page = _paginate_list(request, combined.order_by('-date', 'kind', 'id'), param)
+
+    # Invitation retenue : payée d'abord, puis la plus favorable
+    my_guests = Guest.objects.filter(guest_match(request.user))
+    token_priority = Case(
+        When(payment_status='paid', then=Value(0)),
+        When(status=Guest.STATUS_ACCEPTED, then=Value(1)),
+        When(status=Guest.STATUS_PENDING, then=Value(2)),
+        default=Value(3),
     )
+    entries = list(page.object_list)
+    loaded = {}
+    for kind, model, lookup in (('private', PrivateEvent, 'event_private'), ('public', PublicEvent, 'event_public')):
+        ids = [entry['id'] for entry in entries if entry['kind'] == kind]
+        if not ids:
+            continue
+        events = model.objects.select_related('owner').filter(pk__in=ids).annotate(
+            guest_token=Subquery(
+                my_guests.filter(**{lookup: OuterRef('pk')}).order_by(token_priority).values('token')[:1]
+            ),
+        )
+        loaded.update({(kind, event.pk): event for event in events})
+    page.object_list = [loaded[(entry['kind'], entry['id'])] for entry in entries]
+    return page
+
+
+def _paginate_list(request, items, param):
+    """Pagine une liste ou un queryset ; chaque section a son propre paramètre de page"""
+    page = Paginator(items, DASHBOARD_PAGE_SIZE).get_page(request.GET.get(param))
+    query = request.GET.copy()
+    query.pop(param, None)
+    page.base_query = query.urlencode()
+    page.param = param
+    return page
 
-    # Événements publics
-    public_created = PublicEvent.objects.filter(owner=user)
-    public_pending = PublicEvent.objects.none()
-
-    # Par RSVP : utilisateurs ayant répondu 'yes'
-    public_attending_rsvp = PublicEvent.objects.filter(
-        rsvps__user=user, rsvps__response='yes'
-    ).distinct()
-
-    # Par paiement : utilisateurs qui ont payé et statut accepté
-    public_attending_payment = PublicEvent.objects.filter(
-        guests__email__iexact=user_email, guests__payment_status='paid'
-    ).distinct()
-
-    # Combine RSVP et paiements pour "accepté", supprime doublons
-    public_attending = list(dict.fromkeys(list(public_attending_rsvp) + list(public_attending_payment)))
-
-    public_declined = PublicEvent.objects.none()
-
-    # Filtrage selon le type choisi
-    if event_type == 'private':
-        created_events = private_created
-        pending_events = private_pending
-        attending_events = private_attending
-        declined_events = private_declined
-    elif event_type == 'public':
-        created_events = public_created
-        pending_events = public_pending
-        attending_events = public_attending
-        declined_events = public_declined
-    else:  # all
-        created_events = list(private_created) + list(public_created)
-        pending_events = private_pending
-        attending_events = list(private_attending) + public_attending
-        declined_events = private_declined
-
-    # Mapping des tokens pour RSVP ou Guest
-    guest_tokens = {}
-    if user_email:
-        for g in Guest.objects.filter(email__iexact=user_email):
-            if g.event_private:
-                guest_tokens[g.event_private.id] = g.token
-            elif g.event_public:
-                guest_tokens[g.event_public.id] = g.token
 
+@login_required
+def dashboard(request):
+    """
+    Tableau de bord : chaque section est comptée et paginée en base, un nombre fixe
+    de requêtes quel que soit le nombre d'événements.
+    """
+    user = request.user
+    event_type = request.GET.get('type', 'all')
+    if event_type not in ('all', 'private', 'public'):
+        event_type = 'all'
+
+    sections = _dashboard_sections(user, event_type)
     context = {
-        'created_events': created_events,
-        'pending_events': pending_events,
-        'attending_events': attending_events,
-        'declined_events': declined_events,
-        'guest_tokens': guest_tokens,
+        'created_events': _dashboard_page(request, sections['created'], 'created_page'),
+        'pending_events': _dashboard_page(request, sections['pending'], 'pending_page'),
+        'attending_events': _dashboard_page(request, sections['attending'], 'attending_page'),
+        'declined_events': _dashboard_page(request, sections['declined'], 'declined_page'),
         'event_type': event_type,
         'now': localtime(now()),
     }
@@ -374,9 +410,8 @@ def add_private_event(request):
             event.owner = request.user
             event.save()
             
-            # Récupérer et nettoyer la liste des emails
-            emails_str = form.cleaned_data.get('guests_emails', '')
-            emails = [e.strip() for e in emails_str.split(',') if e.strip()]
+            # Récupérer, normaliser et dédoublonner la liste des emails
+            emails = parse_guest_emails(form.cleaned_data.get('guests_emails', ''))
             
             # Configuration du logger
             import logging
@@ -389,90 +424,32 @@ def add_private_event(request):
                 'emails': emails
             }
             
-            logger.info("Début de l'envoi des invitations", extra=log_context)
+            logger.info("Mise en file des invitations", extra=log_context)
             
-            # Importer l'utilitaire d'email
-            from .utils.email_utils import send_private_event_invitation
+            # Les invitations sont envoyées par le worker `process_email_queue` :
+            # la vue ne fait qu'insérer les invités et les emails à envoyer.
+            from .utils.email_queue import enqueue_private_event_invitations
             
             try:
-                sent_count = 0
-                failed_emails = []
-                
-                for email in emails:
-                    try:
-                        # Créer l'invité dans la base de données
-                        guest = Guest.objects.create(event_private=event, email=email)
-                        rsvp_link = f"{request.scheme}://{request.get_host()}/rsvp/{guest.token}/"
-                        
-                        # Envoyer l'invitation par email
-                        email_sent = send_private_event_invitation(
-                            event=event,
-                            guest_email=email,
-                            rsvp_url=rsvp_link,  
-                            request=request
-                        )
-                        
-                        if email_sent:
-                            sent_count += 1
-                            logger.info(f"Email envoyé avec succès à {email}", extra={
-                                'email': email,
-                                'event_id': event.id,
-                                'rsvp_link': rsvp_link
-                            })
-                            
-                            # Afficher un message de débogage en console
-                            print(f"\n" + "="*50)
-                            print(f"EMAIL ENVOYÉ AVEC SUCCÈS À: {email}")
-                            print(f"Événement: {event.title}")
-                            print(f"Lien RSVP: {rsvp_link}")
-                            print("="*50 + "\n")
-                        else:
-                            failed_emails.append(email)
-                            logger.warning(f"Échec d'envoi à {email}", extra={
-                                'email': email,
-                                'event_id': event.id
-                            })
-                            
-                    except Exception as e:
-                        import traceback
-                        error_details = traceback.format_exc()
-                        failed_emails.append(email)
-                        logger.error(
-                            f"Erreur lors de l'envoi à {email}", 
-                            exc_info=True,
-                            extra={
-                                'email': email,
-                                'error': str(e),
-                                'event_id': event.id,
-                                'traceback': error_details
-                            }
-                        )
-                        
-                        # Afficher un message d'erreur en console
-                        print(f"\n" + "!"*50)
-                        print(f"ERREUR D'ENVOI D'EMAIL À {email}")
-                        print(f"Erreur: {str(e)}")
-                        print("!"*50 + "\n")
+                with transaction.atomic():
+                    created, _ = sync_private_event_guests(event, emails)
+                    invitations = [
+                        (guest.email, f"{request.scheme}://{request.get_host()}/rsvp/{guest.token}/")
+                        for guest in created
+                    ]
+                    enqueue_private_event_invitations(event, invitations)
                 
-                # Afficher les messages de statut à l'utilisateur
-                if sent_count > 0:
+                if invitations:
                     messages.success(
                         request,
-                        f"✅ Événement créé avec succès ! {sent_count} invitation(s) envoyée(s)."
-                    )
-                
-                if failed_emails:
-                    failed_count = len(failed_emails)
-                    messages.warning(
-                        request,
-                        f"⚠️ {failed_count} invitation(s) n'ont pas pu être envoyées. "
-                        f"Emails concernés : {', '.join(failed_emails[:5])}"
-                        f"{'...' if len(failed_emails) > 5 else ''}"
+                        f"✅ Événement créé avec succès ! {len(invitations)} invitation(s) en cours d'envoi."
                     )
+                else:
+                    messages.success(request, "✅ Événement créé avec succès !")
                 
             except Exception as e:
                 logger.critical(
-                    "Erreur critique lors de l'envoi des invitations", 
+                    "Erreur critique lors de la mise en file des invitations", 
                     exc_info=True, 
                     extra=log_context
                 )
@@ -482,12 +459,6 @@ def add_private_event(request):
                     "Veuillez réessayer ou contacter l'administrateur."
                 )
                 
-                # Afficher l'erreur critique en console
-                print("\n" + "!"*50)
-                print("ERREUR CRITIQUE LORS DE L'ENVOI DES INVITATIONS")
-                print(f"Erreur: {str(e)}")
-                print("!"*50 + "\n")
-                
             return redirect('dashboard')  # Redirection vers le tableau de bord après création
         else:
             # Afficher les erreurs de formulaire
@@ -517,6 +488,8 @@ def edit_public_event(request, event_id):
             # Let the form handle conversion and cleaned values
             updated_event = form.save(commit=False)
             updated_event.save()
+            # Capacité éventuellement augmentée : la liste d'attente avance
+            schedule_promotion(updated_event.id)
             messages.success(request, "✅ Événement public mis à jour !")
             return redirect("dashboard")
 
@@ -546,78 +519,39 @@ def edit_public_event(request, event_id):
 
 @login_required
 def admin_stats(request):
+    """
+    Tableau de bord administrateur, servi depuis un instantané en cache (utils/admin_stats.py) ;
+    les données du graphique sont chargées ensuite par admin_stats_chart
+    """
     # Vérifier si l'utilisateur est un superutilisateur
     if not request.user.is_superuser:
         messages.error(request, "Accès refusé. Vous n'avez pas les droits d'administrateur.")
-        return redirect('event_detail', event_type='public', event_id=event.id)
-    
-    # Statistiques de base
-    total_users = User.objects.count()
-    total_events = PublicEvent.objects.count() + PrivateEvent.objects.count()
-    public_events_count = PublicEvent.objects.count()
-    private_events_count = PrivateEvent.objects.count()
-    
-    # Derniers événements créés
-    recent_public_events = PublicEvent.objects.order_by('-created_at')[:5]
-    recent_private_events = PrivateEvent.objects.order_by('-created_at')[:5]
-    recent_events = list(recent_public_events) + list(recent_private_events)
-    recent_events.sort(key=lambda x: x.created_at, reverse=True)
-    
-    # Préparation des données pour le graphique d'évolution mensuelle
-    from django.db.models.functions import TruncMonth
-    from django.db.models import Count
-    
-    # Événements publics par mois
-    public_events_by_month = (
-        PublicEvent.objects
-        .annotate(month=TruncMonth('date'))
-        .values('month')
-        .annotate(count=Count('id'))
-        .order_by('month')
-    )
-    
-    # Événements privés par mois
-    private_events_by_month = (
-        PrivateEvent.objects
-        .annotate(month=TruncMonth('date'))
-        .values('month')
-        .annotate(count=Count('id'))
-        .order_by('month')
-    )
-    
-    # Fusionner les données des événements publics et privés par mois
-    from collections import defaultdict
-    from datetime import datetime
-    
-    events_by_month = defaultdict(int)
-    
-    for event in public_events_by_month:
-        month = event['month'].strftime('%Y-%m')
-        events_by_month[month] += event['count']
-    
-    for event in private_events_by_month:
-        month = event['month'].strftime('%Y-%m')
-        events_by_month[month] += event['count']
-    
-    # Trier les mois et préparer les données pour le graphique
-    sorted_months = sorted(events_by_month.keys())
-    months = [datetime.strptime(month, '%Y-%m').strftime('%b %Y') for month in sorted_months]
-    event_counts = [events_by_month[month] for month in sorted_months]
-    
-    # Préparer le contexte
+        return redirect('home')
+
+    snapshot = get_admin_stats()
     context = {
-        'total_users': total_users,
-        'total_events': total_events,
-        'public_events_count': public_events_count,
-        'private_events_count': private_events_count,
-        'recent_events': recent_events[:5],  # Limiter à 5 événements récents
-        'months': json.dumps(months, ensure_ascii=False),  # Convertir en JSON pour JavaScript
-        'event_counts': json.dumps(event_counts),  # Convertir en JSON pour JavaScript
+        'total_users': snapshot['total_users'],
+        'total_events': snapshot['total_events'],
+        'public_events_count': snapshot['public_events_count'],
+        'private_events_count': snapshot['private_events_count'],
+        'recent_events': snapshot['recent_events'],
     }
-    
     return render(request, 'events/admin_stats.html', context)
 
 
+@login_required
+def admin_stats_chart(request):
+    """Données JSON du graphique d'évolution mensuelle du tableau de bord administrateur"""
+    if not request.user.is_superuser:
+        return JsonResponse({'error': "Accès refusé."}, status=403)
+
+    snapshot = get_admin_stats()
+    response = JsonResponse({'months': snapshot['months'], 'event_counts': snapshot['event_counts']})
+    # Instantané déjà en cache côté serveur : le navigateur peut le réutiliser le temps de sa fraîcheur
+    patch_cache_control(response, private=True, max_age=getattr(settings, 'ADMIN_STATS_TTL', 60))
+    return response
+
+
 # ================================
 # Event Detail & Join
 # ================================
@@ -631,6 +565,68 @@ from django.contrib.auth import get_user_model
 from .models import PublicEvent, PrivateEvent, Guest, RSVP
 from .forms import MockPaymentForm
 
+
+
+def _has_seat(event, user):
+    """Vrai si l'utilisateur occupe déjà une place (invité accepté, non remboursé)"""
+    return has_seat(event, user)
+
+
+def _waitlist_redirect(request, event):
+    """Événement complet : inscription en liste d'attente (simple insertion) plutôt qu'un échec"""
+    entry = join_waitlist(event, request.user)
+    messages.info(
+        request,
+        f"⏳ Cet événement est complet : vous êtes n°{waitlist_position(entry)} sur la liste d'attente. "
+        "Vous recevrez un email dès qu'une place vous sera attribuée.",
+    )
+    return redirect('event_detail', event_type='public', event_id=event.id)
+
+
+def _is_prefetch(request):
+    """Vrai pour un préchargement du navigateur (lien survolé, prerender) : pas une visite"""
+    purpose = request.headers.get('Sec-Purpose') or request.headers.get('Purpose') or ''
+    return 'prefetch' in purpose.lower()
+
+
+def _hold_for_payment(request, event):
+    """
+    Place retenue à l'affichage du formulaire de paiement (lève EventFull si complet).
+    Rien n'est retenu pour une capacité illimitée, une place déjà occupée ou un
+    préchargement ; un rechargement retrouve la place retenue sans la prolonger
+    (une seule place par utilisateur et par événement, SEAT_HOLD_TTL secondes au plus)
+    """
+    if not event.max_participants or _is_prefetch(request) or _has_seat(event, request.user):
+        return None
+    return hold_seat(event, request.user)
+
+
+def _paid_checkout(request, event, amount):
+    """
+    Paiement soumis par l'un des formulaires (voir utils/checkout.py) : retourne la redirection
+    qui suit, ou None si le formulaire doit être réaffiché (erreur déjà signalée)
+    """
+    try:
+        record = checkout(event, request.user, amount, idempotency_key_from(request.POST))
+    except EventFull:
+        return _waitlist_redirect(request, event)
+    except CheckoutError as e:
+        messages.error(request, str(e))
+        return None
+
+    # Resoumission : réponse selon l'issue de la soumission d'origine
+    if record.status == Checkout.STATUS_REFUNDED:
+        return _waitlist_redirect(request, event)
+    if record.status == Checkout.STATUS_FAILED:
+        messages.error(request, record.error or "Le paiement a échoué, veuillez réessayer.")
+        return None
+    if record.status == Checkout.STATUS_PENDING:
+        messages.info(request, "⏳ Votre paiement est en cours de traitement.")
+    else:
+        messages.success(request, "💳 Paiement effectué avec succès ! Vous êtes maintenant participant de cet événement.")
+    return redirect('dashboard')  # Redirection vers le tableau de bord après création
+
+
 @login_required
 def event_detail(request, event_type, event_id):
     now_time = timezone.localtime(timezone.now())
@@ -644,23 +640,21 @@ def event_detail(request, event_type, event_id):
         messages.error(request, "Type d'événement invalide.")
         return redirect('event_detail', event_type='public', event_id=event.id)
 
-    user_email = request.user.email.strip().lower() if request.user.email else None
-
     # 🔹 Vérifie si l'utilisateur a déjà rejoint l'événement
     if event_type == 'public':
         # Pour les événements publics payants, on vérifie le statut de paiement
         if event.is_paid and event.price is not None:
             user_has_joined = Guest.objects.filter(
+                guest_match(request.user),
                 event_public=event,
-                email__iexact=user_email,
                 status=Guest.STATUS_ACCEPTED,
                 payment_status='paid'
             ).exists()
         else:
             # Pour les événements publics gratuits, on vérifie soit Guest accepté, soit RSVP
             user_has_joined = Guest.objects.filter(
+                guest_match(request.user),
                 event_public=event,
-                email__iexact=user_email,
                 status=Guest.STATUS_ACCEPTED
             ).exists() or RSVP.objects.filter(
                 event_public=event,
@@ -670,8 +664,8 @@ def event_detail(request, event_type, event_id):
     else:
         # Pour les événements privés
         user_has_joined = Guest.objects.filter(
+            guest_match(request.user),
             event_private=event,
-            email__iexact=user_email,
             status=Guest.STATUS_ACCEPTED
         ).exists() or RSVP.objects.filter(
             event_private=event,
@@ -683,14 +677,15 @@ def event_detail(request, event_type, event_id):
     payment_form = None
     display_price = None
     has_paid = False
+    seat_hold = None
     
     if event_type == 'public' and event.is_paid and event.price is not None:
         display_price = f"{event.price:.2f}"
         
         # Vérifier si l'utilisateur a déjà payé
         has_paid = Guest.objects.filter(
+            guest_match(request.user),
             event_public=event,
-            email__iexact=user_email,
             payment_status='paid',
             status=Guest.STATUS_ACCEPTED
         ).exists()
@@ -700,290 +695,74 @@ def event_detail(request, event_type, event_id):
             if request.method == "POST":
                 payment_form = MockPaymentForm(request.POST)
                 if payment_form.is_valid():
-                    try:
-                        amount = Decimal(str(payment_form.cleaned_data['amount']))
-                    except (InvalidOperation, KeyError):
-                        messages.error(request, "Montant invalide.")
-                        amount = None
-
-                    if amount is not None and Decimal(str(event.price)) == amount:
-                        # 🔹 Crée ou met à jour le Guest après paiement
-                        guest, created = Guest.objects.update_or_create(
-                            event_public=event,
-                            email__iexact=user_email,
-                            defaults={
-                                'email': user_email,
-                                'status': Guest.STATUS_ACCEPTED,
-                                'payment_amount': amount,
-                                'payment_status': 'paid',
-                                'payment_transaction_id': f"PAY-{request.user.id}-{int(now_time.timestamp())}",
-                                'payment_date': now_time
-                            }
-                        )
-
-                        # 🔹 Crée ou met à jour le RSVP
-                        rsvp, _ = RSVP.objects.update_or_create(
-                            user=request.user,
-                            event_public=event,
-                            defaults={
-                                'response': 'yes', 
-                                'created_at': now_time
-                            }
-                        )
-
-                        messages.success(request, "✅ Paiement effectué et participation enregistrée avec succès !")
-                        return redirect('dashboard')  # Redirection vers le tableau de bord après création
-                    else:
-                        messages.error(request, f"Le montant doit être de {event.price:.2f} DT.")
+                    # 🔹 Paiement, puis Guest et RSVP enregistrés avec la place
+                    response = _paid_checkout(request, event, payment_form.cleaned_data['amount'])
+                    if response is not None:
+                        return response
             else:
                 # Créer le formulaire avec la valeur initiale du prix
                 payment_form = MockPaymentForm(initial={'amount': event.price})
+                # Place retenue le temps de saisir la carte, comme sur les pages de paiement
+                if not event.is_full:
+                    try:
+                        seat_hold = _hold_for_payment(request, event)
+                    except EventFull:
+                        pass
     
-    # Préparation du contexte initial
-    context = {
-        'event': event,
-        'event_type': event_type,
-        'now': now_time,
-        'user_has_joined': user_has_joined,
-        'display_price': display_price,
-        'payment_form': payment_form,
-        'has_paid': has_paid
-    }
-
-    # 🔹 Initialisation des variables pour la liste des participants
-    guests = None
+    # 🔹 Liste des participants (événements publics) : une page à la fois, calculée en SQL
     participants = []
-    participants_queryset = []
     total_rsvp = 0
     total_accepted = 0
     total_paid = 0
     user_participation = None
-    
-    # Initialiser UserModel pour la recherche des utilisateurs
-    UserModel = get_user_model()
+    waitlist_rank = None
+    seats_left = None
+    # Clé d'idempotence du formulaire de paiement (conservée en cas de réaffichage)
+    idempotency_key = idempotency_key_from(request.POST) if request.method == 'POST' else new_idempotency_key()
 
-    # Récupération des participants pour les événements publics
     if event_type == 'public':
-        # Récupérer tous les invités acceptés (pour les événements gratuits et payants)
-        guests = Guest.objects.filter(
-            event_public=event,
-            status=Guest.STATUS_ACCEPTED
-        ).select_related('event_public')
-        
-        # Debug: Afficher le nombre d'invités trouvés
-        print(f"DEBUG - Nombre d'invités trouvés: {guests.count()}")
-        for g in guests:
-            print(f"  - {g.email}, Payé: {getattr(g, 'payment_status', 'N/A')}")
-        
-        # Pour les événements payants, ne montrer que ceux qui ont payé
-        if event.is_paid and event.price is not None:
-            guests = guests.filter(
-                payment_status='paid',
-                status=Guest.STATUS_ACCEPTED
-            )
-        
-        # Récupérer les RSVP pour cet événement
-        rsvps = RSVP.objects.filter(
-            event_public=event,
-            response='yes'
-        ).select_related('user', 'user__userprofile')
-        
-        # Debug: Afficher le nombre de RSVP trouvés
-        print(f"DEBUG - Nombre de RSVP trouvés: {rsvps.count()}")
-        
-        # Créer une liste unifiée des participants
-        participants_list = []
-        
-        # Ajouter les invités
-        for guest in guests:
-            user_obj = UserModel.objects.filter(email__iexact=guest.email).first()
-            participants_list.append({
-                'guest': guest,
-                'user': user_obj,
-                'is_rsvp': False,
-                'is_accepted': guest.status == Guest.STATUS_ACCEPTED,
-                'is_paid': guest.payment_status == 'paid' if hasattr(guest, 'payment_status') else False
-            })
-            
-            # Mettre à jour les totaux
-            if guest.status == Guest.STATUS_ACCEPTED:
-                total_accepted += 1
-                if hasattr(guest, 'payment_status') and guest.payment_status == 'paid':
-                    total_paid += 1
-        
-        # Ajouter les RSVP qui ne sont pas déjà dans la liste des invités
-        for rsvp in rsvps:
-            if not any(p['user'] == rsvp.user for p in participants_list):
-                participants_list.append({
-                    'guest': None,
-                    'user': rsvp.user,
-                    'is_rsvp': True,
-                    'is_accepted': True,  # Un RSVP 'yes' est considéré comme accepté
-                    'is_paid': False  # Les RSVP ne sont pas considérés comme payants
-                })
-                total_rsvp += 1
-        
-        # Mettre à jour le total RSVP (uniquement ceux qui n'ont pas d'entrée Guest)
-        total_rsvp = len([p for p in participants_list if p['is_rsvp'] and not p['guest']])
-        
-        # Filtrer les participants si une recherche est effectuée
-        search_query = request.GET.get('q', '').strip().lower()
-        if search_query:
-            participants_list = [
-                p for p in participants_list 
-                if (p['user'] and (search_query in p['user'].username.lower() or 
-                                  search_query in p['user'].email.lower())) or
-                   (p['guest'] and search_query in p['guest'].email.lower())
-            ]
-        
-        # Pagination
-        paginator = Paginator(participants_list, 10)  # 10 participants par page
-        page = request.GET.get('page')
-        
-        try:
-            participants = paginator.page(page)
-        except PageNotAnInteger:
-            participants = paginator.page(1)
-        except EmptyPage:
-            participants = paginator.page(paginator.num_pages)
-            
-        # Remove the duplicate pagination code below
-        # The rest of the pagination logic is handled above
-        
-        # Vérifier la participation de l'utilisateur connecté
+        participants = public_event_participants(
+            event,
+            q=request.GET.get('q', '').strip(),
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+        )
+
+        # Places disponibles, places retenues pendant un paiement déduites
+        seats_left = free_seats(event)
+
+        # Totaux (compteurs dénormalisés, sans requête)
+        total_accepted = event.accepted_count
+        total_paid = event.paid_count
+        total_rsvp = event.rsvp_yes_count
+
+        # Participation de l'utilisateur connecté
         if request.user.is_authenticated:
-            user_participation = next(
-                (p for p in participants_list if p['user'] == request.user),
-                None
-            )
-            
-            # Si l'utilisateur n'est pas dans la liste des participants mais a un RSVP
-            if not user_participation:
-                user_rsvp = next(
-                    (p for p in participants_list if p['user'] == request.user and p['is_rsvp']),
-                    None
-                )
-                if user_rsvp:
-                    user_participation = user_rsvp
-
-    # Afficher la liste des participants à tous les utilisateurs
-        UserModel = get_user_model()
-
-        # Recherche (filtre) des participants par nom ou email
-        q = request.GET.get('q', '').strip()
-
-        # Guests liés à l'événement
-        if event_type == 'public':
-            if event.is_paid and event.price is not None:
-                # Pour les événements payants, on vérifie que le paiement a été effectué
-                guests_qs = Guest.objects.filter(
-                    event_public=event,
-                    status=Guest.STATUS_ACCEPTED,
-                    payment_status='paid'
-                ).order_by('-created_at')
-            else:
-                # Pour les événements gratuits, on vérifie seulement le statut
-                guests_qs = Guest.objects.filter(
-                    event_public=event,
-                    status=Guest.STATUS_ACCEPTED
-                ).order_by('-created_at')
-                
-            # Ajouter les RSVPs pour les événements publics
-            rsvps_qs = RSVP.objects.filter(
+            guest = Guest.objects.filter(
+                guest_match(request.user),
                 event_public=event,
-                response='yes'
-            ).select_related('user').order_by('-created_at')
-            
-            # Si l'utilisateur n'est pas l'organisateur, ne montrer que les participants acceptés
-            if request.user != event.owner:
-                guests_qs = guests_qs.filter(status=Guest.STATUS_ACCEPTED)
-                
-        else:
-            # Pour les événements privés, on vérifie seulement le statut
-            guests_qs = Guest.objects.filter(
-                event_private=event,
-                status=Guest.STATUS_ACCEPTED
-            ).order_by('-created_at')
-            
-            # Pour les événements privés, on ne montre que les invités acceptés
-            if request.user != event.owner:
-                guests_qs = guests_qs.filter(status=Guest.STATUS_ACCEPTED)
-                
-            rsvps_qs = RSVP.objects.none()  # Pas de RSVP pour les événements privés
-        # Filtrer par recherche si nécessaire
-        if q:
-            guests_qs = guests_qs.filter(Q(email__icontains=q))
-            if 'rsvps_qs' in locals():
-                rsvps_qs = rsvps_qs.filter(
-                    Q(user__username__icontains=q) | 
-                    Q(user__email__icontains=q) |
-                    Q(user__first_name__icontains=q) |
-                    Q(user__last_name__icontains=q)
-                )
-
-        # Pour événements publics, récupérer aussi les RSVPs (utilisateurs ayant répondu 'yes')
-        rsvp_users = []
-        if event_type == 'public':
-            if 'rsvps_qs' not in locals():
-                rsvps_qs = RSVP.objects.filter(
-                    event_public=event, 
-                    response='yes'
-                ).select_related('user')
-                
-            rsvp_users = [r.user for r in rsvps_qs]
-            total_rsvp = rsvps_qs.count()
+                status=Guest.STATUS_ACCEPTED,
+            ).first()
+            has_rsvp = RSVP.objects.filter(event_public=event, user=request.user, response='yes').exists()
+            if guest or has_rsvp:
+                user_participation = {
+                    'guest': guest,
+                    'user': request.user,
+                    'is_rsvp': has_rsvp and guest is None,
+                    'is_accepted': True,
+                    'is_paid': bool(guest and guest.payment_status == 'paid'),
+                }
+
+        # Rang dans la liste d'attente (événement complet)
+        if not user_has_joined:
+            entry = user_waitlist_entry(event, request.user)
+            if entry is not None:
+                waitlist_rank = waitlist_position(entry)
 
-        # Totaux par Guest — filtrer selon le type d'événement pour éviter les erreurs de type
-        if event_type == 'public':
-            total_accepted = Guest.objects.filter(event_public=event, status=Guest.STATUS_ACCEPTED).count()
-            total_paid = Guest.objects.filter(event_public=event, payment_status='paid').count()
-        else:
-            total_accepted = Guest.objects.filter(event_private=event, status=Guest.STATUS_ACCEPTED).count()
-            # Les événements privés n'ont pas de paiement via Guest.event_public
-            total_paid = 0
-
-        seen_emails = set()
-
-        # Ajouter les Guests
-        for g in guests_qs:
-            linked_user = UserModel.objects.filter(email__iexact=g.email).first()
-            participants_queryset.append({
-                'guest': g,
-                'user': linked_user,
-                'is_rsvp': linked_user in rsvp_users if linked_user else False,
-                'is_paid': (g.payment_status == 'paid'),
-                'is_accepted': (g.status == Guest.STATUS_ACCEPTED),
-            })
-            if g.email:
-                seen_emails.add(g.email.lower())
-
-        # Ajouter les RSVPs qui n'ont pas de Guest correspondant
-        if event_type == 'public':
-            for user in rsvp_users:
-                if user.email and user.email.lower() in seen_emails:
-                    continue
-                # user a RSVP mais pas de guest
-                participants_queryset.append({
-                    'guest': None,
-                    'user': user,
-                    'is_rsvp': True,
-                    'is_paid': False,
-                    'is_accepted': False,
-                })
-
-        # Pagination is already handled above
-        # Remove duplicate pagination code
-
-
-    # Debug: Afficher le nombre de participants dans la console serveur
-    print(f"DEBUG - Nombre de participants: {len(participants) if participants else 0}")
-    print(f"DEBUG - participants est de type: {type(participants)}")
-    
     return render(request, 'events/event_detail.html', {
         'event': event,
         'payment_form': payment_form,
         'participants': participants,
-        'participants_page': participants if isinstance(participants, object) else None,
         'now': now_time,
         'event_type': event_type,
         'user_has_joined': user_has_joined,
@@ -991,7 +770,11 @@ def event_detail(request, event_type, event_id):
         'total_rsvp': total_rsvp,
         'total_accepted': total_accepted,
         'total_paid': total_paid,
-        'user_participation': user_participation if 'user_participation' in locals() else None,
+        'user_participation': user_participation,
+        'waitlist_rank': waitlist_rank,
+        'seats_left': seats_left,
+        'seat_hold': seat_hold,
+        'idempotency_key': idempotency_key,
     })
 
 
@@ -999,7 +782,9 @@ def event_detail(request, event_type, event_id):
 @login_required
 def join_event(request, event_id):
     event = get_object_or_404(PrivateEvent, id=event_id)
-    guest, _ = Guest.objects.get_or_create(event_private=event, email=request.user.email)
+    guest, _ = Guest.objects.get_or_create(
+        event_private=event, email=request.user.email, defaults={'user': request.user}
+    )
     guest.status = Guest.STATUS_ACCEPTED
     guest.save()
     messages.success(request, f"🎉 Vous avez rejoint l'événement '{event.title}' !")
@@ -1009,41 +794,10 @@ def join_event(request, event_id):
 def register_user_to_public_event(user, event, *, paid=False, amount=None, transaction_id=None):
     """
     Inscrit proprement un utilisateur à un événement public
-    (gratuit ou payant)
+    (gratuit ou payant), en une transaction qui réserve sa place :
+    lève EventFull si l'événement est complet (voir utils/checkout.py)
     """
-    email = user.email.strip().lower()
-    now = timezone.now()
-
-    # 🔹 Guest
-    guest, created = Guest.objects.get_or_create(
-        event_public=event,
-        email__iexact=email,
-        defaults={
-            'email': email,
-            'status': Guest.STATUS_ACCEPTED,
-        }
-    )
-
-    guest.status = Guest.STATUS_ACCEPTED
-
-    if paid:
-        guest.payment_status = 'paid'
-        guest.payment_amount = Decimal(str(amount)) if amount else None
-        guest.payment_transaction_id = transaction_id
-        guest.payment_date = now
-
-    guest.save()
-
-    # 🔹 RSVP
-    rsvp, _ = RSVP.objects.get_or_create(
-        user=user,
-        event_public=event,
-        defaults={'response': 'yes', 'created_at': now}
-    )
-    rsvp.response = 'yes'
-    rsvp.save()
-
-    return guest
+    return register_participant(user=user, event=event, paid=paid, amount=amount, transaction_id=transaction_id)
 
 
 @login_required
@@ -1058,16 +812,22 @@ def join_public_event(request, event_id):
         messages.info(request, "Cet événement est payant. Veuillez procéder au paiement.")
         return redirect('event_payment', event_id=event.id)
 
+    # Complet d'après la ligne déjà chargée : file d'attente, sans transaction de réservation
+    if event.is_full and not _has_seat(event, request.user):
+        return _waitlist_redirect(request, event)
+
     # Pour les événements gratuits
-    register_user_to_public_event(
-        user=request.user,
-        event=event,
-        paid=False
-    )
+    try:
+        register_user_to_public_event(
+            user=request.user,
+            event=event,
+            paid=False
+        )
+    except EventFull:
+        return _waitlist_redirect(request, event)
 
     messages.success(request, f"🎉 Vous participez à l'événement '{event.title}' !")
     return redirect('event_detail', event_type='public', event_id=event.id)
-    return redirect('event_payment', event_id=event.id)
 
 
 # ================================
@@ -1081,53 +841,25 @@ def payment_view(request, event_id):
     if request.method == 'POST':
         form = MockPaymentForm(request.POST)
         if form.is_valid():
-            try:
-                amount = Decimal(str(form.cleaned_data['amount']))
-            except (InvalidOperation, KeyError):
-                messages.error(request, "Montant invalide.")
-                return render(request, 'events/payment.html', {'event': event, 'form': form})
-
-            if event.price is not None and Decimal(str(event.price)) == amount:
-                guest, created = Guest.objects.get_or_create(
-                    event_public=event,
-                    email=request.user.email,
-                    defaults={
-                        'status': Guest.STATUS_ACCEPTED,
-                        'payment_amount': amount,
-                        'payment_status': 'paid',
-                        'payment_transaction_id': f"MOCK-{request.user.id}-{int(timezone.now().timestamp())}",
-                        'payment_date': timezone.now()
-                    }
-                )
-                if not created:
-                    guest.status = Guest.STATUS_ACCEPTED
-                    guest.payment_amount = amount
-                    guest.payment_status = 'paid'
-                    guest.payment_transaction_id = f"MOCK-{request.user.id}-{int(timezone.now().timestamp())}"
-                    guest.payment_date = timezone.now()
-                    guest.save()
-
-                # Créer ou mettre à jour le RSVP
-                rsvp, r_created = RSVP.objects.get_or_create(
-                    user=request.user,
-                    event_public=event,
-                    defaults={'response': 'yes', 'created_at': timezone.now()}
-                )
-                if not r_created:
-                    rsvp.response = 'yes'
-                    rsvp.save()
-
-                messages.success(request, "💳 Paiement effectué avec succès ! Vous êtes maintenant participant de cet événement.")
-                return redirect('dashboard')  # Redirection vers le tableau de bord après création
-            else:
-                messages.error(request, f"Le montant doit être de {event.price:.2f} €.")
+            # Paiement, puis invité et RSVP enregistrés avec la place, en une transaction
+            response = _paid_checkout(request, event, form.cleaned_data['amount'])
+            if response is not None:
+                return response
         else:
             messages.error(request, "Veuillez corriger les erreurs du formulaire de paiement.")
-        return render(request, 'events/payment.html', {'event': event, 'form': form})
+        return render(request, 'events/payment.html', {
+            'event': event, 'form': form, 'idempotency_key': idempotency_key_from(request.POST),
+        })
 
-    # GET → afficher le formulaire
+    # GET → retenir une place puis afficher le formulaire
+    try:
+        seat_hold = _hold_for_payment(request, event)
+    except EventFull:
+        return _waitlist_redirect(request, event)
     form = MockPaymentForm(initial={'amount': event.price})
-    return render(request, 'events/payment.html', {'event': event, 'form': form})
+    return render(request, 'events/payment.html', {
+        'event': event, 'form': form, 'seat_hold': seat_hold, 'idempotency_key': new_idempotency_key(),
+    })
 
 
 @login_required
@@ -1171,47 +903,47 @@ def event_payment(request, event_id):
         messages.error(request, "Cet événement ne nécessite pas de paiement.")
         return redirect('event_detail', event_type='public', event_id=event_id)
     
-    # Vérifie si l'utilisateur a déjà payé (avec correspondance insensible à la casse)
+    # Vérifie si l'utilisateur a déjà payé (invitation du compte, ou de son adresse)
     if Guest.objects.filter(
+        guest_match(request.user),
         event_public=event,
-        email__iexact=request.user.email,
         payment_status='paid'
     ).exists():
         messages.info(request, "Vous êtes déjà inscrit à cet événement.")
         return redirect('event_detail', event_type='public', event_id=event.id)
+
+    # Complet : pas de paiement, place dans la file d'attente (un promu garde la sienne pour payer)
+    if event.is_full and not _has_seat(event, request.user):
+        return _waitlist_redirect(request, event)
+
+    # Place retenue le temps de saisir la carte (convertie au paiement, libérée à expiration)
+    seat_hold = None
+    if request.method == 'GET':
+        try:
+            seat_hold = _hold_for_payment(request, event)
+        except EventFull:
+            return _waitlist_redirect(request, event)
     
     if request.method == 'POST':
         form = MockPaymentForm(request.POST)
+        idempotency_key = idempotency_key_from(request.POST)
         if form.is_valid():
-            try:
-                amount = Decimal(str(form.cleaned_data['amount']))
-            except (InvalidOperation, KeyError):
-                messages.error(request, "Montant invalide.")
-                return render(request, 'events/event_payment.html', {'event': event, 'form': form, 'display_price': f"{event.price:.2f}"})
-            
-            if amount != Decimal(str(event.price)):
-                messages.error(request, f"Le montant doit être de {event.price:.2f} €.")
-            else:
-                # Utilisation de la fonction centrale pour enregistrer l'utilisateur
-                register_user_to_public_event(
-                    user=request.user,
-                    event=event,
-                    paid=True,
-                    amount=amount,
-                    transaction_id=f"MOCK-{request.user.id}-{int(timezone.now().timestamp())}"
-                )
-                
-                messages.success(request, "💳 Paiement effectué avec succès ! Vous êtes maintenant participant de cet événement.")
-                return redirect('dashboard')  # Redirection vers le tableau de bord après création
+            # Service de paiement commun aux formulaires (utils/checkout.py)
+            response = _paid_checkout(request, event, form.cleaned_data['amount'])
+            if response is not None:
+                return response
         else:
             messages.error(request, "Veuillez corriger les erreurs du formulaire.")
     else:
         form = MockPaymentForm(initial={'amount': event.price})
+        idempotency_key = new_idempotency_key()
     
     return render(request, 'events/event_payment.html', {
         'event': event,
         'form': form,
-        'display_price': f"{event.price:.2f}"
+        'display_price': f"{event.price:.2f}",
+        'seat_hold': seat_hold,
+        'idempotency_key': idempotency_key,
     })
 
 
@@ -1226,6 +958,8 @@ def edit_public_event(request, event_id):
             # Use the form to apply cleaned values (is_paid boolean, price, etc.)
             updated_event = form.save(commit=False)
             updated_event.save()
+            # Capacité éventuellement augmentée : la liste d'attente avance
+            schedule_promotion(updated_event.id)
             messages.success(request, "✅ Événement public mis à jour !")
             return redirect("dashboard")
 
@@ -1267,21 +1001,23 @@ def edit_private_event(request, event_id):
         if form.is_valid():
             event = form.save(commit=False)
             
-            # Gestion des invités
-            guests_emails = form.cleaned_data.get('guests_emails', '')
-            if guests_emails is not None:  # Vérifier que le champ n'est pas None
-                # Supprimer les invités existants pour cet événement
-                Guest.objects.filter(event_private=event).delete()
+            with transaction.atomic():
+                event.save()
                 
-                # Ajouter les nouveaux invités
-                for email in [e.strip() for e in guests_emails.split(',') if e.strip()]:
-                    Guest.objects.create(
-                        event_private=event,
-                        email=email,
-                        status=Guest.STATUS_PENDING
-                    )
+                # Gestion des invités : seule la différence est appliquée,
+                # les invités existants gardent leur lien RSVP et leur réponse
+                guests_emails = form.cleaned_data.get('guests_emails', '')
+                if guests_emails is not None:  # Vérifier que le champ n'est pas None
+                    created, _ = sync_private_event_guests(event, parse_guest_emails(guests_emails))
+                    
+                    # Les nouveaux invités reçoivent leur invitation via la file d'emails
+                    if created:
+                        from .utils.email_queue import enqueue_private_event_invitations
+                        enqueue_private_event_invitations(event, [
+                            (guest.email, f"{request.scheme}://{request.get_host()}/rsvp/{guest.token}/")
+                            for guest in created
+                        ])
             
-            event.save()
             messages.success(request, "L'événement privé a été mis à jour avec succès !")
             return redirect('dashboard')  # Redirection vers le tableau de bord après création
     else:
@@ -1383,12 +1119,16 @@ def rsvp(request, token):
                             defaults={'response': 'yes' if response == 'accepted' else 'no'}
                         )
                 
-                # Envoyer un email de confirmation
+                # Email de confirmation envoyé par le worker `process_email_queue`
                 try:
-                    from .utils.email_utils import send_rsvp_confirmation
-                    send_rsvp_confirmation(guest, event, response)
+                    from .utils.email_queue import enqueue_email
+                    enqueue_email(
+                        OutboundEmail.KIND_RSVP_CONFIRMATION,
+                        guest.email,
+                        payload={'guest_id': guest.id, 'response': response},
+                    )
                 except Exception as e:
-                    logger.error(f"Erreur lors de l'envoi de la confirmation RSVP: {str(e)}")
+                    logger.error(f"Erreur lors de la mise en file de la confirmation RSVP: {str(e)}")
                 
                 messages.success(
                     request, 
@@ -1497,7 +1237,8 @@ def profile(request):
     participating_events = {
         'public_rsvps': RSVP.objects.filter(user=request.user, response='yes').select_related('event_public'),
         'private_invites': Guest.objects.filter(
-            email=request.user.email, 
+            user=request.user,
+            event_private__isnull=False,
             status=Guest.STATUS_ACCEPTED
         ).select_related('event_private')
     }
@@ -1574,88 +1315,63 @@ def edit_profile(request):
 def statistiques(request):
     """
     Vue pour afficher les statistiques du site
+    Les totaux et l'histogramme sont lus dans les agrégats mensuels (EventStat, voir utils/stats.py) :
+    le coût de la page ne dépend pas du nombre d'événements
     """
     # Statistiques de base
     total_utilisateurs = User.objects.count()
-    total_evenements = PublicEvent.objects.count() + PrivateEvent.objects.count()
-    
-    # Calculer le nombre total de participations
-    total_participations = RSVP.objects.filter(response='yes').count() + \
-                          Guest.objects.filter(status='accepted').count()
-    
-    # Événements à venir (dans les 30 prochains jours) — inclure publics et privés
-    date_limite = timezone.now() + timedelta(days=30)
-
-    upcoming_public = PublicEvent.objects.filter(date__gte=timezone.now(), date__lte=date_limite).order_by('date')
-    upcoming_private = PrivateEvent.objects.filter(date__gte=timezone.now(), date__lte=date_limite).order_by('date')
-
-    # Fonction utilitaire pour calculer le nombre de participants réel d'un événement
-    def count_participants_for_event(ev):
-        # Pour les événements publics : compter les RSVPs 'yes' + guests acceptés/paid
-        if isinstance(ev, PublicEvent):
-            rsvp_count = RSVP.objects.filter(event_public=ev, response='yes').count()
-            guest_count = Guest.objects.filter(event_public=ev, status=Guest.STATUS_ACCEPTED).count()
-            paid_count = Guest.objects.filter(event_public=ev, payment_status='paid').count()
-            # Éviter le double comptage : guests payés sont généralement marked accepted too,
-            # mais on prend le max entre (rsvp_count + guest_count) et paid_count pour être conservateur
-            total = rsvp_count + guest_count
-            # Si paid_count est greater than guest_count, prefer paid_count (covers paid but not accepted)
-            if paid_count > guest_count:
-                total = rsvp_count + paid_count
-            return total
-        else:
-            # Pour événements privés : compter les guests acceptés
-            return Guest.objects.filter(event_private=ev, status=Guest.STATUS_ACCEPTED).count()
+    totaux = EventStat.objects.filter(period=EventStat.PERIOD_MONTH).aggregate(
+        evenements=Sum('events'), participations=Sum('participations'),
+    )
+    total_evenements = totaux['evenements'] or 0
+    # Invités acceptés + RSVP 'yes'
+    total_participations = totaux['participations'] or 0
 
     # Construire une liste d'objets simples pour le template avec participants_count et max_participants
     def make_event_summary(ev):
         return {
             'instance': ev,
-            'title': getattr(ev, 'title', ''),
-            'date': getattr(ev, 'date', None),
-            'participants_count': count_participants_for_event(ev),
+            'title': ev.title,
+            'date': ev.date,
+            'participants_count': ev.participants_count,
             'max_participants': getattr(ev, 'max_participants', None),
         }
 
-    upcoming = [make_event_summary(e) for e in list(upcoming_public) + list(upcoming_private)]
-    upcoming.sort(key=lambda x: x['date'] or timezone.now())
+    # Événements à venir (dans les 30 prochains jours) — inclure publics et privés
+    # 5 premiers de chaque type lus sur l'index de date, puis fusionnés
+    maintenant = timezone.now()
+    date_limite = maintenant + timedelta(days=30)
+    upcoming = [
+        make_event_summary(e)
+        for model in (PublicEvent, PrivateEvent)
+        for e in model.objects.filter(date__gte=maintenant, date__lte=date_limite).order_by('date', 'pk')[:5]
+    ]
+    upcoming.sort(key=lambda x: x['date'])
     evenements_a_venir = upcoming[:5]
 
-    # Top événements : combiner publics et privés et trier par participants_count
-    all_public = list(PublicEvent.objects.all())
-    all_private = list(PrivateEvent.objects.all())
-    all_events = all_public + all_private
-    top_list = [make_event_summary(e) for e in all_events]
+    # Top événements : 5 premiers de chaque type sur l'index de participants_count
+    top_list = [
+        make_event_summary(e)
+        for model in (PublicEvent, PrivateEvent)
+        for e in model.objects.order_by('-participants_count', 'pk')[:5]
+    ]
     top_list.sort(key=lambda x: x['participants_count'], reverse=True)
     top_evenements = top_list[:5]
-    
-    # Préparation des données pour le graphique d'évolution mensuelle
-    from django.db.models.functions import TruncMonth
-    
-    # Événements par mois
-    evenements_par_mois = {}
-    mois = []
-    
-    # Récupérer les 12 derniers mois
-    for i in range(11, -1, -1):
-        date = timezone.now() - timedelta(days=30*i)
-        mois_str = date.strftime('%Y-%m')
-        mois_nom = date.strftime('%b %Y')
-        mois.append(mois_nom)
-        evenements_par_mois[mois_str] = 0
-    
-    # Compter les événements par mois (publics + privés)
-    for event in list(PublicEvent.objects.all()) + list(PrivateEvent.objects.all()):
-        try:
-            mois_str = event.date.strftime('%Y-%m')
-        except Exception:
-            continue
-        if mois_str in evenements_par_mois:
-            evenements_par_mois[mois_str] += 1
-    
-    # Préparer les données pour le graphique
-    donnees_graphique = [evenements_par_mois[m] for m in sorted(evenements_par_mois.keys())]
-    
+
+    # Graphique d'évolution mensuelle : les 12 derniers mois calendaires (fuseau local)
+    debut = timezone.localtime(maintenant).date().replace(day=1)
+    mois_debuts = []
+    for _ in range(12):
+        mois_debuts.append(debut)
+        debut = (debut - timedelta(days=1)).replace(day=1)
+    mois_debuts.reverse()
+    par_mois = dict(
+        EventStat.objects.filter(period=EventStat.PERIOD_MONTH, period_start__gte=mois_debuts[0])
+        .values('period_start').annotate(n=Sum('events')).values_list('period_start', 'n')
+    )
+    mois = [m.strftime('%b %Y') for m in mois_debuts]
+    donnees_graphique = [par_mois.get(m, 0) for m in mois_debuts]
+
     context = {
         'total_utilisateurs': total_utilisateurs,
         'total_evenements': total_evenements,
@@ -1665,5 +1381,5 @@ def statistiques(request):
         'mois': json.dumps(mois),
         'evenements_par_mois': json.dumps(donnees_graphique),
     }
-    
+
     return render(request, 'events/statistiques.html', context)
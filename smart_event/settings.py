@@ -40,6 +40,7 @@ INSTALLED_APPS = [
 
 # === Middleware ===
 MIDDLEWARE = [
+    'events.utils.trace.TraceMiddleware',  # Traces de débogage (retiré de la chaîne si DEBUG_TRACE est faux)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,6 +83,10 @@ DATABASES = {
         'NAME': os.getenv("DB_NAME", BASE_DIR / "db.sqlite3"),
     }
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Les écrivains concurrents attendent le verrou jusqu'à `timeout` secondes ; les réservations
+    # de places prennent ce verrou dès BEGIN (seat_transaction, voir events/utils/capacity.py)
+    DATABASES['default']['OPTIONS'] = {'timeout': int(os.getenv('SQLITE_TIMEOUT', '20'))}
 
 # === Authentification ===
 AUTH_PASSWORD_VALIDATORS = [
@@ -106,15 +111,84 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# === QR codes des invitations ===
+QR_CODE_CACHE_SIZE = int(os.getenv('QR_CODE_CACHE_SIZE', '1024'))  # entrées du cache mémoire
+QR_CODE_DISK_CACHE = os.getenv('QR_CODE_DISK_CACHE', 'False') == 'True'  # cache dans MEDIA_ROOT/qrcodes
+QR_CODE_POOL_WORKERS = int(os.getenv('QR_CODE_POOL_WORKERS', '0')) or None  # None = tous les cœurs
+
 # === Authentification ===
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
 
+# === Cache ===
+# Les sessions et les codes 2FA sont partagés entre les workers gunicorn : cache fichier
+# par défaut (un seul serveur). Avec plusieurs serveurs, pointer ces alias vers un cache partagé.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('SESSION_CACHE_DIR', os.path.join(BASE_DIR, '.cache', 'sessions')),
+    },
+    'two_factor': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('TWO_FACTOR_CACHE_DIR', os.path.join(BASE_DIR, '.cache', 'two_factor')),
+    },
+    # Partagé entre les workers : un seul recalcul de l'instantané admin pour tous
+    'admin_stats': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('ADMIN_STATS_CACHE_DIR', os.path.join(BASE_DIR, '.cache', 'admin_stats')),
+    },
+}
+
+# === Authentification à deux facteurs ===
+TWO_FACTOR_CODE_STORE = os.getenv('TWO_FACTOR_CODE_STORE', 'cache')  # 'cache' ou 'db'
+TWO_FACTOR_CACHE_ALIAS = 'two_factor'
+TWO_FACTOR_CODE_TTL = int(os.getenv('TWO_FACTOR_CODE_TTL', '900'))  # secondes
+# Un code encore valable est réutilisé ; un nouveau code n'est envoyé que sur demande
+# (au plus TWO_FACTOR_SEND_LIMIT par fenêtre, espacés de TWO_FACTOR_RESEND_DEBOUNCE secondes)
+TWO_FACTOR_RESEND_DEBOUNCE = int(os.getenv('TWO_FACTOR_RESEND_DEBOUNCE', '60'))
+TWO_FACTOR_SEND_LIMIT = int(os.getenv('TWO_FACTOR_SEND_LIMIT', '5'))
+TWO_FACTOR_SEND_WINDOW = int(os.getenv('TWO_FACTOR_SEND_WINDOW', '3600'))
+# Au-delà de TWO_FACTOR_VERIFY_LIMIT codes erronés par fenêtre, le code est invalidé (réponse 429)
+TWO_FACTOR_VERIFY_LIMIT = int(os.getenv('TWO_FACTOR_VERIFY_LIMIT', '5'))
+TWO_FACTOR_VERIFY_WINDOW = int(os.getenv('TWO_FACTOR_VERIFY_WINDOW', '900'))
+
 # === Session fix ===
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'  # Ou 'django.contrib.sessions.backends.signed_cookies'
+# Sessions en base lues via le cache 'sessions' ; l'expiration n'est rafraîchie qu'après
+# SESSION_REFRESH_FRACTION de SESSION_COOKIE_AGE (pas d'UPDATE à chaque page vue)
+SESSION_ENGINE = 'events.sessions'
+SESSION_CACHE_ALIAS = 'sessions'
 SESSION_COOKIE_AGE = 1209600  # 2 weeks in seconds
-SESSION_SAVE_EVERY_REQUEST = True
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_REFRESH_FRACTION = float(os.getenv('SESSION_REFRESH_FRACTION', '0.1'))
+
+# === Tableau de bord administrateur (events/utils/admin_stats.py) ===
+# Instantané recalculé au plus toutes les ADMIN_STATS_TTL secondes (ou par `manage.py refresh_admin_stats`),
+# puis servi périmé pendant au plus ADMIN_STATS_STALE_TTL secondes pendant son recalcul
+ADMIN_STATS_CACHE_ALIAS = 'admin_stats'
+ADMIN_STATS_TTL = int(os.getenv('ADMIN_STATS_TTL', '60'))
+ADMIN_STATS_STALE_TTL = int(os.getenv('ADMIN_STATS_STALE_TTL', '3600'))
+
+# === Places retenues pendant le paiement (events/utils/capacity.py) ===
+# Durée (secondes) ; les places expirées sont purgées par `manage.py sweep_seat_holds`
+SEAT_HOLD_TTL = int(os.getenv('SEAT_HOLD_TTL', '600'))
+
+# === Paiements (events/utils/checkout.py) ===
+# 'mock' (passerelle locale, tout débit réussit) ou chemin d'une classe BasePaymentGateway
+PAYMENT_GATEWAY = os.getenv('PAYMENT_GATEWAY', 'mock')
+# Paiement resté « en cours » au-delà de ce délai (secondes) : soldé par `manage.py resolve_stale_checkouts`
+CHECKOUT_PENDING_TIMEOUT = int(os.getenv('CHECKOUT_PENDING_TIMEOUT', '900'))
+
+# === Liens absolus des emails envoyés hors requête (file d'emails) ===
+SITE_URL = os.getenv('SITE_URL', 'http://localhost:8000')
+
+# === Traces de débogage (events/utils/trace.py) ===
+# Désactivées par défaut ; une fois activées, seule une fraction des requêtes est tracée
+DEBUG_TRACE = os.getenv('DEBUG_TRACE', 'False') == 'True'
+DEBUG_TRACE_SAMPLE_RATE = float(os.getenv('DEBUG_TRACE_SAMPLE_RATE', '0.01'))
 
 # Clear existing problematic sessions
 import os
@@ -155,6 +229,16 @@ SERVER_EMAIL = os.getenv('SERVER_EMAIL', EMAIL_HOST_USER)
 # Timeout raisonnable
 EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', '30'))
 
+# File d'attente des emails sortants (commande `process_email_queue`)
+EMAIL_QUEUE_BATCH_SIZE = int(os.getenv('EMAIL_QUEUE_BATCH_SIZE', '50'))
+EMAIL_QUEUE_MAX_ATTEMPTS = int(os.getenv('EMAIL_QUEUE_MAX_ATTEMPTS', '5'))
+EMAIL_QUEUE_BACKOFF_BASE = int(os.getenv('EMAIL_QUEUE_BACKOFF_BASE', '30'))  # secondes
+EMAIL_QUEUE_BACKOFF_MAX = int(os.getenv('EMAIL_QUEUE_BACKOFF_MAX', '3600'))
+# Emails envoyés ou abandonnés supprimés après ce délai (jours) par le worker
+EMAIL_QUEUE_RETENTION_DAYS = int(os.getenv('EMAIL_QUEUE_RETENTION_DAYS', '7'))
+# Nombre de messages envoyés sur une même connexion SMTP avant reconnexion
+EMAIL_BATCH_RECONNECT_EVERY = int(os.getenv('EMAIL_BATCH_RECONNECT_EVERY', '100'))
+
 # Affichage en mode développement (n'affiche pas le mot de passe)
 if DEBUG:
     print('\n' + '='*70)
@@ -221,6 +305,12 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        # Traces échantillonnées par requête (DEBUG_TRACE)
+        'events.trace': {
+            'handlers': ['console', 'file'],
+            'level': os.getenv('DEBUG_TRACE_LEVEL', 'DEBUG'),
+            'propagate': False,
+        },
         # Logger spécifique pour le suivi des emails
         'email_logger': {
             'handlers': ['console', 'file'],
@@ -250,13 +340,12 @@ STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')  # Important pour la collecte
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
-# Ajoutez WhiteNoise pour la gestion des fichiers statiques
-MIDDLEWARE = [
-    # ...
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # Ajoutez cette ligne
-    'django.middleware.security.SecurityMiddleware',
-    # ...
-]
+# Ajoutez WhiteNoise pour la gestion des fichiers statiques (juste après SecurityMiddleware,
+# sans écraser le reste de la liste : sessions, auth et TwoFactorMiddleware en dépendent)
+MIDDLEWARE.insert(
+    MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+)
 
 # Activez la compression pour les fichiers statiques
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
\ No newline at end of file
@@ -4,8 +4,9 @@ from django.conf import settings
 from django.conf.urls.static import static
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    # Avant l'admin : sa route finale (catch_all_view) intercepterait admin/stats/
     path('', include('events.urls')),  # routes de l'app principale
+    path('admin/', admin.site.urls),
 ]
 
 if settings.DEBUG: